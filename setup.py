@@ -40,6 +40,7 @@ setuptools.setup(
         "opencv-python>=4.5.1.48",
         "Appium-Python-Client>=0.40",
         "uiautomator2>=2.10.0",
+        "lxml>=4.6.0",
         "wheel>=0.34.2",
         "pytest>=5.3.5",
         "airtest>=1.1.3",
@@ -14,6 +14,7 @@ from automotive.application.panel.panel import Gui
 from automotive.core.android.android_service import AndroidService
 from automotive.core.android.common.enums import ElementAttributeEnum, SwipeDirectorEnum, DirectorEnum, ToolTypeEnum
 from automotive.core.can.can_service import CANService
+from automotive.core.can.multi_can_service import MultiCANService
 from automotive.core.can.common.enums import CanBoxDeviceEnum, BaudRateEnum
 from automotive.core.can.message import Message
 from automotive.core.can.tools.parser.dbc_parser import DbcParser
@@ -31,6 +32,6 @@ from automotive.utils.excel_utils import ExcelUtils
 __all__ = ["CameraActions", "CanActions", "It6831Actions", "KonstanterActions", "RelayActions", "SerialActions",
            "Curve", "SystemTypeEnum", "ClusterHmi", "HypervisorScreenShot", "AirCondition", "FileTypeEnum",
            "TestCaseGenerator", "Gui", "AndroidService", "ElementAttributeEnum", "SwipeDirectorEnum", "DirectorEnum",
-           "ToolTypeEnum", "CANService", "CanBoxDeviceEnum", "BaudRateEnum", "DbcParser", "ImageCompare",
-           "CompareTypeEnum", "CompareProperty", "logger", "Utils", "SerialPort", "Images", "Player", "Performance",
-           "MicroPhone", "Camera", "Message", "ExcelEnum", "ExcelUtils"]
+           "ToolTypeEnum", "CANService", "MultiCANService", "CanBoxDeviceEnum", "BaudRateEnum", "DbcParser",
+           "ImageCompare", "CompareTypeEnum", "CompareProperty", "logger", "Utils", "SerialPort", "Images", "Player",
+           "Performance", "MicroPhone", "Camera", "Message", "ExcelEnum", "ExcelUtils"]
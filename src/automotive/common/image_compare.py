@@ -7,7 +7,8 @@
 # @Created:     2021/5/1 - 23:57
 # --------------------------------------------------------
 import shutil
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Dict
 
 from .typehints import Position, RGB
 from ..logger.logger import logger
@@ -37,6 +38,8 @@ class CompareProperty(object):
         self.gray: 是否灰度对比
 
         self.gray_threshold: 灰度二值化阈值
+
+        self.results: 对比结果，{模板图片: [[每张截图每个区域是否相同]]}，为None表示没有对比(提前得出结果后取消了)
     """
 
     def __init__(self):
@@ -49,6 +52,7 @@ class CompareProperty(object):
         self.similarity = None
         self.gray = False
         self.gray_threshold = 240
+        self.results = dict()  # type: Dict[str, List[List[Optional[bool]]]]
 
     def set_value(self,
                   name: str,
@@ -80,11 +84,19 @@ class ImageCompare(object):
     由于区域截图并非所有的项目都支持，目前皆不建议进行任何的区域截图对比，虽然区域截图能够提高效率，但是牺牲稳定性并不是自动化测试的方向。
 
     由于allure的需要，提供了将截图图片进行画框处理后另存到其他路径的方法。
+
+    max_workers大于1的时候，每张截图的每个区域(截图, 区域)作为一个任务并行对比(OpenCV的模板匹配会释放GIL)，
+
+    结果已经确定的时候(如闪图找到了一张亮图)取消还没有开始的任务。
     """
 
-    def __init__(self):
+    def __init__(self, max_workers: int = 1):
+        """
+        :param max_workers: 并行对比的线程数量，为1的时候依次对比
+        """
         self.__images = Images()
         self.__utils = Utils()
+        self.max_workers = max_workers
 
     def __compare_image_area(self,
                              template_image: str,
@@ -122,54 +134,40 @@ class ImageCompare(object):
         template_position = self.__images.convert_position(x, y, width=width, height=height)
         target_position = self.__images.convert_position(0, 0, width=width,
                                                          height=height) if is_area else template_position
-        # 先按照air test方式对比
+        # 按照air test方式对比，图片只在第一次使用的时候解码(见Images的缓存)
         result = self.__images.find_best_result_by_position(template_image, target_image, template_position,
                                                             target_position, threshold=float(similarity / 100),
                                                             rgb=True)
-        # 像素对比，暂时没有用
-        result1 = self.__images.compare_by_matrix_in_same_area(template_image, target_image, template_position,
-                                                               target_position, gray=gray, threshold=threshold)
-        matrix_result = result1[0] >= similarity
-        logger.debug(f"matrix compare result is {matrix_result}")
         return result is not None
 
-    def __compare_image(self,
-                        template_image: str,
-                        target_image: str,
-                        positions: List[Position],
-                        gray: bool,
-                        threshold: int,
-                        similarity: float,
-                        is_area) -> bool:
+    @staticmethod
+    def __decide(image_results: List[Optional[bool]], light_or_dark: bool, is_break: bool) -> Optional[bool]:
         """
-        对比图片的多个区域
+        根据已经确定的每张截图的结果判断整体结果是否已经确定
 
-        :param template_image: 要比较的图片（原图中的LIGHT或者DARK)
+        :param image_results: 每张截图是否相同，None表示还没有确定
 
-        :param target_image: 截图图片
-
-        :param positions: 对比区域
-
-        :param gray: 是否灰度对比
-
-        :param threshold: 灰度对比阈值
+        :param light_or_dark: True表示需要找到相同的图片，False表示不能有相同的图片
 
-        :param similarity: 相似度（百分比)
-
-        :param is_area: target_image是否是区域截图的产物（区域截图对比方式和全图截图对比方式不同)
-
-        :return:
-            True: 大于阈值
+        :param is_break: 是否找到一张图片相同就退出
 
-            False: 小于阈值
+        :return: 整体结果，None表示还没有确定
         """
-        count = 0
-        if len(positions) == 0:
-            return False
-        for position in positions:
-            if self.__compare_image_area(template_image, target_image, position, gray, threshold, similarity, is_area):
-                count += 1
-        return count == len(positions)
+        if light_or_dark and is_break:
+            # 找到一张相同的图片即可
+            if True in image_results:
+                return True
+        elif light_or_dark:
+            # 所有的图片都需要相同
+            if False in image_results:
+                return False
+        else:
+            # 有一张图片对比相同，则表示对比有问题
+            if True in image_results:
+                return False
+        if None in image_results:
+            return None
+        return not (light_or_dark and is_break)
 
     def __compare_images(self,
                          template_image: str,
@@ -180,9 +178,10 @@ class ImageCompare(object):
                          similarity: float,
                          light_or_dark: bool = True,
                          is_break: bool = False,
-                         is_area: bool = False):
+                         is_area: bool = False,
+                         results: Optional[Dict[str, List[List[Optional[bool]]]]] = None):
         """
-        对比多张图片的单个区域或者多个区域
+        对比多张图片的单个区域或者多个区域，一张截图的所有区域都相同才表示该截图相同
 
         :param template_image: 要比较的图片（原图中的LIGHT或者DARK)
 
@@ -196,32 +195,80 @@ class ImageCompare(object):
 
         :param similarity: 相似度（百分比)
 
+        :param light_or_dark: True表示截图需要相同，False表示截图都不能相同
+
         :param is_area: 是否区域对比
 
         :param is_break: 是否找到一张图片相同就退出
 
+        :param results: 保存每张截图每个区域的对比结果
+
         :return:
             True: 相同
 
             False: 不同
         """
-        count = 0
-        if len(target_images) == 0:
+        if len(target_images) == 0 or len(positions) == 0:
             return False
-        for image in target_images:
-            logger.debug(f"now compare template_image[{template_image}] and target_image [{image}]")
-            if self.__compare_image(template_image, image, positions, gray, threshold, similarity, is_area):
-                if light_or_dark:
-                    if is_break:
-                        logger.debug(f"break compare and return True")
-                        return True
-                    else:
-                        logger.debug(f"compare success")
-                        count += 1
+        matrix = [[None] * len(positions) for _ in target_images]
+        if results is not None:
+            results[template_image] = matrix
+        image_results = [None] * len(target_images)  # type: List[Optional[bool]]
+        remaining = [len(positions)] * len(target_images)
+
+        def update(image_index: int, position_index: int, same: bool) -> Optional[bool]:
+            matrix[image_index][position_index] = same
+            if image_results[image_index] is None:
+                if not same:
+                    image_results[image_index] = False
                 else:
-                    # 有一张图片对比相同，则表示对比有问题
-                    return False
-        return count == len(target_images)
+                    remaining[image_index] -= 1
+                    if remaining[image_index] == 0:
+                        image_results[image_index] = True
+                        logger.debug(f"template_image[{template_image}] is same as [{target_images[image_index]}]")
+            return self.__decide(image_results, light_or_dark, is_break)
+
+        if self.max_workers <= 1:
+            for i, image in enumerate(target_images):
+                logger.debug(f"now compare template_image[{template_image}] and target_image [{image}]")
+                for j, position in enumerate(positions):
+                    # 有一个区域不同的时候不需要再对比剩下的区域
+                    if image_results[i] is not None:
+                        break
+                    same = self.__compare_image_area(template_image, image, position, gray, threshold, similarity,
+                                                     is_area)
+                    result = update(i, j, same)
+                    if result is not None:
+                        logger.debug(f"compare result is {result}")
+                        return result
+            return self.__decide(image_results, light_or_dark, is_break)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = dict()
+            image_futures = [[] for _ in target_images]
+            for i, image in enumerate(target_images):
+                for j, position in enumerate(positions):
+                    future = executor.submit(self.__compare_image_area, template_image, image, position, gray,
+                                             threshold, similarity, is_area)
+                    futures[future] = i, j
+                    image_futures[i].append(future)
+            try:
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    i, j = futures[future]
+                    result = update(i, j, future.result())
+                    if result is not None:
+                        logger.debug(f"compare result is {result}")
+                        return result
+                    if image_results[i] is not None:
+                        # 该截图已经确定，取消剩下的区域
+                        for item in image_futures[i]:
+                            item.cancel()
+            finally:
+                # 结果确定后取消还没有开始的任务，正在对比的任务完成后退出
+                for future in futures:
+                    future.cancel()
+        return self.__decide(image_results, light_or_dark, is_break)
 
     def __compare_normal(self, compare_property: CompareProperty) -> bool:
         """
@@ -249,7 +296,7 @@ class ImageCompare(object):
         light_or_dark = (compare_property.type == CompareTypeEnum.LIGHT)
         return self.__compare_images(template_image=light_template, target_images=screen_shot_images,
                                      positions=positions, gray=gray, threshold=threshold, similarity=similarity,
-                                     light_or_dark=light_or_dark)
+                                     light_or_dark=light_or_dark, results=compare_property.results)
 
     def __compare_dark(self, compare_property: CompareProperty) -> bool:
         """
@@ -274,7 +321,8 @@ class ImageCompare(object):
         similarity = compare_property.similarity
         logger.debug(f"similarity is {similarity}")
         logger.trace("compare dark template file")
-        return self.__compare_images(dark_template, screen_shot_images, positions, gray, threshold, similarity)
+        return self.__compare_images(dark_template, screen_shot_images, positions, gray, threshold, similarity,
+                                     results=compare_property.results)
 
     def __compare_blink(self, compare_property: CompareProperty) -> bool:
         """
@@ -296,12 +344,12 @@ class ImageCompare(object):
         similarity = compare_property.similarity
         # 先比较亮图
         light = self.__compare_images(light_template, screen_shot_images, positions, gray, threshold, similarity,
-                                      is_break=True)
+                                      is_break=True, results=compare_property.results)
         # 亮图是否找到
         if light:
             # 找暗图
             return self.__compare_images(dark_template, screen_shot_images, positions, gray, threshold, similarity,
-                                         is_break=True)
+                                         is_break=True, results=compare_property.results)
         else:
             return False
 
@@ -311,8 +359,9 @@ class ImageCompare(object):
 
         :param compare_property: 图像对比参数
 
-        :return: 成功/失败
+        :return: 成功/失败，每张截图每个区域的对比结果保存在compare_property.results中
         """
+        compare_property.results = dict()
         if compare_property.type == CompareTypeEnum.BLINK:
             return self.__compare_blink(compare_property)
         else:
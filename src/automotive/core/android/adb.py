@@ -9,21 +9,209 @@
 import os
 import platform
 import subprocess as sp
-from time import sleep
-from typing import List, Tuple, Optional
-
-from automotive.logger.logger import logger
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import sleep, time
+from typing import List, Tuple, Optional, Dict, Sequence
+from uuid import uuid4
+
+from automotive.logger.logger import logger, is_enabled
 from .common.enums import KeyCodeEnum
 
 
+class AdbShell(object):
+    """
+    常驻的adb shell会话
+
+    只启动一次adb shell进程，命令通过stdin写入，每条命令后面输出一个唯一的结束标记(包含命令的返回值)，
+
+    读取到结束标记的时候表示命令执行完成，不需要每次都启动adb进程，也不需要固定的等待时间。
+
+    命令的返回值只包含标准输出，标准错误由单独的线程读取并写入日志
+
+    注意: 命令不能是需要交互的命令(如不带参数的sh、top)，也不能包含未闭合的引号或者heredoc
+    """
+
+    def __init__(self, device_id: Optional[str] = None):
+        """
+        :param device_id: 设备编号，为空的时候使用adb默认的设备
+        """
+        self.device_id = device_id
+        self.__sentinel = f"__AUTOMOTIVE_{uuid4().hex}__"
+        command = ["adb", "-s", device_id, "shell"] if device_id else ["adb", "shell"]
+        logger.debug(f"start adb shell session [{' '.join(command)}]")
+        self.__process = sp.Popen(command, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+        self.__lines = Queue()
+        self.__lock = Lock()
+        # 最后一条命令的返回值
+        self.exit_code = None  # type: Optional[int]
+        Thread(target=self.__read, daemon=True).start()
+        Thread(target=self.__read_error, daemon=True).start()
+
+    def __read(self):
+        """
+        读取线程，把adb shell的输出按行放到队列中，进程结束的时候放入None
+        """
+        for line in iter(self.__process.stdout.readline, b""):
+            self.__lines.put(line.decode("utf-8", errors="replace").rstrip("\r\n"))
+        self.__lines.put(None)
+
+    def __read_error(self):
+        """
+        读取线程，把adb shell的标准错误写入日志，不混入命令的输出
+        """
+        for line in iter(self.__process.stderr.readline, b""):
+            logger.debug(f"adb shell of device[{self.device_id}] stderr: "
+                         f"{line.decode('utf-8', errors='replace').rstrip()}")
+
+    @property
+    def is_alive(self) -> bool:
+        return self.__process.poll() is None
+
+    def __read_until_sentinel(self, end_time: Optional[float]) -> List[str]:
+        """
+        读取一条命令的输出，直到读取到结束标记
+
+        :param end_time: 超时的时间点，为空表示不超时
+
+        :return: 输出的每一行
+        """
+        lines = []
+        while True:
+            timeout = None if end_time is None else max(end_time - time(), 0)
+            try:
+                line = self.__lines.get(timeout=timeout)
+            except Empty:
+                self.close()
+                raise TimeoutError(f"adb shell command not finished in time")
+            if line is None:
+                raise RuntimeError(f"adb shell session of device[{self.device_id}] exited")
+            position = line.find(self.__sentinel)
+            if position < 0:
+                lines.append(line)
+            else:
+                # 命令的输出最后没有换行的时候，结束标记会和输出在同一行
+                if position > 0:
+                    lines.append(line[:position])
+                code = line[position + len(self.__sentinel):]
+                self.exit_code = int(code) if code.isdigit() else None
+                return lines
+
+    def execute_batch(self, commands: Sequence[str], timeout: Optional[float] = 30) -> List[List[str]]:
+        """
+        一次写入多条命令，所有命令执行完成后返回(只需要一次往返)
+
+        :param commands: shell命令列表(不需要adb shell前缀)
+
+        :param timeout: 所有命令执行完成的超时时间(秒)，为空表示不超时，超时后会关闭会话
+
+        :return: 每条命令的输出
+        """
+        if not commands:
+            return []
+        script = "".join(f"{command}\necho \"{self.__sentinel}$?\"\n" for command in commands)
+        end_time = None if timeout is None else time() + timeout
+        with self.__lock:
+            if is_enabled("debug"):
+                logger.debug(f"execute shell commands {list(commands)}")
+            self.__process.stdin.write(script.encode("utf-8"))
+            self.__process.stdin.flush()
+            return [self.__read_until_sentinel(end_time) for _ in commands]
+
+    def execute(self, command: str, timeout: Optional[float] = 30) -> List[str]:
+        """
+        执行一条命令，命令执行完成后返回
+
+        :param command: shell命令(不需要adb shell前缀)
+
+        :param timeout: 超时时间(秒)，为空表示不超时，超时后会关闭会话
+
+        :return: 命令的输出
+        """
+        return self.execute_batch([command], timeout)[0]
+
+    def close(self):
+        """
+        关闭会话
+        """
+        if self.is_alive:
+            try:
+                self.__process.stdin.close()
+                self.__process.wait(1)
+            except (OSError, sp.TimeoutExpired):
+                self.__process.kill()
+
+
 class ADB(object):
     """
     Android ADB相关的命令python化， 对于实际的测试活动中，更多的使用了click/screen_shot两个操作
+
+    adb shell命令通过每个设备一个的常驻会话执行(见AdbShell)，其他命令(如push/pull/install)每次启动adb进程
     """
+    # 每个设备的常驻会话，所有ADB对象共用
+    __shells = dict()  # type: Dict[Optional[str], AdbShell]
+    __shells_lock = Lock()
+    # 并行拉取/推送文件的最大数量
+    _max_transfer_workers = 4
 
     def command(self, command: str, device_id: Optional[str] = None):
         return  self.__adb_command(command=command,device_id=device_id)
 
+    def __get_shell(self, device_id: Optional[str]) -> AdbShell:
+        """
+        获取设备的常驻会话，会话不存在或者已经退出的时候重新启动
+        """
+        with self.__shells_lock:
+            shell = self.__shells.get(device_id)
+            if shell is None or not shell.is_alive:
+                shell = AdbShell(device_id)
+                self.__shells[device_id] = shell
+            return shell
+
+    def shell(self, command: str, device_id: Optional[str] = None, timeout: Optional[float] = 30) -> List[str]:
+        """
+        在设备的常驻会话中执行shell命令
+
+        :param command: shell命令，如 input tap 100 200
+
+        :param device_id: 设备编号
+
+        :param timeout: 超时时间(秒)
+
+        :return: 命令的输出
+        """
+        return self.__get_shell(device_id).execute(command, timeout)
+
+    def batch(self, commands: Sequence[str], device_id: Optional[str] = None,
+              timeout: Optional[float] = 30) -> List[List[str]]:
+        """
+        在设备的常驻会话中一次执行多条shell命令(只需要一次往返)
+
+        :param commands: shell命令列表
+
+        :param device_id: 设备编号
+
+        :param timeout: 所有命令执行完成的超时时间(秒)
+
+        :return: 每条命令的输出
+        """
+        return self.__get_shell(device_id).execute_batch(commands, timeout)
+
+    def close_shell(self, device_id: Optional[str] = None, all_devices: bool = True):
+        """
+        关闭常驻会话
+
+        :param device_id: 设备编号
+
+        :param all_devices: 是否关闭所有设备的会话，为False的时候只关闭device_id的会话
+        """
+        with self.__shells_lock:
+            keys = list(self.__shells) if all_devices else [device_id]
+            shells = [self.__shells.pop(key) for key in keys if key in self.__shells]
+        for shell in shells:
+            shell.close()
+
     @staticmethod
     def __execute(command: str) -> List[str]:
         logger.debug(f"execute command [{command}]")
@@ -40,6 +228,9 @@ class ADB(object):
         if command[:3] == "adb":
             command = command[4:]
             # command = command.split("adb")[1]
+        if command[:6] == "shell ":
+            # 原有的adb shell命令没有超时时间(如monkey、am instrument -w)，只有shell/batch默认有超时时间
+            return self.shell(command[6:], device_id, timeout=None)
         if device_id:
             return self.__execute(f"adb -s {device_id} {command}")
         else:
@@ -55,6 +246,7 @@ class ADB(object):
         """
         断开所有的ADB连接
         """
+        self.close_shell()
         self.__execute("adb disconnect")
 
     def start_server(self):
@@ -67,6 +259,7 @@ class ADB(object):
         """
         杀掉ADB服务
         """
+        self.close_shell()
         self.__execute("adb kill-server")
 
     def version(self) -> List[str]:
@@ -79,6 +272,8 @@ class ADB(object):
         """
         ADB ROOT
         """
+        # root后adbd会重启，原有的会话失效
+        self.close_shell()
         self.__execute("adb root")
 
     def push(self, local: str, remote: str, device_id: Optional[str] = None):
@@ -115,9 +310,21 @@ class ADB(object):
         """
         self.__adb_command(f"shell rm {remote}", device_id)
 
+    def __transfer(self, function, items: Sequence[Tuple[str, str]], device_id: Optional[str]):
+        """
+        并行传输文件，所有文件传输完成后返回，任意一个失败时抛出异常
+        """
+        if not items:
+            return
+        workers = min(len(items), self._max_transfer_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(function, source, target, device_id) for source, target in items]
+            for future in futures:
+                future.result()
+
     def pull_files(self, files: List[str], local: str, device_id: Optional[str] = None):
         """
-        拉取所有文件到本地电脑
+        并行拉取所有文件到本地电脑，所有文件拉取完成后返回
 
         :param files: 文件列表
 
@@ -125,16 +332,29 @@ class ADB(object):
 
         :param device_id: 设备编号
         """
-        for file in files:
-            self.pull(file, local, device_id)
-            sleep(1)
-        sleep(1)
+        self.__transfer(self.pull, [(file, local) for file in files], device_id)
+
+    def push_files(self, files: List[str], remote: str, device_id: Optional[str] = None):
+        """
+        并行推送所有文件到设备，所有文件推送完成后返回
+
+        :param files: 本地文件列表
+
+        :param remote:  远程文件夹
+
+        :param device_id: 设备编号
+        """
+        self.__transfer(self.push, [(file, remote) for file in files], device_id)
 
     def remove_files(self, files: List[str], device_id: Optional[str] = None):
-        for file in files:
-            self.remove(file, device_id)
-            sleep(1)
-        sleep(1)
+        """
+        删除多个源文件(只需要一次往返)
+
+        :param files: 远程文件列表
+
+        :param device_id: 设备编号
+        """
+        self.batch([f"rm {file}" for file in files], device_id)
 
     def input_text(self, text: str, device_id: Optional[str] = None):
         """
@@ -145,7 +365,6 @@ class ADB(object):
         :param device_id:  设备编号
         """
         self.__adb_command(f"shell input {text}", device_id)
-        sleep(0.1)
 
     def click(self, x: int, y: int, display_id: Optional[int] = None, device_id: Optional[str] = None):
         """
@@ -169,11 +388,19 @@ class ADB(object):
                         f"{sendevent} {device} 0 0 0",
                         f"{sendevent} {device} 1 330 0",
                         f"{sendevent} {device} 0 0 0"]
-            for cmd in commands:
-                self.__adb_command(cmd, device_id)
+            self.batch(commands, device_id)
         else:
             self.__adb_command(f"shell input tap {x} {y}", device_id)
-        sleep(0.1)
+
+    def clicks(self, points: Sequence[Tuple[int, int]], device_id: Optional[str] = None):
+        """
+        利用adb命令依次点击多个坐标，所有点击在一次往返中完成
+
+        :param points: 坐标点列表[(x, y)]
+
+        :param device_id: 设备编号
+        """
+        self.batch([f"input tap {x} {y}" for x, y in points], device_id)
 
     def press_key(self, key_code: KeyCodeEnum, device_id: Optional[str] = None):
         """
@@ -184,7 +411,6 @@ class ADB(object):
         :param device_id:  device id
         """
         self.__adb_command(f"shell input keyevent {key_code.value}", device_id)
-        sleep(0.1)
 
     def screen_cap(self, file_name: str, android_folder: str = "sdcard", device_id: Optional[str] = None):
         """
@@ -207,8 +433,8 @@ class ADB(object):
                 image_name = f"{image_name}.jpg"
         remote_path = f"/{android_folder}/{image_name}"
         logger.info(f"remote_path is {remote_path}")
+        # 会话中的命令执行完成才返回，截图文件已经生成
         self.__adb_command(f"shell screencap -p {remote_path}", device_id)
-        sleep(1)
         logger.info(f"file{image_name} will be pull in {folder}")
         self.pull(remote_path, folder, device_id)
 
@@ -6,12 +6,13 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:48
 # --------------------------------------------------------
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Sequence, Dict, Any
 
 from appium.webdriver.common.touch_action import TouchAction
 from selenium.common.exceptions import NoSuchElementException
 
 from .common.enums import SwipeDirectorEnum, ElementAttributeEnum, ToolTypeEnum
+from .common.hierarchy import HierarchySnapshot, HierarchyNode
 from .common.typehints import Capability, Driver, LocatorElement, Locator, Element, Attributes, ClickPosition
 from .uiautomator2_client import UiAutomator2Client
 from .appium_client import AppiumClient
@@ -1360,6 +1361,45 @@ class AndroidService(metaclass=Singleton):
         """
         return self.__client.get_xml_struct()
 
+    def get_snapshot(self) -> HierarchySnapshot:
+        """
+        获取界面结构快照(仅支持uiautomator2)，一次获取后多个定位符和元素属性都在本地读取
+
+        :return: 界面结构快照
+        """
+        if self.__type != ToolTypeEnum.UIAUTOMATOR2:
+            raise TypeError(f"snapshot only support uiautomator2")
+        return self.__client.get_snapshot()
+
+    def find_nodes(self, locator: Locator, parent: Optional[Union[LocatorElement, HierarchyNode]] = None,
+                   timeout: float = _DEFAULT_TIME_OUT) -> List[HierarchyNode]:
+        """
+        在界面结构快照中查找元素(仅支持uiautomator2)，找到的元素可以直接用于点击等操作
+
+        :param locator: 定位符，支持UiSelector的写法以及xpath
+
+        :param parent: 父元素，为空的时候在整个界面中查找
+
+        :param timeout: 超时时间， 默认3秒
+
+        :return: 快照中的元素列表
+        """
+        if self.__type != ToolTypeEnum.UIAUTOMATOR2:
+            raise TypeError(f"snapshot only support uiautomator2")
+        return self.__client.find_nodes(locator=locator, parent=parent, timeout=timeout)
+
+    def get_elements_info(self, locators: Sequence[Locator]) -> List[Optional[Dict[str, Any]]]:
+        """
+        从同一个界面结构快照中获取多个元素的信息(仅支持uiautomator2)
+
+        :param locators: 定位符列表
+
+        :return: 元素信息列表，找不到的元素为None
+        """
+        if self.__type != ToolTypeEnum.UIAUTOMATOR2:
+            raise TypeError(f"snapshot only support uiautomator2")
+        return self.__client.get_elements_info(locators=locators)
+
     def exist(self, locator: LocatorElement, timeout: float = _DEFAULT_TIME_OUT) -> bool:
         """
         元素是否存在
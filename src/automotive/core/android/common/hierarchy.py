@@ -0,0 +1,318 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        hierarchy.py
+# @Author:      lizhe
+# @Created:     2022/3/28 - 21:06
+# --------------------------------------------------------
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Any
+
+from lxml import etree
+
+from automotive.common.typehints import Position
+from .constants import UISELECTORS, LOWER_UISELECTORS
+from .typehints import Locator
+
+"""
+界面结构快照
+
+一次性获取界面的结构(uiautomator2的dump_hierarchy)，在本地用lxml解析，多个定位符以及元素的属性都从同一个快照中获取，
+
+不需要每个元素、每个属性都向设备发送一次请求。定位符(UiSelector的写法或者xpath)编译成XPath后缓存，相同写法的定位符只编译一次。
+"""
+
+# 正则表达式的命名空间(EXSLT)
+_namespaces = {"re": "http://exslt.org/regular-expressions"}
+# UiSelector的定位方式对应的节点属性和比较方式
+_selector_attributes = {
+    "text": ("text", "equal"),
+    "textContains": ("text", "contains"),
+    "textMatches": ("text", "matches"),
+    "textStartsWith": ("text", "starts"),
+    "className": ("class", "equal"),
+    "classNameMatches": ("class", "matches"),
+    "description": ("content-desc", "equal"),
+    "descriptionContains": ("content-desc", "contains"),
+    "descriptionMatches": ("content-desc", "matches"),
+    "descriptionStartsWith": ("content-desc", "starts"),
+    "checkable": ("checkable", "equal"),
+    "checked": ("checked", "equal"),
+    "clickable": ("clickable", "equal"),
+    "longClickable": ("long-clickable", "equal"),
+    "scrollable": ("scrollable", "equal"),
+    "enabled": ("enabled", "equal"),
+    "focusable": ("focusable", "equal"),
+    "focused": ("focused", "equal"),
+    "selected": ("selected", "equal"),
+    "packageName": ("package", "equal"),
+    "packageNameMatches": ("package", "matches"),
+    "resourceId": ("resource-id", "equal"),
+    "resourceIdMatches": ("resource-id", "matches"),
+    "index": ("index", "equal"),
+}
+_conditions = {
+    "equal": "@{attribute}=${variable}",
+    "contains": "contains(@{attribute}, ${variable})",
+    "starts": "starts-with(@{attribute}, ${variable})",
+    "matches": "re:test(@{attribute}, ${variable})",
+}
+# 元素信息中的布尔属性，和UiObject.info的名字一致
+_boolean_attributes = {
+    "checkable": "checkable",
+    "checked": "checked",
+    "clickable": "clickable",
+    "enabled": "enabled",
+    "focusable": "focusable",
+    "focused": "focused",
+    "longClickable": "long-clickable",
+    "scrollable": "scrollable",
+    "selected": "selected",
+}
+_bounds_pattern = re.compile(r"\[(-?\d+),(-?\d+)]\[(-?\d+),(-?\d+)]")
+
+
+@lru_cache(maxsize=256)
+def __compile_selector(keys: Tuple[str, ...]) -> etree.XPath:
+    """
+    把UiSelector的定位方式编译成XPath，定位的值通过变量传入，所以只按照定位方式缓存
+    """
+    conditions = []
+    for index, key in enumerate(keys):
+        attribute, compare = _selector_attributes[key]
+        conditions.append(_conditions[compare].format(attribute=attribute, variable=f"v{index}"))
+    expression = ".//node" + (f"[{' and '.join(conditions)}]" if conditions else "")
+    return etree.XPath(expression, namespaces=_namespaces)
+
+
+@lru_cache(maxsize=256)
+def __compile_xpath(expression: str) -> etree.XPath:
+    """
+    编译xpath定位符
+    """
+    return etree.XPath(expression, namespaces=_namespaces)
+
+
+def __to_value(key: str, value: Any) -> str:
+    """
+    把定位的值转换成节点中的属性值
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if _selector_attributes[key][1] == "matches":
+        # UiSelector的Matches需要完整匹配
+        return f"^(?:{value})$"
+    return str(value)
+
+
+def compile_locator(locator: Locator) -> Tuple[etree.XPath, Dict[str, str], Optional[int]]:
+    """
+    把定位符编译成XPath
+
+    :param locator: 定位符，支持UiSelector的写法(不区分大小写)以及xpath
+
+    :return: (XPath, 变量, instance)，没有instance的时候为None
+    """
+    if isinstance(locator, str):
+        locator = {"text": locator}
+    items = dict()
+    instance = None
+    xpath = None
+    for key, value in locator.items():
+        lower_key = key.lower().replace("-", "")
+        if lower_key == "xpath":
+            xpath = value
+        elif lower_key == "instance":
+            instance = int(value)
+        elif lower_key in LOWER_UISELECTORS:
+            items[UISELECTORS[LOWER_UISELECTORS.index(lower_key)]] = value
+        else:
+            raise KeyError(f"key [{key}] is not support, only support {UISELECTORS} and xpath")
+    if xpath is not None:
+        if items:
+            raise KeyError(f"xpath can not be used with {list(items)}")
+        return __compile_xpath(xpath), dict(), instance
+    keys = tuple(sorted(items))
+    variables = dict((f"v{index}", __to_value(key, items[key])) for index, key in enumerate(keys))
+    return __compile_selector(keys), variables, instance
+
+
+class HierarchyNode(object):
+    """
+    快照中的一个元素，属性的读取方式和UiObject一致(info、get_text)，读取的时候不需要访问设备
+    """
+    __slots__ = ("element", "snapshot", "__bounds")
+
+    def __init__(self, element: etree._Element, snapshot: "HierarchySnapshot"):
+        self.element = element
+        # 元素所在的快照
+        self.snapshot = snapshot
+        self.__bounds = None  # type: Optional[Tuple[int, int, int, int]]
+
+    def __eq__(self, other):
+        return isinstance(other, HierarchyNode) and self.element is other.element
+
+    def __hash__(self):
+        return hash(self.element)
+
+    def __repr__(self):
+        return f"HierarchyNode(class={self.class_name}, text={self.text}, resource_id={self.resource_id})"
+
+    def attribute(self, name: str) -> str:
+        """
+        获取节点中的属性值(原始字符串)
+
+        :param name: 节点中的属性名，如resource-id
+        """
+        return self.element.get(name, "")
+
+    @property
+    def text(self) -> str:
+        return self.attribute("text")
+
+    @property
+    def class_name(self) -> str:
+        return self.attribute("class")
+
+    @property
+    def resource_id(self) -> str:
+        return self.attribute("resource-id")
+
+    @property
+    def description(self) -> str:
+        return self.attribute("content-desc")
+
+    @property
+    def package(self) -> str:
+        return self.attribute("package")
+
+    @property
+    def bounds(self) -> Tuple[int, int, int, int]:
+        """
+        元素的范围(left, top, right, bottom)
+        """
+        if self.__bounds is None:
+            match = _bounds_pattern.match(self.attribute("bounds"))
+            self.__bounds = tuple(map(int, match.groups())) if match else (0, 0, 0, 0)
+        return self.__bounds
+
+    @property
+    def location(self) -> Position:
+        """
+        元素的位置(x, y, width, height)
+        """
+        left, top, right, bottom = self.bounds
+        return left, top, right - left, bottom - top
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        """
+        和UiObject.info相同格式的元素信息
+        """
+        left, top, right, bottom = self.bounds
+        info = {
+            "bounds": {"left": left, "top": top, "right": right, "bottom": bottom},
+            "childCount": len(self.element),
+            "className": self.class_name,
+            "contentDescription": self.description,
+            "packageName": self.package,
+            "resourceName": self.resource_id,
+            "text": self.text,
+            "visibleBounds": {"left": left, "top": top, "right": right, "bottom": bottom},
+        }
+        for key, name in _boolean_attributes.items():
+            info[key] = self.attribute(name) == "true"
+        return info
+
+    def get_text(self) -> str:
+        return self.text
+
+    def get_descendant_text(self, class_pattern: str = ".*Text.*") -> str:
+        """
+        获取第一个类名匹配的子元素的文本，找不到的时候返回空字符串
+
+        :param class_pattern: 类名的正则表达式
+        """
+        pattern = re.compile(class_pattern)
+        for element in self.element.iterdescendants("node"):
+            if pattern.fullmatch(element.get("class", "")):
+                return element.get("text", "")
+        return ""
+
+
+class HierarchySnapshot(object):
+    """
+    界面结构快照，从dump_hierarchy获取的xml中查找元素
+    """
+
+    def __init__(self, xml: str):
+        """
+        :param xml: 界面结构(dump_hierarchy的返回值)
+        """
+        self.__root = etree.fromstring(xml.encode("utf-8") if isinstance(xml, str) else xml)
+        # 节点对象缓存，保证同一个节点多次查找得到的是同一个对象
+        self.__nodes = dict()  # type: Dict[etree._Element, HierarchyNode]
+
+    @property
+    def root(self) -> etree._Element:
+        return self.__root
+
+    def __get_node(self, element: etree._Element) -> HierarchyNode:
+        node = self.__nodes.get(element)
+        if node is None:
+            node = HierarchyNode(element, self)
+            self.__nodes[element] = node
+        return node
+
+    def find(self, locator: Locator, parent: Optional[HierarchyNode] = None) -> List[HierarchyNode]:
+        """
+        查找所有符合定位符的元素，按照界面结构的顺序
+
+        :param locator: 定位符
+
+        :param parent: 父元素，为空的时候在整个界面中查找
+
+        :return: 元素列表，定位符中有instance的时候最多只有一个元素
+        """
+        xpath, variables, instance = compile_locator(locator)
+        context = self.__root if parent is None else parent.element
+        elements = [element for element in xpath(context, **variables) if isinstance(element, etree._Element)]
+        if instance is not None:
+            elements = elements[instance:instance + 1]
+        return [self.__get_node(element) for element in elements]
+
+    def find_one(self, locator: Locator, parent: Optional[HierarchyNode] = None) -> Optional[HierarchyNode]:
+        """
+        查找第一个符合定位符的元素
+
+        :param locator: 定位符
+
+        :param parent: 父元素，为空的时候在整个界面中查找
+
+        :return: 元素，找不到的时候返回None
+        """
+        nodes = self.find(locator, parent)
+        return nodes[0] if nodes else None
+
+    def exists(self, locator: Locator, parent: Optional[HierarchyNode] = None) -> bool:
+        return self.find_one(locator, parent) is not None
+
+    def get_selector(self, node: HierarchyNode) -> Dict[str, Any]:
+        """
+        获取能够在设备上唯一定位该元素的UiSelector参数(根据类名、资源ID、文本、描述以及instance)
+
+        :param node: 快照中的元素
+
+        :return: UiSelector参数，如driver(**selector)
+        """
+        selector = {"className": node.class_name, "packageName": node.package}
+        for key, value in (("resourceId", node.resource_id), ("text", node.text), ("description", node.description)):
+            if value:
+                selector[key] = value
+        nodes = self.find(selector)
+        instance = nodes.index(node)
+        if instance > 0:
+            selector["instance"] = instance
+        return selector
@@ -19,9 +19,10 @@ from uiautomator2 import UiObject
 
 from automotive.common.typehints import Position
 from .constants import DEFAULT_TIME_OUT, LOWER_LOCATORS, LOCATORS, LOWER_UISELECTORS, UISELECTORS
+from .hierarchy import HierarchyNode
 from .typehints import Capability, Driver, Element, LocatorElement, Locator, Attributes, SwipeParam, ClickPosition
 from ..common.enums import DirectorEnum, SwipeDirectorEnum, ElementAttributeEnum
-from automotive.logger.logger import logger
+from automotive.logger.logger import logger, is_enabled
 
 
 class BaseAndroid(metaclass=ABCMeta):
@@ -946,6 +947,9 @@ class BaseAndroid(metaclass=ABCMeta):
         :return: 文本内容
         """
         locator = {"classNameMatches": ".*Text.*"}
+        if isinstance(element, HierarchyNode):
+            # 快照中的元素直接在本地读取，不需要访问设备
+            return element.text or element.get_descendant_text(locator["classNameMatches"])
         if not isinstance(element, (WebElement, UiObject)):
             raise TypeError(f"element{type(element)} is not support, only support WebElement, UiObject")
         if isinstance(element, WebElement):
@@ -989,6 +993,30 @@ class BaseAndroid(metaclass=ABCMeta):
                     return element
         raise NoSuchElementException(f"can not found [{text}] when swipe scroll element")
 
+    def _get_scroll_elements(self, swipe_element: Element, locator: Locator, timeout: float) -> List[Element]:
+        """
+        滑动查找时获取当前页面中的所有元素，默认逐个元素查找，子类可以从界面结构快照中一次性获取
+
+        :param swipe_element: 可滑动的元素
+
+        :param locator: 定位符
+
+        :param timeout: 超时时间
+
+        :return: 元素列表
+        """
+        return self.get_child_elements(swipe_element, locator, timeout)
+
+    def _to_element(self, element: Element) -> Element:
+        """
+        把滑动查找到的元素转换成可以操作的元素，默认不转换
+
+        :param element: 查找到的元素
+
+        :return: 可以操作的元素
+        """
+        return element
+
     def _scroll_element(self,
                         start_x: int,
                         start_y: int,
@@ -1059,13 +1087,13 @@ class BaseAndroid(metaclass=ABCMeta):
         start_time = time.time()
         swipe_time_out = 5 * 60
         if not swipe_time:
-            elements = self.get_child_elements(swipe_element, locator, timeout)
+            elements = self._get_scroll_elements(swipe_element, locator, timeout)
             # 获取当前页面最后一个元素的文本内容（可能是子元素的文本)
             last_element_text = self.__get_last_element_text(elements, direct, timeout)
             logger.debug(f"current edge text = {last_element_text}")
             if text:
                 try:
-                    return self._find_text_in_elements(elements, text, exact_match, timeout)
+                    return self._to_element(self._find_text_in_elements(elements, text, exact_match, timeout))
                 except NoSuchElementException:
                     logger.debug(f"swipe and continue find element")
         else:
@@ -1085,15 +1113,17 @@ class BaseAndroid(metaclass=ABCMeta):
             self._driver.swipe(start_x, start_y, end_x, end_y, duration)
             if wait_time:
                 time.sleep(wait_time)
-                logger.trace(f"{self.get_xml_struct()}")
+                # 获取界面结构需要访问设备，只在输出trace的时候获取
+                if is_enabled("trace"):
+                    logger.trace(f"{self.get_xml_struct()}")
             # 表示没有指定次数
             if not swipe_time:
                 # 表示没有找到相关元素
-                elements = self.get_child_elements(swipe_element, locator, timeout)
+                elements = self._get_scroll_elements(swipe_element, locator, timeout)
                 logger.debug(f"swipe {count} and find elements size is {len(elements)}")
                 if text:
                     try:
-                        return self._find_text_in_elements(elements, text, exact_match, timeout)
+                        return self._to_element(self._find_text_in_elements(elements, text, exact_match, timeout))
                     except NoSuchElementException:
                         logger.debug(f"swipe and continue find element")
                 # 获取当前页面最边缘的元素
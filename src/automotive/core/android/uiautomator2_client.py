@@ -6,7 +6,7 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:49
 # --------------------------------------------------------
-from typing import Union, List, Optional
+from typing import Union, List, Optional, Sequence, Dict, Any
 
 import uiautomator2 as u2
 import time
@@ -18,6 +18,7 @@ from automotive.logger.logger import logger
 from .common.constants import UISELECTORS
 
 from .common.enums import ElementAttributeEnum, SwipeDirectorEnum, DirectorEnum
+from .common.hierarchy import HierarchySnapshot, HierarchyNode
 from .common.interfaces import BaseAndroid
 from .common.typehints import Capability, U2LocatorElement, Locator, Attributes, ClickPosition, LocatorElement
 from ...common.typehints import Position
@@ -83,6 +84,24 @@ class UiAutomator2Client(BaseAndroid):
                 return ui_object
         raise NoSuchElementException(f"no found locator[{device_locator} in device")
 
+    def __to_snapshot_locator(self, element: Union[U2LocatorElement, HierarchyNode]) -> Optional[Locator]:
+        """
+        把元素转换成快照中可以使用的定位符
+
+        :param element: 定位符、UiObject或者快照中的元素
+
+        :return: 定位符，UiObject中有child/sibling等无法在快照中表示的条件时返回None
+        """
+        if isinstance(element, HierarchyNode):
+            return element.snapshot.get_selector(element)
+        elif isinstance(element, UiObject):
+            selector = element.selector
+            if selector.get("childOrSibling"):
+                return None
+            return dict((key, value) for key, value in selector.items() if key in UISELECTORS or key == "instance")
+        else:
+            return self._convert_locator(element)
+
     def __get_click_point(self, element: UiObject, position: DirectorEnum = DirectorEnum.CENTER) -> ClickPosition:
         """
         根据position确定需要点击的范围
@@ -115,6 +134,8 @@ class UiAutomator2Client(BaseAndroid):
     def get_element(self, locator: U2LocatorElement, timeout: float = DEFAULT_TIME_OUT) -> UiObject:
         if isinstance(locator, UiObject):
             return locator
+        elif isinstance(locator, HierarchyNode):
+            return self.to_ui_object(locator)
         else:
             if isinstance(locator, (str, dict)):
                 locator = self._convert_locator(locator)
@@ -182,6 +203,8 @@ class UiAutomator2Client(BaseAndroid):
                                     exact_match, timeout, swipe_time, wait_time)
 
     def get_location(self, locator: U2LocatorElement, timeout: float = DEFAULT_TIME_OUT) -> Position:
+        if isinstance(locator, HierarchyNode):
+            return locator.location
         info = self.get_element(locator, timeout).info
         bounds = info["bounds"]
         bottom, left, right, top = bounds["bottom"], bounds["left"], bounds["right"], bounds["top"]
@@ -278,6 +301,83 @@ class UiAutomator2Client(BaseAndroid):
     def get_xml_struct(self) -> str:
         return self._driver.dump_hierarchy()
 
+    def get_snapshot(self) -> HierarchySnapshot:
+        """
+        获取界面结构快照，只访问一次设备，多个定位符以及元素的属性都可以从同一个快照中获取
+
+        :return: 界面结构快照
+        """
+        return HierarchySnapshot(self.get_xml_struct())
+
+    def find_nodes(self,
+                   locator: Locator,
+                   parent: Optional[Union[U2LocatorElement, HierarchyNode]] = None,
+                   timeout: float = DEFAULT_TIME_OUT) -> List[HierarchyNode]:
+        """
+        在界面结构快照中查找元素，找不到的时候每0.5秒重新获取一次快照，直到超时
+
+        :param locator: 定位符，支持UiSelector的写法以及xpath
+
+        :param parent: 父元素，为空的时候在整个界面中查找
+
+        :param timeout: 超时时间
+
+        :return: 快照中的元素列表
+        """
+        locator = self._convert_locator(locator)
+        parent_locator = None
+        if parent is not None:
+            parent_locator = self.__to_snapshot_locator(parent)
+            if parent_locator is None:
+                raise ValueError(f"parent [{parent}] can not be found in snapshot")
+        end_time = time.time() + (timeout if timeout else 0)
+        while True:
+            snapshot = self.get_snapshot()
+            parent_node = None if parent_locator is None else snapshot.find_one(parent_locator)
+            if parent_locator is None or parent_node is not None:
+                nodes = snapshot.find(locator, parent_node)
+                if nodes:
+                    return nodes
+            if time.time() > end_time:
+                break
+            time.sleep(0.5)
+        raise NoSuchElementException(f"no found locator[{locator}] in device")
+
+    def get_elements_info(self, locators: Sequence[Locator]) -> List[Optional[Dict[str, Any]]]:
+        """
+        从同一个快照中获取多个元素的信息(和UiObject.info的格式相同)
+
+        :param locators: 定位符列表
+
+        :return: 元素信息列表，找不到的元素为None
+        """
+        snapshot = self.get_snapshot()
+        result = []
+        for locator in locators:
+            node = snapshot.find_one(self._convert_locator(locator))
+            result.append(node.info if node else None)
+        return result
+
+    def to_ui_object(self, node: HierarchyNode) -> UiObject:
+        """
+        把快照中的元素转换成UiObject，用于点击、输入等需要访问设备的操作
+
+        :param node: 快照中的元素
+
+        :return: UiObject元素
+        """
+        return self._driver(**node.snapshot.get_selector(node))
+
+    def _get_scroll_elements(self, swipe_element: U2LocatorElement, locator: Locator,
+                             timeout: float) -> List[Union[UiObject, HierarchyNode]]:
+        # 每次滑动后只获取一次快照，元素的文本在本地读取
+        if self.__to_snapshot_locator(swipe_element) is None:
+            return super()._get_scroll_elements(swipe_element, locator, timeout)
+        return self.find_nodes(locator, swipe_element, timeout)
+
+    def _to_element(self, element: Union[UiObject, HierarchyNode]) -> UiObject:
+        return self.to_ui_object(element) if isinstance(element, HierarchyNode) else element
+
     def swipe_point(self, start_point: ClickPosition, end_point: ClickPosition, swipe_time: int, duration: float):
         start_x = start_point[0]
         start_y = start_point[1]
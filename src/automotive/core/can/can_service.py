@@ -6,83 +6,219 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:42
 # --------------------------------------------------------
+import os
+import json
+import math
 import time
 import random
-import copy
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from threading import Lock
 from time import sleep
-from typing import Tuple, Union, List, Any, Dict, Optional
+from typing import Tuple, Union, List, Any, Dict, Optional, Sequence
+
+import numpy as np
 
 from .common.typehints import MessageType, FilterNode, MessageIdentity
-from .message import Message, get_message
+from .message import Message, MessageSnapshot, get_message
+from .signal_decoder import get_array, decode_stack
 from .common.interfaces import BaseCanBus
-from .common.enums import CanBoxDeviceEnum, BaudRateEnum
-from automotive.common.singleton import Singleton
+from .common.enums import CanBoxDeviceEnum, BaudRateEnum, StackOverflowEnum
+from .common.frame_stack import FrameStack
+from .common.scheduler import TransmitStatistics
+from .common.receive_statistics import ReceiveStatistics, BusLoad
+from .common.watcher import Watcher, SignalWatcher, SignalChangedWatcher, MessageWatcher, MessageLostWatcher, \
+    SignalPredicate
 from automotive.logger.logger import logger
 
 
 def __get_can_bus(can_box_device: CanBoxDeviceEnum, baud_rate: BaudRateEnum, data_rate: BaudRateEnum,
-                  channel_index: int, can_fd: bool, max_workers: int) -> BaseCanBus:
+                  channel_index: int, can_fd: bool, max_workers: int, stack_size: int,
+                  stack_overflow: StackOverflowEnum) -> BaseCanBus:
     if can_box_device == CanBoxDeviceEnum.PEAKCAN:
         logger.debug("use pcan")
         from .hardware.peakcan.pcan_bus import PCanBus
         return PCanBus(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index, can_fd=can_fd,
-                       max_workers=max_workers)
+                       max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
     elif can_box_device == CanBoxDeviceEnum.TSMASTER:
         logger.debug("use tsmaster")
         from .hardware.tscan.tsmaster_bus import TsMasterCanBus
         return TsMasterCanBus(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index, can_fd=can_fd,
-                              max_workers=max_workers)
+                              max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
     elif can_box_device == CanBoxDeviceEnum.ZLGUSBCAN:
         logger.debug("use zlg")
         from .hardware.zlg.zlg_can_bus import ZlgCanBus
         return ZlgCanBus(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index, can_fd=can_fd,
-                         max_workers=max_workers)
+                         max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
     elif can_box_device == CanBoxDeviceEnum.CANALYST or can_box_device == CanBoxDeviceEnum.USBCAN:
         logger.debug("use usbcan")
         from .hardware.usbcan.usb_can_bus import UsbCanBus
         return UsbCanBus(can_box_device, baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index,
-                         can_fd=can_fd, max_workers=max_workers)
+                         can_fd=can_fd, max_workers=max_workers, stack_size=stack_size,
+                         stack_overflow=stack_overflow)
     else:
         raise RuntimeError(f"{can_box_device.value} not support")
 
 
+# 已经构建的CAN总线，{(CAN盒子类型, 通道): CAN总线}，同一个设备的同一个通道只构建一次，所有的Can/CANService对象共用
+_can_buses = dict()  # type: Dict[Tuple[CanBoxDeviceEnum, int], BaseCanBus]
+_can_buses_lock = Lock()
+# 自动查找CAN盒子的时候记录上一次找到的设备，下次优先打开该设备
+_device_state_file = os.path.join(os.path.expanduser("~"), ".automotive", "can_box_device.json")
+# 自动查找CAN盒子的时候等待所有设备打开的最长时间(秒)
+_probe_timeout = 3.0
+
+
+def __read_device_state(can_fd: bool) -> Optional[CanBoxDeviceEnum]:
+    """
+    读取上一次自动查找到的CAN盒子，文件不存在或者内容错误的时候返回None
+    """
+    try:
+        with open(_device_state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return CanBoxDeviceEnum.from_name(state["fd" if can_fd else "can"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def __write_device_state(can_box_device: CanBoxDeviceEnum, can_fd: bool):
+    """
+    记录自动查找到的CAN盒子，CAN和CAN FD分开记录，写入失败不影响使用
+    """
+    try:
+        try:
+            with open(_device_state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if not isinstance(state, dict):
+                state = dict()
+        except (OSError, ValueError):
+            state = dict()
+        state["fd" if can_fd else "can"] = can_box_device.value[0]
+        os.makedirs(os.path.dirname(_device_state_file), exist_ok=True)
+        temp_file = f"{_device_state_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_file, _device_state_file)
+    except OSError as e:
+        logger.debug(f"save can box device failed, {e}")
+
+
+def __probe_can_bus(can_box_device: CanBoxDeviceEnum, baud_rate: BaudRateEnum, data_rate: BaudRateEnum,
+                    channel_index: int, can_fd: bool, max_workers: int, stack_size: int,
+                    stack_overflow: StackOverflowEnum) -> BaseCanBus:
+    """
+    构建CAN总线并打开设备(不启动接收和发送线程)，打开失败的时候关闭设备并抛出异常
+    """
+    can = __get_can_bus(can_box_device, baud_rate, data_rate, channel_index, can_fd, max_workers, stack_size,
+                        stack_overflow)
+    try:
+        can.can_device.open_device(baud_rate=baud_rate, data_rate=data_rate, channel=channel_index)
+    except Exception:
+        # 部分设备打开成功但是通道初始化失败，需要关闭设备
+        can.can_device.close_device()
+        raise
+    if not can.can_device.is_open:
+        raise RuntimeError(f"open {can_box_device.value[0]} failed")
+    return can
+
+
+def __close_probe(future: Future):
+    """
+    关闭没有被选中的设备
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().can_device.close_device()
+
+
+def __detect_can_bus(baud_rate: BaudRateEnum, data_rate: BaudRateEnum, channel_index: int, can_fd: bool,
+                     max_workers: int, stack_size: int, stack_overflow: StackOverflowEnum
+                     ) -> Tuple[CanBoxDeviceEnum, BaseCanBus]:
+    """
+    自动查找CAN盒子
+
+    1、优先打开上一次找到的设备，成功的时候直接返回
+
+    2、否则同时打开所有支持的设备，最多等待_probe_timeout秒，多个设备打开成功的时候按照CanBoxDeviceEnum的顺序选择，其他的设备关闭
+
+    返回的CAN总线已经打开了设备，open_can的时候不会重复打开
+    """
+    parameters = baud_rate, data_rate, channel_index, can_fd, max_workers, stack_size, stack_overflow
+    candidates = [value for value in CanBoxDeviceEnum.__members__.values() if not can_fd or value.value[1]]
+    cached = __read_device_state(can_fd)
+    if cached in candidates:
+        logger.info(f"try to open last device {cached.value[0]}")
+        try:
+            return cached, __probe_can_bus(cached, *parameters)
+        except Exception as e:
+            logger.debug(f"open {cached.value[0]} failed, {e}")
+            candidates.remove(cached)
+    logger.info(f"try to open {[value.value[0] for value in candidates]}")
+    thread_pool = ThreadPoolExecutor(max_workers=max(len(candidates), 1), thread_name_prefix="can_probe")
+    futures = [(value, thread_pool.submit(__probe_can_bus, value, *parameters)) for value in candidates]
+    # 排在前面的设备都已经有结果的时候不再等待后面的设备，超时的设备打开完成之后在回调中关闭
+    deadline = time.perf_counter() + _probe_timeout
+    pending = [future for _, future in futures]
+    while pending:
+        remain = deadline - time.perf_counter()
+        if remain <= 0:
+            break
+        wait(pending, timeout=remain, return_when=FIRST_COMPLETED)
+        pending = []
+        for _, future in futures:
+            if not future.done():
+                pending.append(future)
+            elif future.exception() is None:
+                break
+    thread_pool.shutdown(wait=False)
+    selected = None
+    for value, future in futures:
+        if selected is None and future.done() and future.exception() is None:
+            selected = value, future.result()
+            continue
+        if future.done() and future.exception() is not None:
+            logger.debug(f"open {value.value[0]} failed, {future.exception()}")
+        future.add_done_callback(__close_probe)
+    if selected is None:
+        raise RuntimeError("No device found, is can box connected")
+    __write_device_state(selected[0], can_fd)
+    return selected
+
+
 def get_can_box_device(can_box_device: CanBoxDeviceEnum, baud_rate: BaudRateEnum, data_rate: BaudRateEnum,
-                       channel_index: int, can_fd: bool, max_workers: int) -> Tuple[CanBoxDeviceEnum, BaseCanBus]:
+                       channel_index: int, can_fd: bool, max_workers: int, stack_size: int = 1000000,
+                       stack_overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE
+                       ) -> Tuple[CanBoxDeviceEnum, BaseCanBus]:
     """
-    获取can盒子的类型， 依次从PCan找到CANALYST然后到USBCAN
+    获取can盒子的类型，没有指定的时候自动查找(参考__detect_can_bus)
+
+    同一个设备的同一个通道已经构建过CAN总线的时候直接返回该总线(没有指定设备的时候返回该通道已有的总线)，
+
+    不会对同一个通道重复打开设备，此时baud_rate等参数以第一次构建时为准
     :return: can盒类型
     """
-    if can_box_device:
-        return can_box_device, __get_can_bus(can_box_device, baud_rate, data_rate, channel_index, can_fd, max_workers)
-    else:
-        for key, value in CanBoxDeviceEnum.__members__.items():
-            name, type_ = value.value
-            if can_fd is True and type_ is True:
-                logger.info(f"try to open {key}")
-                can = __get_can_bus(value, baud_rate, data_rate, channel_index, can_fd, max_workers)
-                try:
-                    can.open_can()
-                    sleep(1)
-                    can.close_can()
-                    return value, __get_can_bus(value, baud_rate, data_rate, channel_index, can_fd, max_workers)
-                except RuntimeError:
-                    logger.debug(f"open {name} failed")
-            elif can_fd is False:
-                logger.info(f"try to open {key}")
-                can = __get_can_bus(value, baud_rate, data_rate, channel_index, can_fd, max_workers)
-                try:
-                    can.open_can()
-                    sleep(1)
-                    can.close_can()
-                    return value, __get_can_bus(value, baud_rate, data_rate, channel_index, can_fd, max_workers)
-                except RuntimeError:
-                    logger.debug(f"open {name} failed")
-        raise RuntimeError("No device found, is can box connected")
+    with _can_buses_lock:
+        for (device, channel), can_bus in _can_buses.items():
+            if channel == channel_index and (can_box_device is None or can_box_device == device):
+                logger.debug(f"use the shared can bus of {device.value[0]} channel {channel}")
+                return device, can_bus
+        if can_box_device:
+            can_bus = __get_can_bus(can_box_device, baud_rate, data_rate, channel_index, can_fd, max_workers,
+                                    stack_size, stack_overflow)
+        else:
+            can_box_device, can_bus = __detect_can_bus(baud_rate, data_rate, channel_index, can_fd, max_workers,
+                                                       stack_size, stack_overflow)
+        _can_buses[(can_box_device, channel_index)] = can_bus
+        return can_box_device, can_bus
 
 
-class Can(metaclass=Singleton):
+class Can(object):
     """
     CAN设备操作的父类，实现CAN的最基本的操作， 如打开、关闭设备, 传输、接收CAN消息，停止传输CAN消息，查看CAN设备打开状态等
+
+    每个实例对应一个CAN设备的一个通道，同时操作多路CAN参考MultiCANService
+
+    同一个设备的同一个通道的多个实例(如CANService和TracePlayback)共用一个CAN总线(参考get_can_box_device)，
+
+    已经打开的总线不会重复打开，任何一个实例关闭的时候总线关闭
     """
 
     def __init__(self,
@@ -91,15 +227,19 @@ class Can(metaclass=Singleton):
                  data_rate: Union[BaudRateEnum, int] = BaudRateEnum.DATA,
                  channel_index: int = 1,
                  can_fd: bool = False,
-                 max_workers: int = 300):
+                 max_workers: int = 300,
+                 stack_size: int = 1000000,
+                 stack_overflow: Union[StackOverflowEnum, str] = StackOverflowEnum.OVERWRITE):
         if isinstance(can_box_device, str):
             can_box_device = CanBoxDeviceEnum.from_name(can_box_device)
         if isinstance(baud_rate, int):
             baud_rate = BaudRateEnum.from_value(baud_rate)
         if isinstance(data_rate, int):
             data_rate = BaudRateEnum.from_value(data_rate)
+        if isinstance(stack_overflow, str):
+            stack_overflow = StackOverflowEnum.from_name(stack_overflow)
         self._can_box_device, self._can = get_can_box_device(can_box_device, baud_rate, data_rate, channel_index,
-                                                             can_fd, max_workers)
+                                                             can_fd, max_workers, stack_size, stack_overflow)
 
     @property
     def can_box_device(self) -> CanBoxDeviceEnum:
@@ -113,6 +253,9 @@ class Can(metaclass=Singleton):
         """
         对CAN设备进行打开、初始化等操作，并同时开启设备的帧接收线程。
         """
+        if self._can.is_running:
+            logger.debug("can bus is already opened by other instance")
+            return
         self._can.open_can()
 
     def close_can(self):
@@ -145,6 +288,14 @@ class Can(metaclass=Singleton):
         """
         self._can.transmit(message)
 
+    def transmit_batch(self, messages: Sequence[Message]):
+        """
+        批量发送CAN消息帧，在同一次调度中连续发送
+
+        :param messages: CAN消息帧列表
+        """
+        self._can.transmit_batch(messages)
+
     def transmit_one(self, message: Message):
         """
         仅发一帧数据
@@ -169,24 +320,103 @@ class Can(metaclass=Singleton):
         """
         self._can.clear_stack_data()
 
-    def get_stack(self) -> List[Message]:
+    def get_transmit_statistics(self, message_id: Optional[int] = None) -> Dict[int, TransmitStatistics]:
+        """
+        获取发送统计
+
+        :param message_id: message的ID，为空表示所有发送过的帧
+
+        :return: {msg_id: 统计数据}
+        """
+        return self._can.get_transmit_statistics(message_id)
+
+    def get_receive_statistics(self, message_id: Optional[int] = None) -> Dict[int, ReceiveStatistics]:
+        """
+        获取接收统计，接收线程在线更新，不需要保存帧
+
+        :param message_id: message的ID，为空表示所有收到过的帧
+
+        :return: {msg_id: 统计数据}
+        """
+        return self._can.get_receive_statistics(message_id)
+
+    def get_bus_load(self) -> BusLoad:
+        """
+        获取总线负载(按照时间窗口统计的百分比)
+        """
+        return self._can.get_bus_load()
+
+    def clear_receive_statistics(self):
+        """
+        清空接收统计
+        """
+        self._can.clear_receive_statistics()
+
+    def get_stack(self) -> FrameStack:
         """
         获取当前栈中所收到的消息
 
-        :return:  栈中数据List<Message>
+        :return:  栈中数据，可以像List<Message>一样使用
         """
         return self._can.get_stack()
 
+    def add_watcher(self, watcher: Watcher) -> Watcher:
+        """
+        添加监听者，接收线程收到数据的时候增量检查条件
+
+        :param watcher: 监听者
+
+        :return: 监听者
+        """
+        return self._can.add_watcher(watcher)
+
+    def remove_watcher(self, watcher: Optional[Watcher] = None):
+        """
+        移除并取消监听者
+
+        :param watcher: 监听者，为空表示所有的监听者
+        """
+        self._can.remove_watcher(watcher)
+
+    def watch_message(self, message_id: Optional[int] = None, count: int = 1,
+                      timeout: Optional[float] = 5) -> MessageWatcher:
+        """
+        监听收到count帧消息
+
+        :param message_id: message的ID，为空表示任意帧
+
+        :param count: 帧数量
+
+        :param timeout: 超时时间(秒)
+
+        :return: 监听者，通过wait获取结果
+        """
+        return self.add_watcher(MessageWatcher(message_id, count, timeout))
+
+    def watch_message_lost(self, message_id: Optional[int], lost_time: int,
+                           timeout: Optional[float] = 5) -> MessageLostWatcher:
+        """
+        监听消息丢失，从现在或者最后一次收到该帧开始，超过lost_time没有收到的时候为True
+
+        :param message_id: message的ID，为空表示任意帧(即总线丢失)
+
+        :param lost_time: 丢失时间 单位ms
+
+        :param timeout: 超时时间(秒)，超时的时候为False
+
+        :return: 监听者，通过wait获取结果
+        """
+        return self.add_watcher(MessageLostWatcher(message_id, lost_time / 1000, timeout))
+
     def is_can_bus_lost(self, continue_time: int = 5) -> bool:
         """
-        can总线是否数据丢失，如果检测周期内有一帧can信号表示can网络没有中断
+        can总线是否数据丢失，如果检测周期内有一帧can信号表示can网络没有中断，收到数据的时候立即返回
 
-        :param continue_time: 清空数据，10s内收不到任何的CAN消息表示CAN总线丢失
+        :param continue_time: 清空数据，continue_time秒内收不到任何的CAN消息表示CAN总线丢失
         """
         # 清空栈数据
         self.clear_stack_data()
-        time.sleep(continue_time)
-        return len(self._can.get_stack()) == 0
+        return not self.watch_message(None, timeout=continue_time).wait()
 
 
 class CANService(Can):
@@ -225,13 +455,20 @@ class CANService(Can):
                  data_rate: Union[BaudRateEnum, int] = BaudRateEnum.DATA,
                  channel_index: int = 1,
                  can_fd: bool = False,
-                 max_workers: int = 300):
-        super().__init__(can_box_device, baud_rate, data_rate, channel_index, can_fd, max_workers)
+                 max_workers: int = 300,
+                 stack_size: int = 1000000,
+                 stack_overflow: Union[StackOverflowEnum, str] = StackOverflowEnum.OVERWRITE):
+        super().__init__(can_box_device, baud_rate, data_rate, channel_index, can_fd, max_workers, stack_size,
+                         stack_overflow)
         logger.debug(f"read message from file {messages}")
         self.__messages, self.__name_messages = get_message(messages, encoding=encoding)
-        # 备份message, 可以作为初始值发送
-        self.__backup_messages = copy.deepcopy(self.__messages)
-        self.__backup_name_messages = copy.deepcopy(self.__name_messages)
+        # message初始值的快照, 可以作为初始值发送
+        self.__snapshot = MessageSnapshot(self.__messages)
+        # signal名字对应的msg id，{signal_name: [msg_id]}
+        self.__signal_index = self.__build_signal_index()
+        # 接收统计按照矩阵表中的周期和长度计算丢帧数量和DLC错误
+        self._can.set_receive_expected(dict((msg_id, (message.cycle_time, message.data_length))
+                                            for msg_id, message in self.__messages.items()))
 
     @property
     def name_messages(self) -> Dict[str, Any]:
@@ -243,23 +480,9 @@ class CANService(Can):
 
     def __restore_default_message(self):
         """
-        恢复初始的message值
-        """
-        self.__messages = copy.deepcopy(self.__backup_messages)
-        self.__name_messages = copy.deepcopy(self.__backup_name_messages)
-
-    def __set_message(self, msg_id: int, data: list) -> Message:
-        """
-        :param msg_id: 消息ID
-
-        :param data: 数据
-
-        :return: Message对象
+        恢复初始的message值，只恢复自上一次快照之后被修改过的message
         """
-        msg = self.messages[msg_id]
-        msg.data = data
-        msg.update(False)
-        return msg
+        self.__snapshot.restore()
 
     @staticmethod
     def __is_message_in_node(message: Message, filter_sender: FilterNode) -> bool:
@@ -347,11 +570,46 @@ class CANService(Can):
         if interval > 0:
             sleep(interval)
 
-    def __get_msg_id_from_signal_name(self, signal_name: str) -> int:
-        for msg_name, msg in self.messages.items():
-            if signal_name in msg.signals:
-                return msg.msg_id
-        raise RuntimeError(f"{signal_name} can not be found in messages")
+    def __build_signal_index(self) -> Dict[str, List[int]]:
+        """
+        建立signal名字到msg id的索引，多个message中存在同名signal的时候需要使用msg_name.signal_name的方式指定
+        """
+        signal_index = dict()
+        for msg_id, message in self.messages.items():
+            for signal_name in message.signals:
+                signal_index.setdefault(signal_name, []).append(msg_id)
+        duplicates = [signal_name for signal_name, msg_ids in signal_index.items() if len(msg_ids) > 1]
+        if duplicates:
+            logger.warning(f"signal {duplicates} defined in more than one message, "
+                           f"please use msg_name.signal_name to specify them")
+        return signal_index
+
+    def __get_msg_id_from_signal_name(self, signal_name: str, msg_id: Optional[int] = None) -> Tuple[int, str]:
+        """
+        根据signal名字查找所在的msg id
+
+        :param signal_name: signal名字，也支持msg_name.signal_name的方式
+
+        :param msg_id: 已知的msg id，为空的时候通过signal名字查找
+
+        :return: (msg id, signal名字)
+        """
+        if "." in signal_name:
+            msg_name, signal_name = signal_name.split(".", 1)
+            if msg_name not in self.name_messages:
+                raise RuntimeError(f"{msg_name} can not be found in messages")
+            msg_id = self.name_messages[msg_name].msg_id
+        if msg_id is not None:
+            if signal_name not in self.messages[msg_id].signals:
+                raise RuntimeError(f"{signal_name} is not in {hex(msg_id)}")
+            return msg_id, signal_name
+        if signal_name not in self.__signal_index:
+            raise RuntimeError(f"{signal_name} can not be found in messages")
+        msg_ids = self.__signal_index[signal_name]
+        if len(msg_ids) > 1:
+            raise RuntimeError(f"{signal_name} is defined in {list(map(hex, msg_ids))}, "
+                               f"please use msg_name.signal_name to specify it")
+        return msg_ids[0], signal_name
 
     def send_can_message_by_id_or_name(self, msg: MessageIdentity):
         """
@@ -382,7 +640,7 @@ class CANService(Can):
             如： {"signal_name1": 0x1, "signal_name2": 0x2}
         """
         if isinstance(msg, str):
-            msg_id = self.name_messages[msg]
+            msg_id = self.name_messages[msg].msg_id
         elif isinstance(msg, int):
             msg_id = msg
         else:
@@ -394,6 +652,31 @@ class CANService(Can):
         set_message.check_message()
         self.send_can_message_by_id_or_name(msg_id)
 
+    def send_can_signals(self, signals: Dict[str, Union[int, float]]):
+        """
+        同时设置多个message中的signal并发送
+
+        signal按照所在的message分组，每个message只重新计算一次数据，所有message在同一次调度中连续发送
+
+        :param signals: 需要修改的信号，其中key是信号名字(同名信号使用msg_name.signal_name)，value是物理值
+
+            如： {"signal_name1": 0x1, "msg_name.signal_name2": 0x2}
+        """
+        changes = dict()
+        for name, value in signals.items():
+            msg_id, signal_name = self.__get_msg_id_from_signal_name(name)
+            changes.setdefault(msg_id, dict())[signal_name] = value
+        send_messages = []
+        for msg_id, values in changes.items():
+            set_message = self.messages[msg_id]
+            for signal_name, value in values.items():
+                set_message.signals[signal_name].physical_value = value
+            set_message.check_message()
+            set_message.update(True)
+            send_messages.append(set_message)
+        logger.debug(f"send messages {list(map(hex, changes))}")
+        self.transmit_batch(send_messages)
+
     def send_can_message(self, send_msg: Message, type_: bool = False):
         """
         直接发送的Message对象数据，可以选择8byte数据发送和signals数据发送两种方式，默认使用signals方式构建数据
@@ -407,7 +690,10 @@ class CANService(Can):
             False: signals方式发送
         """
         send_msg.check_message(type_)
-        if not type_:
+        if type_:
+            # 直接修改data发送的时候signal的值没有变化，需要手动标记
+            send_msg.mark_modified()
+        else:
             logger.debug("now update message")
             send_msg.update(True)
         logger.debug(f"msg Id {hex(send_msg.msg_id)}, msg data is {list(map(lambda x: hex(x), send_msg.data))}")
@@ -458,12 +744,8 @@ class CANService(Can):
             False: 没有变化
         """
         # 过滤掉没有用的数据
-        data_list = list(filter(lambda x: x.msg_id == msg_id, stack))
-        duplicate = set()
-        for message in data_list:
-            data = message.data
-            duplicate.add(data)
-        return len(duplicate) > 1
+        _, data = get_array(stack, msg_id)
+        return len(data) > 1 and bool((data != data[0]).any())
 
     def is_lost_message(self,
                         msg_id: int,
@@ -478,13 +760,15 @@ class CANService(Can):
 
         1、总线是否丢失
 
-        2、最后两帧收到的消息间隔时间大于信号周期间隔时间且收到的消息小于应该收到的消息去掉信号丢失周期应该收到的消息数量
+        2、有lost_period的时候，检测时间内超过lost_period个周期没有收到该消息表示丢失，满足条件时立即返回True
+
+        3、没有lost_period的时候，检测时间内收到的消息少于应该收到的数量表示丢失，收到足够数量时立即返回False
 
         :param msg_id: message id值
 
-        :param lost_period: 信号丢失周期（默认为10个周期)
+        :param lost_period: 信号丢失周期
 
-        :param continue_time: 检测时间（当不为空的时候，会清空数据并等待time ms，然后再检测数据)
+        :param continue_time: 最长检测时间(秒)
 
         :param cycle_time: 信号周期 单位ms
 
@@ -495,38 +779,52 @@ class CANService(Can):
             logger.info(f"judge bus status")
             if self.is_can_bus_lost(bus_time):
                 return True
-        logger.debug(f"sleep {continue_time}")
-        # 清空栈数据，继续接收数据
-        self.clear_stack_data()
-        time.sleep(continue_time)
-        stack = self._can.get_stack()
-        logger.debug(f"stack size is {len(stack)}")
-        # 过滤掉没有用的数据
-        msg_stack_list = list(filter(lambda x: x.msg_id == msg_id, stack))
-        msg_stack_size = len(msg_stack_list)
-        logger.debug(f"msg_stack_size is {msg_stack_size}")
-        # 计算continue_time时间内应该受到的帧数量
-        receive_msg_size = (continue_time * 1000) / cycle_time
-        logger.debug(f"receive_msg_size is {receive_msg_size}")
         if lost_period:
-            logger.debug(f"lost_period exist")
-            # 确保至少收到两个以上的信号
-            if msg_stack_size < 2:
-                return True
-            else:
-                pass_time = (int(msg_stack_list[-1].time_stamp, 16) - int(msg_stack_list[-2].time_stamp, 16)) / 1000
-                judge_time = cycle_time * lost_period
-                logger.info(f"pass time is {pass_time} and judge time is {judge_time}")
-                # 最后两帧的间隔时间大于信号周期间隔时间且收到的消息小于应该收到的消息去掉信号丢失周期应该收到的消息
-                max_lost_receive_msg_size = receive_msg_size - (lost_period * 1000) / cycle_time
-                logger.info(f"msg_stack_size is {msg_stack_size} and max_size is {max_lost_receive_msg_size}")
-                return pass_time > judge_time and msg_stack_size < max_lost_receive_msg_size
-        else:
-            logger.info(f"need receive msg size [{receive_msg_size}] and actual receive size is [{msg_stack_size}]")
-            return msg_stack_size < receive_msg_size
+            lost_time = cycle_time * lost_period
+            logger.info(f"judge {hex(msg_id)} not received in {lost_time}ms during {continue_time}s")
+            result = self.watch_message_lost(msg_id, lost_time, timeout=continue_time).wait()
+            # 接收统计中记录了该消息的帧数量以及最大帧间隔，用于分析丢失的原因
+            logger.info(f"message lost is {result}, receive statistics is {self.get_receive_statistics(msg_id)}")
+            return result
+        # 计算continue_time时间内应该收到的帧数量
+        receive_msg_size = math.ceil((continue_time * 1000) / cycle_time)
+        watcher = self.watch_message(msg_id, count=receive_msg_size, timeout=continue_time)
+        result = watcher.wait()
+        logger.info(f"need receive msg size [{receive_msg_size}] and actual receive size is [{watcher.received}]")
+        return not result
+
+    def check_cycle_time(self,
+                         msg_id: int,
+                         tolerance: float = 0.1,
+                         max_lost: int = 0,
+                         cycle_time: Optional[int] = None) -> bool:
+        """
+        根据接收统计检查message的周期，不需要等待和保存帧，统计从打开设备或者clear_receive_statistics开始
 
-    @staticmethod
-    def is_signal_value_changed(stack: List[Message], msg_id: int, signal_name: str) -> bool:
+        判断规则：收到两帧以上、平均间隔和周期的误差在tolerance以内、估算的丢帧数量不超过max_lost且没有DLC错误
+
+        :param msg_id: message id值
+
+        :param tolerance: 平均间隔允许的误差(周期的比例)
+
+        :param max_lost: 允许的丢帧数量
+
+        :param cycle_time: 信号周期 单位ms，默认使用矩阵表中的周期
+        """
+        if cycle_time is None:
+            cycle_time = self.messages[msg_id].cycle_time if msg_id in self.messages else 0
+        if cycle_time <= 0:
+            raise ValueError(f"cycle time of {hex(msg_id)} is not set")
+        statistics = self.get_receive_statistics(msg_id)
+        if msg_id not in statistics:
+            logger.info(f"{hex(msg_id)} not received")
+            return False
+        statistics = statistics[msg_id]
+        logger.info(f"{hex(msg_id)} statistics is {statistics}")
+        return statistics.count > 1 and abs(statistics.gap_mean - cycle_time) <= cycle_time * tolerance \
+            and statistics.lost <= max_lost and statistics.dlc_errors == 0
+
+    def is_signal_value_changed(self, stack: List[Message], msg_id: int, signal_name: str) -> bool:
         """
         检测某个msg中某个signal是否有变化
 
@@ -541,18 +839,14 @@ class CANService(Can):
 
             False: 没有变化
         """
-        # 过滤掉没有用的数据
-        data_list = list(filter(lambda x: x.msg_id == msg_id, stack))
-        duplicate = set()
-        for message in data_list:
-            signal = message.signals[signal_name]
-            duplicate.add(signal.value)
-        return len(duplicate) > 1
+        _, values = decode_stack(stack, self.messages[msg_id], [signal_name], physical=False)
+        values = values[signal_name]
+        return len(values) > 1 and bool((values != values[0]).any())
 
     def get_receive_signal_values(self,
                                   stack: List[Message],
                                   signal_name: str,
-                                  msg_id: Optional[str] = None) -> List[int]:
+                                  msg_id: Optional[int] = None) -> List[int]:
         """
         所有曾经出现的信号值
         :param stack:
@@ -560,47 +854,33 @@ class CANService(Can):
         :param signal_name:
         :return:
         """
-        if msg_id is None:
-            msg_id = self.__get_msg_id_from_signal_name(signal_name)
-        result = []
-        filter_messages = list(filter(lambda x: x.msg_id == msg_id, stack))
-        for msg in filter_messages:
-            message = self.__set_message(msg.msg_id, msg.data)
-            if signal_name not in message.signals:
-                raise RuntimeError(f"{signal_name} is not in {msg_id}")
-            else:
-                signal = message.signals[signal_name]
-                if signal.physical_value not in result:
-                    result.append(signal.physical_value)
-        return result
+        msg_id, signal_name = self.__get_msg_id_from_signal_name(signal_name, msg_id)
+        _, values = decode_stack(stack, self.messages[msg_id], [signal_name])
+        # 按照第一次出现的顺序返回
+        unique_values, indexes = np.unique(values[signal_name], return_index=True)
+        return unique_values[np.argsort(indexes)].tolist()
 
     def count_signal_value(self,
                            stack: List[Message],
                            signal_name: str,
-                           expect_value: int) -> int:
+                           expect_value: int,
+                           msg_id: Optional[int] = None) -> int:
         """
        检查signal的值是否符合要求
 
-       :param signal_name:  sig name
+       :param signal_name:  sig name(同名信号使用msg_name.signal_name)
 
        :param expect_value: expect value
 
        :param stack: 栈中消息
+
+       :param msg_id: msg id，为空的时候根据signal名字查找
        """
-        msg_id = self.__get_msg_id_from_signal_name(signal_name)
-        # 过滤需要的msg
-        filter_messages = list(filter(lambda x: x.msg_id == msg_id, stack))
-        logger.debug(f"filter messages length is {len(filter_messages)}")
-        msg_count = 0
-        for msg in filter_messages:
-            logger.debug(f"msg data = {msg.data}")
-            # 此时的msg只有data，需要调用方法更新内容
-            message = self.__set_message(msg.msg_id, msg.data)
-            actual_value = message.signals[signal_name].physical_value
-            logger.debug(f"actual_value = {actual_value}")
-            if actual_value == expect_value:
-                msg_count += 1
-        return msg_count
+        msg_id, signal_name = self.__get_msg_id_from_signal_name(signal_name, msg_id)
+        _, values = decode_stack(stack, self.messages[msg_id], [signal_name])
+        values = values[signal_name]
+        logger.debug(f"filter messages length is {len(values)}")
+        return int(np.count_nonzero(values == expect_value))
 
     def check_signal_value(self,
                            stack: List[Message],
@@ -616,7 +896,7 @@ class CANService(Can):
 
         :param msg_id: msg id
 
-        :param signal_name:  sig name
+        :param signal_name:  sig name(同名信号使用msg_name.signal_name)
 
         :param expect_value: expect value
 
@@ -624,10 +904,9 @@ class CANService(Can):
 
         :param stack: 栈中消息
         """
-        if msg_id is None:
-            msg_id = self.__get_msg_id_from_signal_name(signal_name)
+        msg_id, signal_name = self.__get_msg_id_from_signal_name(signal_name, msg_id)
         if count:
-            msg_count = self.count_signal_value(stack, signal_name, expect_value)
+            msg_count = self.count_signal_value(stack, signal_name, expect_value, msg_id)
             logger.info(f"except count is {count}, actual count = {msg_count}")
             if exact:
                 return msg_count == count
@@ -639,6 +918,94 @@ class CANService(Can):
             logger.info(f"current value is {actual_value}, expect value is {expect_value}")
             return expect_value == actual_value
 
+    def watch_signal(self,
+                     signal_name: str,
+                     expect_value: Optional[int] = None,
+                     predicate: Optional[SignalPredicate] = None,
+                     count: int = 1,
+                     timeout: Optional[float] = 5,
+                     msg_id: Optional[int] = None,
+                     physical: bool = True) -> SignalWatcher:
+        """
+        监听signal的值，从现在开始收到的帧中满足条件的帧累计达到count帧的时候为True
+
+        :param signal_name: sig name(同名信号使用msg_name.signal_name)
+
+        :param expect_value: 期望值，和predicate二选一
+
+        :param predicate: 条件，输入每一帧的signal值数组，返回bool数组，如lambda values: values > 3
+
+        :param count: 满足条件的帧数量
+
+        :param timeout: 超时时间(秒)，超时的时候为False
+
+        :param msg_id: msg id，为空的时候根据signal名字查找
+
+        :param physical: True比较物理值，False比较总线值
+
+        :return: 监听者，通过wait获取结果
+        """
+        if (expect_value is None) == (predicate is None):
+            raise ValueError("one of expect_value and predicate must be set")
+        if predicate is None:
+            def predicate(values: np.ndarray) -> np.ndarray:
+                return values == expect_value
+        msg_id, signal_name = self.__get_msg_id_from_signal_name(signal_name, msg_id)
+        message = self.messages[msg_id]
+        watcher = SignalWatcher(message, message.signals[signal_name], predicate, count, physical, timeout)
+        return self.add_watcher(watcher)
+
+    def watch_signal_changed(self,
+                             signal_name: str,
+                             reference: Optional[int] = None,
+                             timeout: Optional[float] = 5,
+                             msg_id: Optional[int] = None,
+                             physical: bool = True) -> SignalChangedWatcher:
+        """
+        监听signal的值发生变化
+
+        :param signal_name: sig name(同名信号使用msg_name.signal_name)
+
+        :param reference: 参考值，为空的时候以收到的第一帧为准
+
+        :param timeout: 超时时间(秒)，超时的时候为False
+
+        :param msg_id: msg id，为空的时候根据signal名字查找
+
+        :param physical: True比较物理值，False比较总线值
+
+        :return: 监听者，通过wait获取结果
+        """
+        msg_id, signal_name = self.__get_msg_id_from_signal_name(signal_name, msg_id)
+        message = self.messages[msg_id]
+        watcher = SignalChangedWatcher(message, message.signals[signal_name], reference, physical, timeout)
+        return self.add_watcher(watcher)
+
+    def wait_signal_value(self,
+                          signal_name: str,
+                          expect_value: int,
+                          timeout: float = 5,
+                          count: int = 1,
+                          msg_id: Optional[int] = None) -> bool:
+        """
+        等待signal的值变成期望值，满足的时候立即返回
+
+        :param signal_name: sig name(同名信号使用msg_name.signal_name)
+
+        :param expect_value: 期望值
+
+        :param timeout: 最长等待时间(秒)
+
+        :param count: 满足条件的帧数量
+
+        :param msg_id: msg id，为空的时候根据signal名字查找
+
+        :return: 是否在超时时间内收到期望值
+        """
+        result = self.watch_signal(signal_name, expect_value, count=count, timeout=timeout, msg_id=msg_id).wait()
+        logger.info(f"wait {signal_name} to be {expect_value} result is {result}")
+        return result
+
     def send_random(self,
                     filter_sender: Optional[FilterNode] = None,
                     cycle_time: Optional[int] = None,
@@ -693,3 +1060,9 @@ class CANService(Can):
         """
         self.__restore_default_message()
         self.send_messages(filter_sender)
+
+    def save_default_messages(self):
+        """
+        把当前所有message的值保存为默认值，之后调用send_default_messages的时候恢复成该值
+        """
+        self.__snapshot.take()
@@ -62,6 +62,26 @@ class CanBoxDeviceEnum(Enum):
         raise ValueError(f"{type_} can not be found in CanBoxDeviceEnum")
 
 
+@unique
+class StackOverflowEnum(Enum):
+    """
+    接收栈满的时候的处理策略
+
+        OVERWRITE: 覆盖最老的帧
+
+        DISCARD: 丢弃新收到的帧
+    """
+    OVERWRITE = "overwrite"
+    DISCARD = "discard"
+
+    @staticmethod
+    def from_name(type_: str):
+        for key, item in StackOverflowEnum.__members__.items():
+            if type_.upper() == key:
+                return item
+        raise ValueError(f"{type_} can not be found in StackOverflowEnum")
+
+
 @unique
 class TraceTypeEnum(Enum):
     """
@@ -76,9 +96,12 @@ class TraceTypeEnum(Enum):
         SPY3_ASC: SPY3录制的CAN log(ASC类型)
 
         CANOE_ASC: CANoe录制的CAN log(ASC类型)
+
+        BINARY: 由其他类型的CAN log转换的二进制trace
     """
     PCAN = "pcan_reader", "PCanReader"
     USB_CAN = "usb_can_reader", "UsbCanReader"
     SPY3_CSV = "vspy_csv_reader", "VspyCsvReader"
     SPY3_ASC = "vspy_ase_reader", "VspyAseReader"
     CANOE_ASC = "canoe_asc_reader", "CanoeAscReader"
+    BINARY = "binary_trace_reader", "BinaryTraceReader"
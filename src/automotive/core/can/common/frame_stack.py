@@ -0,0 +1,328 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        frame_stack.py
+# @Author:      lizhe
+# @Created:     2022/3/13 - 15:02
+# --------------------------------------------------------
+from threading import Lock
+from time import perf_counter
+from typing import List, Optional, Tuple, Sequence, Iterator, Union, Dict
+
+import numpy as np
+
+from .enums import StackOverflowEnum
+from ..message import Message
+
+
+class _IdIndex(object):
+    """
+    单个msg id的索引，按照接收顺序存放帧的序号，head之前的序号已经被移除
+    """
+    __slots__ = ("sequences", "head")
+
+    def __init__(self):
+        self.sequences = []
+        self.head = 0
+
+    def __len__(self):
+        return len(self.sequences) - self.head
+
+    def pop_left(self):
+        self.head += 1
+        # 被移除的部分超过一半的时候整理一次，避免列表无限增长
+        if self.head > 1024 and self.head * 2 > len(self.sequences):
+            del self.sequences[:self.head]
+            self.head = 0
+
+
+class FrameStack(object):
+    """
+    固定容量的接收帧栈(环形缓冲区)
+
+    1、msg id、时间戳、dlc以及数据存放在预先分配的numpy数组中，内存占用不会随着运行时间增长
+
+    2、按照msg id建立二级索引，查询某个msg id的帧只需要O(k)的时间
+
+    3、栈满的时候根据overflow策略覆盖最老的帧或者丢弃新收到的帧
+
+    4、除了设备的时间戳外，还记录保存时的主机时间(perf_counter，秒)，不同设备的栈可以按照主机时间对齐
+
+    为了兼容原有的List[Message]用法，支持len、迭代以及下标访问，访问的时候才会构建Message对象
+    """
+
+    def __init__(self, capacity: int = 1000000, width: int = 8,
+                 overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE):
+        """
+        :param capacity: 最多保存的帧数量
+
+        :param width: 每帧数据的最大长度，CAN为8，CAN FD为64
+
+        :param overflow: 栈满时候的处理策略
+        """
+        if capacity <= 0:
+            raise ValueError(f"capacity[{capacity}] must greater than 0")
+        self.__capacity = capacity
+        self.__width = width
+        self.__overflow = overflow
+        self.__msg_ids = np.zeros(capacity, dtype=np.uint32)
+        self.__time_stamps = np.zeros(capacity, dtype=np.float64)
+        self.__host_times = np.zeros(capacity, dtype=np.float64)
+        self.__dlc = np.zeros(capacity, dtype=np.uint8)
+        self.__data = np.zeros((capacity, width), dtype=np.uint8)
+        # 最老的帧的序号
+        self.__start = 0
+        # 下一帧的序号
+        self.__end = 0
+        # 由于栈满丢失的帧数量
+        self.__dropped = 0
+        self.__index = dict()  # type: Dict[int, _IdIndex]
+        self.__lock = Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self.__capacity
+
+    @property
+    def width(self) -> int:
+        return self.__width
+
+    @property
+    def overflow(self) -> StackOverflowEnum:
+        return self.__overflow
+
+    @property
+    def dropped(self) -> int:
+        """
+        由于栈满被覆盖或者被丢弃的帧数量
+        """
+        return self.__dropped
+
+    def __len__(self) -> int:
+        return self.__end - self.__start
+
+    def __evict(self):
+        """
+        移除最老的一帧
+        """
+        slot = self.__start % self.__capacity
+        self.__index[int(self.__msg_ids[slot])].pop_left()
+        self.__start += 1
+
+    def append(self, msg_id: int, time_stamp: Union[int, float], data: Sequence[int]):
+        """
+        保存一帧数据，由接收线程调用
+
+        :param msg_id: 帧ID
+
+        :param time_stamp: 时间戳
+
+        :param data: 数据
+        """
+        with self.__lock:
+            if self.__end - self.__start == self.__capacity:
+                self.__dropped += 1
+                if self.__overflow == StackOverflowEnum.DISCARD:
+                    return
+                self.__evict()
+            sequence = self.__end
+            slot = sequence % self.__capacity
+            length = len(data)
+            if isinstance(data, bytes):
+                data = np.frombuffer(data, dtype=np.uint8)
+            self.__msg_ids[slot] = msg_id
+            self.__time_stamps[slot] = time_stamp if time_stamp is not None else np.nan
+            self.__host_times[slot] = perf_counter()
+            self.__dlc[slot] = length
+            row = self.__data[slot]
+            row[:length] = data
+            if length < self.__width:
+                row[length:] = 0
+            if msg_id not in self.__index:
+                self.__index[msg_id] = _IdIndex()
+            self.__index[msg_id].sequences.append(sequence)
+            self.__end = sequence + 1
+
+    def extend(self, msg_ids: np.ndarray, time_stamps: np.ndarray, lengths: np.ndarray, data: np.ndarray):
+        """
+        批量保存数据，由接收线程调用，数据直接从设备的接收缓存中拷贝，不需要构建Message对象
+
+        :param msg_ids: 帧ID数组
+
+        :param time_stamps: 时间戳数组
+
+        :param lengths: 数据长度数组
+
+        :param data: (N, dlc)的数据矩阵，超过数据长度的部分不会保存
+        """
+        count = len(msg_ids)
+        if count == 0:
+            return
+        with self.__lock:
+            free = self.__capacity - (self.__end - self.__start)
+            if count > free:
+                if self.__overflow == StackOverflowEnum.DISCARD:
+                    self.__dropped += count - free
+                    count = free
+                    msg_ids, time_stamps, lengths, data = msg_ids[:count], time_stamps[:count], \
+                        lengths[:count], data[:count]
+                else:
+                    if count > self.__capacity:
+                        # 一次收到的数据超过了栈的容量，只保留最新的部分
+                        skip = count - self.__capacity
+                        self.__dropped += skip
+                        count = self.__capacity
+                        msg_ids, time_stamps, lengths, data = msg_ids[skip:], time_stamps[skip:], \
+                            lengths[skip:], data[skip:]
+                    for _ in range(count - free):
+                        self.__evict()
+                    self.__dropped += count - free
+            if count == 0:
+                return
+            slots = np.arange(self.__end, self.__end + count, dtype=np.int64) % self.__capacity
+            self.__msg_ids[slots] = msg_ids
+            self.__time_stamps[slots] = time_stamps
+            self.__host_times[slots] = perf_counter()
+            self.__dlc[slots] = lengths
+            width = min(data.shape[1], self.__width)
+            columns = np.arange(width)
+            # 接收缓存会被重复使用，超过数据长度的部分可能是上一次的数据，需要清零
+            self.__data[slots, :width] = np.where(columns < lengths[:, None], data[:, :width], 0)
+            if width < self.__width:
+                self.__data[slots, width:] = 0
+            index = self.__index
+            for msg_id, sequence in zip(msg_ids.tolist(), range(self.__end, self.__end + count)):
+                if msg_id not in index:
+                    index[msg_id] = _IdIndex()
+                index[msg_id].sequences.append(sequence)
+            self.__end += count
+
+    def clear(self):
+        """
+        清空栈数据
+        """
+        with self.__lock:
+            self.__start = self.__end
+            self.__index.clear()
+
+    def msg_ids(self) -> List[int]:
+        """
+        获取栈中收到过的所有msg id
+        """
+        with self.__lock:
+            return [msg_id for msg_id, index in self.__index.items() if len(index) > 0]
+
+    def count(self, msg_id: int) -> int:
+        """
+        获取某个msg id在栈中的帧数量
+        """
+        with self.__lock:
+            return len(self.__index[msg_id]) if msg_id in self.__index else 0
+
+    def __search(self, sequences: List[int], low: int, time_stamp: float, right: bool) -> int:
+        """
+        在按时间排序的序号列表中二分查找时间戳的位置
+        """
+        high = len(sequences)
+        capacity = self.__capacity
+        time_stamps = self.__time_stamps
+        while low < high:
+            middle = (low + high) // 2
+            value = time_stamps[sequences[middle] % capacity]
+            if value < time_stamp or (right and value == time_stamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __get_slots(self, msg_id: Optional[int], start_time: Optional[float], end_time: Optional[float]) -> np.ndarray:
+        """
+        获取满足条件的帧所在的位置，需要在锁中调用
+        """
+        if msg_id is None:
+            slots = np.arange(self.__start, self.__end, dtype=np.int64) % self.__capacity
+            if start_time is not None or end_time is not None:
+                time_stamps = self.__time_stamps[slots]
+                condition = np.ones(len(slots), dtype=bool)
+                if start_time is not None:
+                    condition &= time_stamps >= start_time
+                if end_time is not None:
+                    condition &= time_stamps <= end_time
+                slots = slots[condition]
+            return slots
+        if msg_id not in self.__index:
+            return np.zeros(0, dtype=np.int64)
+        index = self.__index[msg_id]
+        sequences = index.sequences
+        # 同一个msg id的时间戳是递增的，所以可以二分查找时间窗口
+        low = index.head if start_time is None else self.__search(sequences, index.head, start_time, False)
+        high = len(sequences) if end_time is None else self.__search(sequences, low, end_time, True)
+        return np.array(sequences[low:high], dtype=np.int64) % self.__capacity
+
+    def get_array(self,
+                  msg_id: Optional[int] = None,
+                  start_time: Optional[float] = None,
+                  end_time: Optional[float] = None,
+                  host_time: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取帧的时间戳数组和(N, width)的数据矩阵(拷贝)
+
+        :param msg_id: 帧ID，为空表示所有帧
+
+        :param start_time: 开始时间(包含，设备时间戳)，为空表示不限制
+
+        :param end_time: 结束时间(包含，设备时间戳)，为空表示不限制
+
+        :param host_time: True返回保存时的主机时间(perf_counter，秒)，False返回设备的时间戳
+
+        :return: (时间戳数组, 数据矩阵)
+        """
+        with self.__lock:
+            slots = self.__get_slots(msg_id, start_time, end_time)
+            time_stamps = self.__host_times if host_time else self.__time_stamps
+            return time_stamps[slots], self.__data[slots]
+
+    def get_frames(self,
+                   msg_id: Optional[int] = None,
+                   start_time: Optional[float] = None,
+                   end_time: Optional[float] = None) -> List[Message]:
+        """
+        获取帧列表
+
+        :param msg_id: 帧ID，为空表示所有帧
+
+        :param start_time: 开始时间(包含)，为空表示不限制
+
+        :param end_time: 结束时间(包含)，为空表示不限制
+
+        :return: Message对象列表
+        """
+        with self.__lock:
+            return self.__to_messages(self.__get_slots(msg_id, start_time, end_time))
+
+    def __to_messages(self, slots: np.ndarray) -> List[Message]:
+        """
+        根据位置构建Message对象，需要在锁中调用
+        """
+        frames = zip(self.__msg_ids[slots].tolist(), self.__time_stamps[slots].tolist(), self.__dlc[slots].tolist(),
+                     self.__data[slots].tolist())
+        messages = []
+        for msg_id, time_stamp, dlc, data in frames:
+            message = Message()
+            message.msg_id = msg_id
+            message.time_stamp = time_stamp
+            message.data_length = dlc
+            message.data = data[:dlc]
+            messages.append(message)
+        return messages
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.get_frames())
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[Message, List[Message]]:
+        with self.__lock:
+            sequences = range(self.__start, self.__end)[item]
+            if isinstance(item, slice):
+                return self.__to_messages(np.array(sequences, dtype=np.int64) % self.__capacity)
+            return self.__to_messages(np.array([sequences % self.__capacity], dtype=np.int64))[0]
@@ -8,14 +8,20 @@
 # --------------------------------------------------------
 from abc import ABCMeta, abstractmethod
 from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, wait
-from typing import Tuple, Any, List
-from time import sleep
+from threading import Event
+from typing import Tuple, Any, List, Callable, Optional, Dict, Sequence
+
+import numpy as np
 
 from automotive.common.constant import check_connect, can_tips
-from automotive.logger.logger import logger
+from automotive.logger.logger import logger, is_enabled
 from .constant import dlc
-from .enums import BaudRateEnum
-from ..message import Message
+from .enums import BaudRateEnum, StackOverflowEnum
+from .frame_stack import FrameStack
+from .scheduler import TransmitScheduler, TransmitStatistics
+from .watcher import Watcher, WatcherSet
+from .receive_statistics import ReceiveMonitor, ReceiveStatistics, BusLoad
+from ..message import Message, RawFrame
 
 
 class BaseCanDevice(metaclass=ABCMeta):
@@ -80,8 +86,12 @@ class BaseCanDevice(metaclass=ABCMeta):
 
 
 class BaseCanBus(metaclass=ABCMeta):
+    # 设备时间戳的单位换算成毫秒的倍数，时间戳单位不是毫秒的设备需要重新定义
+    _time_stamp_scale = 1.0
+
     def __init__(self, baud_rate: BaudRateEnum = BaudRateEnum.HIGH, data_rate: BaudRateEnum = BaudRateEnum.DATA,
-                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300):
+                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300, stack_size: int = 1000000,
+                 stack_overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE):
         # baud_rate波特率，
         self._baud_rate = baud_rate
         # data_rate波特率， 仅canfd有用
@@ -92,14 +102,17 @@ class BaseCanBus(metaclass=ABCMeta):
         self._can_fd = can_fd
         # 最大线程数
         self._max_workers = max_workers
-        # 保存接受数据帧的字典，用于接收
-        self._receive_messages = dict()
+        # 保存每个msg id最后收到的帧，用于接收
+        self._receive_messages = dict()  # type: Dict[int, RawFrame]
         # 保存发送数据帧的字典，用于发送
         self._send_messages = dict()
-        # 保存发送的事件信号的字典，用于发送
-        self._event_send_messages = dict()
-        # 用于存放接收到的数据
-        self._stack = []
+        # 用于存放接收到的数据，固定容量，超出后根据stack_overflow处理
+        self._stack = FrameStack(stack_size, 64 if can_fd else 8, stack_overflow)
+        # 接收线程中的监听者，保存帧的时候增量检查监听条件
+        self._watchers = WatcherSet()
+        # 接收统计，保存帧的时候在线更新每个msg id的统计数据和总线负载
+        self._receive_statistics = ReceiveMonitor(self.__get_rate(baud_rate), self.__get_rate(data_rate), can_fd,
+                                                  self._time_stamp_scale)
         # 周期性信号
         self._cycle = "Cycle"
         # 事件性信号
@@ -110,16 +123,29 @@ class BaseCanBus(metaclass=ABCMeta):
         self._thread_pool = ThreadPoolExecutor(max_workers=self._max_workers)
         # 是否需要接收，用于线程关闭
         self._need_receive = True
+        # 是否已经调用open_can
+        self._running = False
         # 是否需要一直发送
         self._need_transmit = True
-        # 发送线程
+        # 发送线程(发送调度器所在的线程)
         self._transmit_thread = []
         # 接收线程
         self._receive_thread = []
-        # 事件信号线程
-        self._event_thread = dict()
+        # 接收通知，设备收到数据或者关闭设备的时候唤醒接收线程
+        self._receive_event = Event()
+        # 设备中没有数据的时候最短和最长的等待时间(秒)，持续没有数据时等待时间逐步加倍
+        self._min_receive_wait = 0.0005
+        self._max_receive_wait = 0.01
+        # 发送调度器，所有周期信号和事件信号都在一个线程中按照计划时间发送
+        self._scheduler = TransmitScheduler(self.__transmit)
+        # 在发送调度器中注册的发送者
+        self._owner = 0
+        # 是否和其他设备共用发送调度器，共用的时候调度线程由外部启动和停止
+        self._shared_scheduler = False
         # dlc对应关系
         self._dlc = dlc
+        # dlc对应的数据长度，下标为dlc
+        self._dlc_lengths = np.array(sorted(dlc, key=dlc.get), dtype=np.uint8)
         # can实例化的对象
         self._can = None
 
@@ -131,37 +157,71 @@ class BaseCanBus(metaclass=ABCMeta):
     def thread_pool(self) -> ThreadPoolExecutor:
         return self._thread_pool
 
+    @property
+    def is_running(self) -> bool:
+        """
+        是否已经调用open_can(接收和发送线程正在运行)
+        """
+        return self._running
+
+    @staticmethod
+    def __get_rate(rate) -> int:
+        """
+        获取速率(kbps)
+        """
+        return rate.value if isinstance(rate, BaudRateEnum) else int(rate)
+
     def _get_dlc_length(self, dlc_length: int) -> int:
         for key, value in self._dlc.items():
             if dlc_length == value:
                 return key
         raise RuntimeError(f"dlc {dlc} not support, only support {self._dlc.keys()}")
 
-    def __transmit(self, can: BaseCanDevice, message: Message, cycle_time: float):
+    def _save_frames(self, msg_ids: np.ndarray, time_stamps: np.ndarray, lengths: np.ndarray,
+                     data: np.ndarray) -> Dict[int, int]:
+        """
+        批量保存接收到的帧到栈中，由设备的读取函数调用
+
+        :param msg_ids: 帧ID数组
+
+        :param time_stamps: 时间戳数组
+
+        :param lengths: 数据长度数组
+
+        :param data: (N, dlc)的数据矩阵
+
+        :return: 每个msg id最后一帧在数组中的位置，设备根据该位置更新_receive_messages
         """
-        CAN发送帧函数，在线程中执行。
+        self._stack.extend(msg_ids, time_stamps, lengths, data)
+        self._receive_statistics.add_frames(msg_ids, time_stamps, lengths)
+        self._watchers.feed(msg_ids, time_stamps, lengths, data)
+        return dict((msg_id, index) for index, msg_id in enumerate(msg_ids.tolist()))
 
-        :param can can设备实例化
+    def _save_frame(self, frame: RawFrame):
+        """
+        保存接收到的一帧到栈中，由每次只能处理一帧的设备的读取函数调用
+
+        :param frame: 接收到的帧
+        """
+        self._receive_messages[frame.msg_id] = frame
+        self._stack.append(frame.msg_id, frame.time_stamp, frame.data)
+        self._receive_statistics.add_frame(frame.msg_id, frame.time_stamp, frame.data_length)
+        self._watchers.feed_frame(frame.msg_id, frame.time_stamp, frame.data)
+
+    def __transmit(self, message: Message):
+        """
+        CAN发送帧函数，在发送调度线程中执行。
 
         :param message: message
         """
-        logger.trace(f"cycle_time = {cycle_time}")
-        msg_id = message.msg_id
-        while can.is_open and not message.stop_flag and self._need_transmit:
-            logger.debug(f"send msg {hex(msg_id)} and cycle time is {message.cycle_time}")
-            try:
-                can.transmit(message)
-            except RuntimeError as e:
-                logger.trace(f"some issue found, error is {e}")
-            # 循环发送的等待周期
-            sleep(cycle_time)
+        if is_enabled("trace"):
+            logger.trace(f"send msg {hex(message.msg_id)} and cycle time is {message.cycle_time}")
+        self._can.transmit(message)
 
-    def __cycle_msg(self, can: BaseCanDevice, message: Message):
+    def __cycle_msg(self, message: Message):
         """
         发送周期性型号
 
-        :param can can设备实例化
-
         :param message: message的集合对象
         """
         msg_id = message.msg_id
@@ -171,68 +231,80 @@ class BaseCanBus(metaclass=ABCMeta):
         condition2 = msg_id in self._send_messages and self._send_messages[msg_id].stop_flag
         logger.debug(f"condition1[{condition1}] and condition2 = [{condition2}]")
         if condition1 or condition2:
+            if not message.cycle_time or message.cycle_time <= 0:
+                # DBC中没有周期时间(或者为0)的周期信号不能周期发送，只发送一次，不影响其他消息的发送
+                logger.warning(f"cycle time of {hex(msg_id)} is [{message.cycle_time}], only send once")
+                self._scheduler.add_event(message, 1, 0, self._owner)
+                return
             # 周期信号
             self._send_messages[msg_id] = message
             data = message.data
             hex_msg_id = hex(msg_id)
-            cycle_time = message.cycle_time / 1000.0
             message.stop_flag = False
             # 周期性发送
             logger.info(f"****** Transmit [Cycle] {hex_msg_id} : {list(map(lambda x: hex(x), data))}"
                         f"Circle time is {message.cycle_time}ms ******")
-            task = self._thread_pool.submit(self.__transmit, can, message, cycle_time)
-            self._transmit_thread.append(task)
+            self._scheduler.add_cycle(message, self._owner)
         else:
-            # 周期事件信号，当周期信号发送的时候，只在变化data的时候会进行快速发送消息
+            # 已经在里面了，所以修改data值而已
+            send_message = self._send_messages[msg_id]
+            if send_message is not message:
+                send_message.data = message.data
+                send_message.mark_modified()
+            # 周期事件信号，当周期信号发送的时候，只在变化data的时候会进行快速发送消息，快速发送完成后恢复周期发送
             if message.msg_send_type == self._cycle_event:
-                # 暂停已发送的消息
-                self.stop_transmit(msg_id)
-                self._send_messages[msg_id].data = message.data
-                self.__event(can, message)
-                # 发送完成了周期性事件信号，恢复信号发送
-                self.resume_transmit(msg_id)
-            else:
-                # 已经在里面了，所以修改data值而已
-                self._send_messages[msg_id].data = message.data
+                self.__event(self._send_messages[msg_id])
 
-    def __event_transmit(self, can: BaseCanDevice, msg_id: int, cycle_time: float):
-        """
-        事件信号发送线程
-        :return:
-        """
-        # 需要发送数据以及当前还有数据可以发送
-        while self._need_transmit and msg_id in self._event_send_messages and len(
-                self._event_send_messages[msg_id]) > 0:
-            message = self._event_send_messages[msg_id].pop(0)
-            can.transmit(message)
-            logger.debug(f"****** Transmit [Event] {msg_id} : {list(map(lambda x: hex(x), message.data))}"
-                         f"Event Cycle time [{message.cycle_time_fast}]")
-            sleep(cycle_time)
-
-    def __event(self, can: BaseCanDevice, message: Message):
+    def __event(self, message: Message):
         """
         发送事件信号
-        :param can can设备实例化
+
         :param message: message的集合对象
         """
-        msg_id = message.msg_id
-        cycle_time = message.cycle_time_fast / 1000.0
         # 事件信号
         event_times = message.cycle_time_fast_times if message.cycle_time_fast_times > 0 else 1
-        # 构建消息列表
-        messages = []
-        for i in range(event_times):
-            messages.append(message)
-        # 第一次发送
-        if msg_id not in self._event_send_messages:
-            self._event_send_messages[msg_id] = messages
-            # 第一次发送，所以需要新开线程
-            self._event_thread[msg_id] = self._thread_pool.submit(self.__event_transmit, can, msg_id, cycle_time)
-        else:
-            self._event_send_messages[msg_id] += messages
-            # 判断消息是否发送完成，若发送完成则需要新开线程，否则继续使用老的线程发送
-            if self._event_thread[msg_id].done():
-                self._event_thread[msg_id] = self._thread_pool.submit(self.__event_transmit, can, msg_id, cycle_time)
+        if is_enabled("debug"):
+            logger.debug(f"****** Transmit [Event] {hex(message.msg_id)} : "
+                         f"{list(map(lambda x: hex(x), message.data))}"
+                         f"Event Cycle time [{message.cycle_time_fast}] and times [{event_times}]")
+        self._scheduler.add_event(message, event_times, message.cycle_time_fast, self._owner)
+
+    def notify_receive(self):
+        """
+        通知接收线程设备中有新的数据，支持回调或者事件的设备可以调用该方法立即唤醒接收线程
+        """
+        self._receive_event.set()
+
+    def _receive(self, read: Callable[[], int]):
+        """
+        CAN接收帧函数，在接收线程中执行，所有设备共用
+
+        1、read每次从设备中读取数据并保存，返回读取到的帧数量，没有数据的时候返回0或者抛出RuntimeError
+
+        2、读取到数据的时候立即继续读取，直到把设备中的数据读完
+
+        3、设备中没有数据的时候等待接收通知，等待时间从_min_receive_wait开始，持续没有数据则加倍，最长为_max_receive_wait
+
+        4、有监听者的时候每次读取前检查一次超时以及消息丢失等和时间有关的条件
+
+        :param read: 读取函数
+        """
+        wait_time = self._min_receive_wait
+        while self._can.is_open and self._need_receive:
+            self._watchers.poll()
+            try:
+                count = read()
+            except RuntimeError as e:
+                logger.trace(e)
+                count = 0
+            if count > 0:
+                wait_time = self._min_receive_wait
+                continue
+            if self._receive_event.wait(wait_time):
+                self._receive_event.clear()
+                wait_time = self._min_receive_wait
+            else:
+                wait_time = min(wait_time * 2, self._max_receive_wait)
 
     def _open_can(self):
         """
@@ -243,10 +315,29 @@ class BaseCanBus(metaclass=ABCMeta):
             self._thread_pool = ThreadPoolExecutor(max_workers=self._max_workers)
         # 开启设备的接收线程
         self._need_receive = True
+        self._running = True
+        self._receive_event.clear()
         # 开启设备的发送线程
         self._need_transmit = True
-        # 打开设备，并初始化设备
-        self._can.open_device(baud_rate=self._baud_rate, data_rate=self._data_rate, channel=self._channel_index)
+        # 打开设备，并初始化设备(自动查找CAN盒子的时候设备已经打开)
+        if not self._can.is_open:
+            self._can.open_device(baud_rate=self._baud_rate, data_rate=self._data_rate, channel=self._channel_index)
+        # 开启发送调度线程
+        if self._shared_scheduler:
+            self._scheduler.clear(self._owner)
+        else:
+            self._scheduler.start()
+            self._transmit_thread.append(self._thread_pool.submit(self._scheduler.run))
+
+    def set_scheduler(self, scheduler: TransmitScheduler):
+        """
+        和其他设备共用发送调度器，需要在open_can之前调用，调度线程由调用者启动和停止
+
+        :param scheduler: 发送调度器
+        """
+        self._scheduler = scheduler
+        self._owner = scheduler.register(self.__transmit)
+        self._shared_scheduler = True
 
     @abstractmethod
     def open_can(self):
@@ -260,18 +351,27 @@ class BaseCanBus(metaclass=ABCMeta):
             关闭USB CAN设备。
         """
         self._need_transmit = False
+        self._running = False
+        if self._shared_scheduler:
+            self._scheduler.remove(owner=self._owner)
+        else:
+            self._scheduler.stop()
         logger.trace("wait _transmit_thread close")
         wait(self._transmit_thread, return_when=ALL_COMPLETED)
         self._need_receive = False
+        # 唤醒正在等待数据的接收线程
+        self._receive_event.set()
         logger.trace("wait _receive_thread close")
         wait(self._receive_thread, return_when=ALL_COMPLETED)
-        logger.trace("wait _event_thread close")
-        wait(self._event_thread.values(), return_when=ALL_COMPLETED)
+        # 设备关闭后不会再收到数据，取消所有的监听
+        self._watchers.remove()
         if self._thread_pool:
             logger.info("shutdown thread pool")
             self._thread_pool.shutdown()
         logger.trace("_send_messages clear")
         self._send_messages.clear()
+        self._transmit_thread.clear()
+        self._receive_thread.clear()
         self._thread_pool = None
         logger.trace("close_device")
         self._can.close_device()
@@ -288,15 +388,26 @@ class BaseCanBus(metaclass=ABCMeta):
         if message.msg_send_type == self._cycle or cycle_time > 0:
             logger.debug("cycle send message")
             # 周期信号
-            self.__cycle_msg(self._can, message)
+            self.__cycle_msg(message)
         elif message.msg_send_type == self._event:
             logger.debug("event send message")
             # 事件信号
-            self.__event(self._can, message)
+            self.__event(message)
         elif message.msg_send_type == self._cycle_event:
             logger.debug("cycle&event send message")
             # 周期事件信号
-            self.__cycle_msg(self._can, message)
+            self.__cycle_msg(message)
+
+    @check_connect("_can", can_tips, is_bus=True)
+    def transmit_batch(self, messages: Sequence[Message]):
+        """
+        批量发送CAN帧，所有帧加入发送调度器后在同一次调度中连续发送
+
+        :param messages: message对象列表
+        """
+        with self._scheduler.batch():
+            for message in messages:
+                self.transmit(message)
 
     @check_connect("_can", can_tips, is_bus=True)
     def transmit_one(self, message: Message):
@@ -325,7 +436,7 @@ class BaseCanBus(metaclass=ABCMeta):
             if message_id in self._send_messages:
                 logger.info(f"Message <{hex(message_id)}> is stop to send.")
                 self._send_messages[message_id].stop_flag = True
-                # self._send_messages[message_id].pause_flag = True
+                self._scheduler.remove(message_id, self._owner)
             else:
                 logger.error(f"Please check message id, Message <{hex(message_id)}> is not contain.")
         else:
@@ -333,7 +444,7 @@ class BaseCanBus(metaclass=ABCMeta):
             for key, item in self._send_messages.items():
                 logger.info(f"Message <{hex(key)}> is stop to send.")
                 item.stop_flag = True
-                # item.pause_flag = True
+            self._scheduler.remove(owner=self._owner)
 
     @check_connect("_can", can_tips, is_bus=True)
     def resume_transmit(self, message_id: int):
@@ -370,12 +481,70 @@ class BaseCanBus(metaclass=ABCMeta):
         :return: Message对象
         """
         if message_id in self._receive_messages:
-            return self._receive_messages[message_id]
+            return self._receive_messages[message_id].to_message()
         else:
             raise RuntimeError(f"message_id {message_id} not receive")
 
+    def add_watcher(self, watcher: Watcher) -> Watcher:
+        """
+        添加监听者，接收线程保存帧的时候增量检查条件，条件满足或者超时的时候完成并自动移除
+
+        :param watcher: 监听者
+
+        :return: 监听者
+        """
+        return self._watchers.add(watcher)
+
+    def remove_watcher(self, watcher: Optional[Watcher] = None):
+        """
+        移除并取消监听者
+
+        :param watcher: 监听者，为空表示所有的监听者
+        """
+        self._watchers.remove(watcher)
+
+    def set_receive_expected(self, expected: Dict[int, Tuple[float, Optional[int]]]):
+        """
+        设置每个msg id期望的周期时间(毫秒)和数据长度，用于接收统计中的丢帧数量、间隔分布和DLC错误
+
+        :param expected: {msg_id: (cycle_time, data_length)}
+        """
+        self._receive_statistics.set_expected(expected)
+
+    def get_receive_statistics(self, message_id: Optional[int] = None) -> Dict[int, ReceiveStatistics]:
+        """
+        获取接收统计(帧数量、DLC错误、丢帧数量、帧间隔的均值/最小/最大值/抖动以及分布，单位毫秒)
+
+        :param message_id: 帧ID，为空表示所有收到过的帧
+
+        :return: {msg_id: 统计数据}
+        """
+        return self._receive_statistics.get(message_id)
+
+    def get_bus_load(self) -> BusLoad:
+        """
+        获取总线负载
+        """
+        return self._receive_statistics.bus_load
+
+    def clear_receive_statistics(self):
+        """
+        清空接收统计
+        """
+        self._receive_statistics.clear()
+
+    def get_transmit_statistics(self, message_id: Optional[int] = None) -> Dict[int, TransmitStatistics]:
+        """
+        获取发送统计(发送次数、延迟、实际周期以及抖动)
+
+        :param message_id: 帧ID，为空表示所有发送过的帧
+
+        :return: {msg_id: 统计数据}
+        """
+        return self._scheduler.get_statistics(message_id, self._owner)
+
     @check_connect("_can", can_tips, is_bus=True)
-    def get_stack(self) -> List[Message]:
+    def get_stack(self) -> FrameStack:
         """
         获取CAN的stack
         """
@@ -0,0 +1,424 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        receive_statistics.py
+# @Author:      lizhe
+# @Created:     2022/3/26 - 16:08
+# --------------------------------------------------------
+from bisect import bisect_right
+from math import sqrt
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Optional, List, Tuple
+
+import numpy as np
+
+"""
+接收统计
+
+接收线程保存帧的同时在线更新每个msg id的统计数据(帧数量、DLC错误、帧间隔的均值/标准差/最小/最大值、间隔分布以及估算的丢帧数量)
+
+和总线负载，每个msg id只占用固定大小的内存，不需要保存帧，任何时候都可以O(1)获取某个msg id的统计数据。
+"""
+
+# 有周期时间的帧按照 间隔/周期 的比例统计分布，如第3个桶表示间隔在0.9~1.1个周期之间
+_cycle_ratio_edges = 0.5, 0.8, 0.9, 1.1, 1.2, 1.5, 2.0, 3.0
+# 没有周期时间的帧按照间隔的绝对时间(毫秒)统计分布
+_gap_edges = 1, 5, 10, 20, 50, 100, 200, 500, 1000
+# 标准帧和扩展帧除数据外的位数(不计算填充位)
+_standard_frame_bits = 47
+_extended_frame_bits = 67
+# CAN FD帧在仲裁速率下传输的位数以及在数据速率下除数据外传输的位数(CRC、DLC等，不计算填充位)
+_fd_arbitration_bits = 30
+_fd_data_bits = 30
+
+
+class ReceiveStatistics(object):
+    """
+    单个msg id的接收统计，时间单位为毫秒(设备时间戳换算)
+
+    gap表示相邻两帧的间隔，histogram为间隔的分布，有周期时间的时候按照间隔和周期的比例分桶(_cycle_ratio_edges)，
+
+    否则按照间隔的绝对时间分桶(_gap_edges)
+    """
+    __slots__ = ("cycle_time", "data_length", "count", "dlc_errors", "lost", "gap_min", "gap_max", "first_time",
+                 "last_time", "histogram", "__edges", "__gap_count", "__gap_mean", "__gap_m2")
+
+    def __init__(self, cycle_time: float = 0, data_length: Optional[int] = None):
+        """
+        :param cycle_time: 期望的周期时间(毫秒)，0表示非周期帧
+
+        :param data_length: 期望的数据长度，为空的时候不检查
+        """
+        self.cycle_time = cycle_time
+        self.data_length = data_length
+        # 收到的帧数量
+        self.count = 0
+        # 数据长度和期望不一致的帧数量
+        self.dlc_errors = 0
+        # 根据间隔估算的丢帧数量(仅周期帧)
+        self.lost = 0
+        self.gap_min = 0.0
+        self.gap_max = 0.0
+        self.first_time = None  # type: Optional[float]
+        self.last_time = None  # type: Optional[float]
+        self.__edges = [ratio * cycle_time for ratio in _cycle_ratio_edges] if cycle_time > 0 else list(_gap_edges)
+        self.histogram = [0] * (len(self.__edges) + 1)
+        self.__gap_count = 0
+        self.__gap_mean = 0.0
+        self.__gap_m2 = 0.0
+
+    @property
+    def edges(self) -> List[float]:
+        """
+        间隔分布的桶边界(毫秒)，histogram[i]表示间隔在edges[i-1]~edges[i]之间的数量
+        """
+        return self.__edges
+
+    @property
+    def gap_mean(self) -> float:
+        return self.__gap_mean
+
+    @property
+    def jitter(self) -> float:
+        """
+        间隔的标准差(毫秒)
+        """
+        return sqrt(self.__gap_m2 / self.__gap_count) if self.__gap_count > 1 else 0.0
+
+    def add_frame(self, time_stamp: float, length: int):
+        """
+        记录一帧(Welford算法计算间隔的均值和方差)，每帧只做标量运算，批量收到的帧使用add_frames
+
+        :param time_stamp: 时间(毫秒)
+
+        :param length: 数据长度
+        """
+        self.count += 1
+        if self.data_length is not None and length != self.data_length:
+            self.dlc_errors += 1
+        last_time = self.last_time
+        self.last_time = time_stamp
+        if last_time is None:
+            self.first_time = time_stamp
+            return
+        gap = time_stamp - last_time
+        self.__gap_count += 1
+        if self.__gap_count == 1:
+            self.gap_min = self.gap_max = gap
+        elif gap < self.gap_min:
+            self.gap_min = gap
+        elif gap > self.gap_max:
+            self.gap_max = gap
+        delta = gap - self.__gap_mean
+        self.__gap_mean += delta / self.__gap_count
+        self.__gap_m2 += delta * (gap - self.__gap_mean)
+        self.histogram[bisect_right(self.__edges, gap)] += 1
+        if self.cycle_time > 0 and gap > self.cycle_time * 1.5:
+            self.lost += int(round(gap / self.cycle_time)) - 1
+
+    def add_frames(self, time_stamps: np.ndarray, lengths: np.ndarray):
+        """
+        批量记录同一个msg id的多帧，结果和逐帧调用add_frame一致
+
+        间隔的均值和方差先在这一批中计算，再和已有的统计合并(Chan的并行方差合并公式)
+
+        :param time_stamps: 时间数组(毫秒)
+
+        :param lengths: 数据长度数组
+        """
+        size = len(time_stamps)
+        if size == 0:
+            return
+        self.count += size
+        if self.data_length is not None:
+            self.dlc_errors += int(np.count_nonzero(lengths != self.data_length))
+        if self.last_time is None:
+            self.first_time = float(time_stamps[0])
+            gaps = np.diff(time_stamps)
+        else:
+            gaps = np.diff(time_stamps, prepend=self.last_time)
+        self.last_time = float(time_stamps[-1])
+        gap_count = len(gaps)
+        if gap_count == 0:
+            return
+        gap_min, gap_max = float(gaps.min()), float(gaps.max())
+        if self.__gap_count == 0:
+            self.gap_min, self.gap_max = gap_min, gap_max
+        else:
+            self.gap_min = min(self.gap_min, gap_min)
+            self.gap_max = max(self.gap_max, gap_max)
+        mean = float(gaps.mean())
+        m2 = float(np.square(gaps - mean).sum())
+        total = self.__gap_count + gap_count
+        delta = mean - self.__gap_mean
+        self.__gap_m2 += m2 + delta * delta * self.__gap_count * gap_count / total
+        self.__gap_mean += delta * gap_count / total
+        self.__gap_count = total
+        counts = np.bincount(np.searchsorted(self.__edges, gaps, side="right"), minlength=len(self.histogram))
+        self.histogram = [count + int(added) for count, added in zip(self.histogram, counts)]
+        if self.cycle_time > 0:
+            lost_gaps = gaps[gaps > self.cycle_time * 1.5]
+            if len(lost_gaps):
+                self.lost += int((np.rint(lost_gaps / self.cycle_time) - 1).sum())
+
+    def __repr__(self):
+        return f"count={self.count}, dlc_errors={self.dlc_errors}, lost={self.lost}, gap(mean={self.gap_mean:.3f}ms, " \
+               f"min={self.gap_min:.3f}ms, max={self.gap_max:.3f}ms, jitter={self.jitter:.3f}ms), " \
+               f"histogram={self.histogram}"
+
+
+class BusLoad(object):
+    """
+    总线负载，按照主机时间划分固定长度的窗口，每个窗口根据收到帧的位数和波特率计算负载(不计算填充位，实际负载略高)
+
+    只保存最近history个窗口的负载
+    """
+
+    def __init__(self, baud_rate: int, data_rate: int, can_fd: bool, window: float = 1.0, history: int = 60):
+        """
+        :param baud_rate: 仲裁速率(kbps)
+
+        :param data_rate: 数据速率(kbps)，仅CAN FD有用
+
+        :param can_fd: 是否CAN FD
+
+        :param window: 窗口长度(秒)
+
+        :param history: 保存的窗口数量
+        """
+        self.__baud_rate = baud_rate * 1000
+        # 数据速率下的一位相当于仲裁速率下的位数
+        self.__data_ratio = baud_rate / data_rate if can_fd else 1.0
+        self.__can_fd = can_fd
+        self.__window = window
+        self.__loads = np.zeros(history, dtype=np.float64)
+        # 已经完成的窗口数量
+        self.__windows = 0
+        self.__window_start = perf_counter()
+        self.__bits = 0.0
+        self.__peak = 0.0
+
+    @property
+    def window(self) -> float:
+        return self.__window
+
+    @property
+    def load(self) -> float:
+        """
+        最近一个完成的窗口的负载(百分比)
+        """
+        return float(self.__loads[(self.__windows - 1) % len(self.__loads)]) if self.__windows > 0 else 0.0
+
+    @property
+    def peak(self) -> float:
+        """
+        所有窗口中的最大负载(百分比)
+        """
+        return self.__peak
+
+    @property
+    def current(self) -> float:
+        """
+        当前未完成的窗口到现在为止的负载(百分比)
+        """
+        elapsed = perf_counter() - self.__window_start
+        return self.__bits / (elapsed * self.__baud_rate) * 100 if elapsed > 0 else 0.0
+
+    def history(self) -> List[float]:
+        """
+        最近完成的窗口的负载(百分比)，按时间顺序
+        """
+        size = len(self.__loads)
+        count = min(self.__windows, size)
+        indexes = np.arange(self.__windows - count, self.__windows) % size
+        return self.__loads[indexes].tolist()
+
+    def __roll(self, now: float):
+        """
+        完成已经结束的窗口，中间没有帧的窗口负载为0
+        """
+        while now - self.__window_start >= self.__window:
+            load = self.__bits / (self.__window * self.__baud_rate) * 100
+            self.__loads[self.__windows % len(self.__loads)] = load
+            if load > self.__peak:
+                self.__peak = load
+            self.__windows += 1
+            self.__bits = 0.0
+            self.__window_start += self.__window
+            if now - self.__window_start >= self.__window * len(self.__loads):
+                # 长时间没有数据，跳过中间的窗口
+                skipped = int((now - self.__window_start) // self.__window) - len(self.__loads)
+                self.__windows += skipped
+                self.__window_start += skipped * self.__window
+
+    def __frame_bits(self, msg_ids: np.ndarray, lengths: np.ndarray) -> float:
+        """
+        计算帧在仲裁速率下占用的位数
+        """
+        extended = (msg_ids > 0x7FF).astype(np.float64)
+        if self.__can_fd:
+            header = _fd_arbitration_bits + extended * (_extended_frame_bits - _standard_frame_bits)
+            data = (lengths.astype(np.float64) * 8 + _fd_data_bits) * self.__data_ratio
+            return float((header + data).sum())
+        header = _standard_frame_bits + extended * (_extended_frame_bits - _standard_frame_bits)
+        return float((header + lengths.astype(np.float64) * 8).sum())
+
+    def add_frames(self, msg_ids: np.ndarray, lengths: np.ndarray):
+        """
+        记录收到的帧
+
+        :param msg_ids: 帧ID数组
+
+        :param lengths: 数据长度数组
+        """
+        self.__roll(perf_counter())
+        self.__bits += self.__frame_bits(msg_ids, lengths)
+
+    def add_frame(self, msg_id: int, length: int):
+        """
+        记录收到的一帧
+
+        :param msg_id: 帧ID
+
+        :param length: 数据长度
+        """
+        self.__roll(perf_counter())
+        extended = msg_id > 0x7FF
+        if self.__can_fd:
+            bits = _fd_arbitration_bits + (length * 8 + _fd_data_bits) * self.__data_ratio
+        else:
+            bits = _standard_frame_bits + length * 8
+        if extended:
+            bits += _extended_frame_bits - _standard_frame_bits
+        self.__bits += bits
+
+    def update(self):
+        """
+        没有收到帧的时候也完成已经结束的窗口，查询之前调用
+        """
+        self.__roll(perf_counter())
+
+    def clear(self):
+        """
+        清空所有窗口的负载以及最大负载，从现在开始重新统计
+        """
+        self.__loads[:] = 0
+        self.__windows = 0
+        self.__window_start = perf_counter()
+        self.__bits = 0.0
+        self.__peak = 0.0
+
+
+class ReceiveMonitor(object):
+    """
+    接收统计引擎，由接收线程调用，按照msg id保存ReceiveStatistics并计算总线负载
+    """
+
+    def __init__(self, baud_rate: int, data_rate: int, can_fd: bool, time_scale: float = 1.0,
+                 window: float = 1.0, history: int = 60):
+        """
+        :param baud_rate: 仲裁速率(kbps)
+
+        :param data_rate: 数据速率(kbps)
+
+        :param can_fd: 是否CAN FD
+
+        :param time_scale: 设备时间戳的单位换算成毫秒的倍数，如微秒为0.001
+
+        :param window: 总线负载的窗口长度(秒)
+
+        :param history: 总线负载保存的窗口数量
+        """
+        self.__time_scale = time_scale
+        self.__statistics = dict()  # type: Dict[int, ReceiveStatistics]
+        # 期望的周期时间和数据长度
+        self.__expected = dict()  # type: Dict[int, Tuple[float, Optional[int]]]
+        self.__bus_load = BusLoad(baud_rate, data_rate, can_fd, window, history)
+        self.__lock = Lock()
+
+    @property
+    def bus_load(self) -> BusLoad:
+        with self.__lock:
+            self.__bus_load.update()
+        return self.__bus_load
+
+    def set_expected(self, expected: Dict[int, Tuple[float, Optional[int]]]):
+        """
+        设置每个msg id期望的周期时间(毫秒)和数据长度，用于计算丢帧数量、间隔分布和DLC错误，已经有的统计数据会被清空
+
+        :param expected: {msg_id: (cycle_time, data_length)}
+        """
+        with self.__lock:
+            self.__expected = dict(expected)
+            self.__statistics.clear()
+
+    def __get(self, msg_id: int) -> ReceiveStatistics:
+        """
+        获取msg id的统计数据，不存在的时候创建，需要在锁中调用
+        """
+        statistics = self.__statistics.get(msg_id)
+        if statistics is None:
+            cycle_time, data_length = self.__expected.get(msg_id, (0, None))
+            statistics = ReceiveStatistics(cycle_time, data_length)
+            self.__statistics[msg_id] = statistics
+        return statistics
+
+    def add_frames(self, msg_ids: np.ndarray, time_stamps: np.ndarray, lengths: np.ndarray):
+        """
+        记录批量收到的帧
+
+        :param msg_ids: 帧ID数组
+
+        :param time_stamps: 设备时间戳数组
+
+        :param lengths: 数据长度数组
+        """
+        if len(msg_ids) == 0:
+            return
+        time_stamps = np.asarray(time_stamps, dtype=np.float64) * self.__time_scale
+        # 按照msg id分组(稳定排序保持每组内的接收顺序)，每个msg id只做一次批量计算
+        order = np.argsort(msg_ids, kind="stable")
+        unique_ids, starts = np.unique(msg_ids[order], return_index=True)
+        groups = np.split(order, starts[1:])
+        with self.__lock:
+            self.__bus_load.add_frames(msg_ids, lengths)
+            for msg_id, rows in zip(unique_ids.tolist(), groups):
+                self.__get(msg_id).add_frames(time_stamps[rows], lengths[rows])
+
+    def add_frame(self, msg_id: int, time_stamp: Optional[float], length: int):
+        """
+        记录收到的一帧
+
+        :param msg_id: 帧ID
+
+        :param time_stamp: 设备时间戳
+
+        :param length: 数据长度
+        """
+        with self.__lock:
+            self.__bus_load.add_frame(msg_id, length)
+            if time_stamp is not None:
+                self.__get(msg_id).add_frame(time_stamp * self.__time_scale, length)
+
+    def get(self, msg_id: Optional[int] = None) -> Dict[int, ReceiveStatistics]:
+        """
+        获取接收统计
+
+        :param msg_id: 帧ID，为空表示所有收到过的帧
+
+        :return: {msg_id: 统计数据}
+        """
+        with self.__lock:
+            if msg_id is None:
+                return dict(self.__statistics)
+            return {msg_id: self.__statistics[msg_id]} if msg_id in self.__statistics else dict()
+
+    def clear(self):
+        """
+        清空所有的统计数据(包括总线负载)
+        """
+        with self.__lock:
+            self.__statistics.clear()
+            self.__bus_load.clear()
@@ -0,0 +1,408 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        scheduler.py
+# @Author:      lizhe
+# @Created:     2022/3/17 - 20:35
+# --------------------------------------------------------
+import heapq
+from contextlib import contextmanager
+from math import sqrt
+from threading import Condition
+from time import perf_counter_ns
+from typing import Dict, Optional, Callable, List, Tuple
+
+from automotive.logger.logger import logger
+from ..message import Message
+
+# 1毫秒对应的纳秒数
+_ns_per_ms = 1000000
+
+
+class TransmitStatistics(object):
+    """
+    单个msg id的发送统计
+
+    lateness表示实际发送时间和计划发送时间的差值(毫秒)，period表示相邻两次周期发送的实际间隔(毫秒)
+    """
+    __slots__ = ("count", "missed", "lateness_max", "__lateness_mean", "__lateness_m2",
+                 "period_min", "period_max", "__period_count", "__period_mean", "__period_m2")
+
+    def __init__(self):
+        # 发送次数
+        self.count = 0
+        # 由于调度不及时被跳过的周期数
+        self.missed = 0
+        self.lateness_max = 0.0
+        self.__lateness_mean = 0.0
+        self.__lateness_m2 = 0.0
+        self.period_min = 0.0
+        self.period_max = 0.0
+        self.__period_count = 0
+        self.__period_mean = 0.0
+        self.__period_m2 = 0.0
+
+    def add_lateness(self, lateness: float):
+        """
+        记录一次发送的延迟(Welford算法计算均值和方差)
+
+        :param lateness: 延迟(毫秒)
+        """
+        self.count += 1
+        delta = lateness - self.__lateness_mean
+        self.__lateness_mean += delta / self.count
+        self.__lateness_m2 += delta * (lateness - self.__lateness_mean)
+        if lateness > self.lateness_max:
+            self.lateness_max = lateness
+
+    def add_period(self, period: float):
+        """
+        记录一次周期发送的实际间隔
+
+        :param period: 间隔(毫秒)
+        """
+        self.__period_count += 1
+        if self.__period_count == 1:
+            self.period_min = self.period_max = period
+        else:
+            self.period_min = min(self.period_min, period)
+            self.period_max = max(self.period_max, period)
+        delta = period - self.__period_mean
+        self.__period_mean += delta / self.__period_count
+        self.__period_m2 += delta * (period - self.__period_mean)
+
+    @property
+    def lateness_mean(self) -> float:
+        return self.__lateness_mean
+
+    @property
+    def lateness_std(self) -> float:
+        return sqrt(self.__lateness_m2 / self.count) if self.count > 1 else 0.0
+
+    @property
+    def period_mean(self) -> float:
+        return self.__period_mean
+
+    @property
+    def jitter(self) -> float:
+        """
+        周期抖动(实际间隔的标准差，毫秒)
+        """
+        return sqrt(self.__period_m2 / self.__period_count) if self.__period_count > 1 else 0.0
+
+    def __repr__(self):
+        return f"count={self.count}, missed={self.missed}, lateness(mean={self.lateness_mean:.3f}ms, " \
+               f"max={self.lateness_max:.3f}ms), period(mean={self.period_mean:.3f}ms, min={self.period_min:.3f}ms, " \
+               f"max={self.period_max:.3f}ms, jitter={self.jitter:.3f}ms)"
+
+
+class _TransmitTask(object):
+    """
+    单个msg id的发送任务，周期发送和事件发送共用一个任务，事件帧发送完成后继续周期发送
+    """
+    __slots__ = ("message", "owner", "sequence", "cycle", "event", "event_times", "deadline", "last_cycle",
+                 "generation", "statistics")
+
+    def __init__(self, message: Message, owner: int, sequence: int):
+        self.message = message
+        # 发送者(注册的发送函数)
+        self.owner = owner
+        # 任务的唯一序号，用于在堆中区分不同的任务
+        self.sequence = sequence
+        # 周期(纳秒)，0表示没有周期发送
+        self.cycle = 0
+        # 事件帧的周期(纳秒)
+        self.event = 0
+        # 剩余需要发送的事件帧数量
+        self.event_times = 0
+        # 下一次发送的计划时间(纳秒)
+        self.deadline = 0
+        # 上一次周期发送的实际时间(纳秒)
+        self.last_cycle = 0
+        # 每次重新调度加1，堆中代数不一致的项已经失效
+        self.generation = 0
+        self.statistics = TransmitStatistics()
+
+    @property
+    def is_active(self) -> bool:
+        return self.cycle > 0 or self.event_times > 0
+
+
+class TransmitScheduler(object):
+    """
+    CAN消息发送调度器，所有周期信号和事件信号都在一个线程中发送
+
+    1、所有任务按照下一次发送的绝对时间(perf_counter_ns)放在堆中，每次唤醒把到期的任务一起发送
+
+    2、下一次发送时间在计划时间的基础上累加周期，不会由于发送耗时产生累计误差，落后超过一个周期的时候跳过错过的周期
+
+    3、距离下一次发送时间小于spin_time的时候不再睡眠，忙等待到发送时间，减少系统睡眠精度带来的抖动
+
+    4、多个CAN设备可以共用一个调度器，每个设备通过register注册自己的发送函数，任务按照(owner, msg id)区分
+    """
+
+    def __init__(self, transmit: Optional[Callable[[Message], None]] = None, spin_time: float = 0.0005):
+        """
+        :param transmit: 发送一帧数据的函数，不为空的时候注册为owner 0
+
+        :param spin_time: 忙等待的时间(秒)
+        """
+        self.__transmits = []  # type: List[Callable[[Message], None]]
+        self.__spin_time = int(spin_time * 1000000000)
+        self.__tasks = dict()  # type: Dict[Tuple[int, int], _TransmitTask]
+        self.__sequences = dict()  # type: Dict[int, _TransmitTask]
+        self.__next_sequence = 0
+        self.__heap = []  # type: List[Tuple[int, int, int]]
+        self.__condition = Condition()
+        self.__running = False
+        if transmit:
+            self.register(transmit)
+
+    @property
+    def is_running(self) -> bool:
+        return self.__running
+
+    def register(self, transmit: Callable[[Message], None]) -> int:
+        """
+        注册发送函数
+
+        :param transmit: 发送一帧数据的函数
+
+        :return: owner，添加任务的时候使用
+        """
+        with self.__condition:
+            self.__transmits.append(transmit)
+            return len(self.__transmits) - 1
+
+    def __schedule(self, task: _TransmitTask, deadline: int):
+        """
+        调度任务，之前放入堆中的项自动失效，需要在锁中调用
+        """
+        task.generation += 1
+        task.deadline = deadline
+        heapq.heappush(self.__heap, (deadline, task.sequence, task.generation))
+        self.__condition.notify()
+
+    def __get_task(self, message: Message, owner: int) -> _TransmitTask:
+        """
+        获取msg id对应的任务，需要在锁中调用
+        """
+        if not 0 <= owner < len(self.__transmits):
+            raise ValueError(f"owner[{owner}] is not registered")
+        key = owner, message.msg_id
+        if key not in self.__tasks:
+            task = _TransmitTask(message, owner, self.__next_sequence)
+            self.__next_sequence += 1
+            self.__tasks[key] = task
+            self.__sequences[task.sequence] = task
+        task = self.__tasks[key]
+        task.message = message
+        return task
+
+    def add_cycle(self, message: Message, owner: int = 0):
+        """
+        开始周期发送，立即发送第一帧
+
+        :param message: 周期发送的消息，发送时读取message.data，修改data后下一个周期生效
+
+        :param owner: 发送者
+        """
+        with self.__condition:
+            task = self.__get_task(message, owner)
+            task.cycle = int(message.cycle_time * _ns_per_ms)
+            if task.cycle <= 0:
+                raise ValueError(f"cycle time of {hex(message.msg_id)} must greater than 0")
+            task.last_cycle = 0
+            if task.event_times == 0:
+                self.__schedule(task, perf_counter_ns())
+
+    def add_event(self, message: Message, times: int, cycle_time: float, owner: int = 0):
+        """
+        发送事件帧，立即发送第一帧，如果还在周期发送，事件帧发送完成后继续周期发送
+
+        :param message: 事件消息
+
+        :param times: 发送次数
+
+        :param cycle_time: 事件帧之间的间隔(毫秒)
+
+        :param owner: 发送者
+        """
+        with self.__condition:
+            task = self.__get_task(message, owner)
+            pending = task.event_times > 0
+            task.event = int(cycle_time * _ns_per_ms)
+            task.event_times += times
+            # 上一次的事件帧还没有发送完成的时候只增加次数，和之前按顺序排队发送一致
+            if not pending:
+                self.__schedule(task, perf_counter_ns())
+
+    @contextmanager
+    def batch(self):
+        """
+        批量添加任务，期间调度线程不会发送，退出后新加入的任务在同一次唤醒中连续发送
+
+            with scheduler.batch():
+                scheduler.add_cycle(message1)
+                scheduler.add_event(message2, 3, 20)
+        """
+        with self.__condition:
+            yield
+
+    def __get_tasks(self, msg_id: Optional[int], owner: int) -> List[_TransmitTask]:
+        """
+        获取发送者的任务，需要在锁中调用
+        """
+        if msg_id is None:
+            return [task for task in self.__tasks.values() if task.owner == owner]
+        return [self.__tasks[(owner, msg_id)]] if (owner, msg_id) in self.__tasks else []
+
+    def remove(self, msg_id: Optional[int] = None, owner: int = 0):
+        """
+        停止发送(包括还没有发送的事件帧)
+
+        :param msg_id: 帧ID，为空表示停止所有帧
+
+        :param owner: 发送者
+        """
+        with self.__condition:
+            for task in self.__get_tasks(msg_id, owner):
+                task.cycle = 0
+                task.event_times = 0
+                task.generation += 1
+
+    def get_statistics(self, msg_id: Optional[int] = None, owner: int = 0) -> Dict[int, TransmitStatistics]:
+        """
+        获取发送统计
+
+        :param msg_id: 帧ID，为空表示所有帧
+
+        :param owner: 发送者
+
+        :return: {msg_id: 统计数据}
+        """
+        with self.__condition:
+            return dict((task.message.msg_id, task.statistics) for task in self.__get_tasks(msg_id, owner))
+
+    def clear(self, owner: Optional[int] = None):
+        """
+        清空任务以及统计数据
+
+        :param owner: 发送者，为空表示所有发送者
+        """
+        with self.__condition:
+            if owner is None:
+                self.__tasks.clear()
+                self.__sequences.clear()
+                self.__heap.clear()
+            else:
+                # 堆中剩余的项找不到任务后自动失效
+                for task in self.__get_tasks(None, owner):
+                    del self.__tasks[(owner, task.message.msg_id)]
+                    del self.__sequences[task.sequence]
+
+    def start(self):
+        """
+        清空之前的任务并允许调度线程运行，需要在run之前调用
+        """
+        with self.__condition:
+            self.__tasks.clear()
+            self.__sequences.clear()
+            self.__heap.clear()
+            self.__running = True
+
+    def stop(self):
+        """
+        停止调度线程
+        """
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+
+    def __pop_due(self, now: int) -> List[Tuple[_TransmitTask, int, int]]:
+        """
+        取出所有到期的任务，需要在锁中调用
+        """
+        due = []
+        heap = self.__heap
+        while heap and heap[0][0] <= now:
+            deadline, sequence, generation = heapq.heappop(heap)
+            task = self.__sequences.get(sequence)
+            if task and task.generation == generation and task.is_active:
+                # 周期任务如果已经被外部设置了stop_flag则不再发送
+                if task.event_times > 0 or not task.message.stop_flag:
+                    due.append((task, deadline, generation))
+        return due
+
+    def __next(self, task: _TransmitTask, deadline: int, now: int):
+        """
+        计算任务的下一次发送时间，需要在锁中调用
+        """
+        if task.event_times > 0:
+            task.event_times -= 1
+            if task.event_times > 0:
+                self.__schedule(task, deadline + task.event)
+            elif task.cycle > 0:
+                # 事件帧发送完成，一个周期后恢复周期发送
+                task.last_cycle = 0
+                self.__schedule(task, now + task.cycle)
+            return
+        if task.cycle > 0:
+            next_deadline = deadline + task.cycle
+            if next_deadline <= now:
+                missed = (now - next_deadline) // task.cycle + 1
+                task.statistics.missed += missed
+                next_deadline += missed * task.cycle
+            self.__schedule(task, next_deadline)
+
+    def __send(self, due: List[Tuple[_TransmitTask, int, int]]) -> List[int]:
+        """
+        发送所有到期的任务，不持有锁
+
+        :return: 每一帧的实际发送时间
+        """
+        send_times = []
+        for task, _, _ in due:
+            send_times.append(perf_counter_ns())
+            try:
+                self.__transmits[task.owner](task.message)
+            except RuntimeError as e:
+                logger.trace(f"some issue found, error is {e}")
+        return send_times
+
+    def run(self):
+        """
+        调度线程，调用stop后退出
+        """
+        logger.debug("transmit scheduler start")
+        while True:
+            with self.__condition:
+                if not self.__running:
+                    break
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+                now = perf_counter_ns()
+                remain = self.__heap[0][0] - now
+                if remain > self.__spin_time:
+                    self.__condition.wait((remain - self.__spin_time) / 1000000000)
+                    continue
+                # 忙等待阶段不持有锁，允许其他线程修改任务
+                due = self.__pop_due(now) if remain <= 0 else []
+            if not due:
+                continue
+            send_times = self.__send(due)
+            now = perf_counter_ns()
+            with self.__condition:
+                for (task, deadline, generation), send_time in zip(due, send_times):
+                    statistics = task.statistics
+                    statistics.add_lateness((send_time - deadline) / _ns_per_ms)
+                    if task.event_times == 0:
+                        if task.last_cycle > 0:
+                            statistics.add_period((send_time - task.last_cycle) / _ns_per_ms)
+                        task.last_cycle = send_time
+                    # 发送期间任务被重新调度或者停止的时候不再计算下一次发送时间
+                    if task.generation == generation:
+                        self.__next(task, deadline, now)
+        logger.debug("transmit scheduler stop")
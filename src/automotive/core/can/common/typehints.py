@@ -18,3 +18,5 @@ IdMessage = Dict[int, MessageType]
 NameMessage = Dict[str, MessageType]
 FilterNode = Union[str, Union[Tuple[str, ...], List[str]]]
 MessageIdentity = Union[int, str]
+# trace中的一帧(时间(秒), msg_id, 数据)
+TraceFrame = Tuple[float, int, List[int]]
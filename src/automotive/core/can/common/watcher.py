@@ -0,0 +1,411 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        watcher.py
+# @Author:      lizhe
+# @Created:     2022/3/24 - 20:37
+# --------------------------------------------------------
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from automotive.logger.logger import logger
+from ..message import Message, Signal
+from ..signal_decoder import decode_raw, to_physical
+
+"""
+接收线程中的条件监听
+
+测试步骤中注册监听条件(如某个signal等于3、某个msg id超过500ms没有收到、某个signal的值发生变化)，接收线程每次保存帧的时候
+
+只把对应msg id的新帧交给监听者增量计算，条件满足或者超时的时候立即完成，测试步骤不需要等待固定的时间。
+
+没有监听者的时候接收线程只多了一次判断，不增加其他开销。
+"""
+
+# signal条件，输入每一帧的signal值数组，返回每一帧是否满足条件的bool数组
+SignalPredicate = Callable[[np.ndarray], np.ndarray]
+
+
+class Watcher(object):
+    """
+    监听条件的父类
+
+    1、feed由接收线程调用，传入该msg id新收到的帧
+
+    2、poll由接收线程定期调用(最长间隔为接收线程的最长等待时间)，用于判断超时以及和时间有关的条件
+
+    3、条件满足时结果为True，超时的时候结果为False，完成后自动从接收线程中移除
+
+    4、feed或者poll抛出异常的时候，异常设置到结果中(wait时抛出)，该监听者被移除，接收线程继续运行
+
+    结果通过concurrent.futures.Future返回，可以等待(wait)也可以添加回调(回调在接收线程中执行，不能有耗时操作)
+    """
+
+    def __init__(self, msg_id: Optional[int], timeout: Optional[float] = None):
+        """
+        :param msg_id: 监听的帧ID，为空表示所有帧
+
+        :param timeout: 超时时间(秒)，为空表示不超时
+        """
+        self.msg_id = msg_id
+        self.__deadline = None if timeout is None else perf_counter() + timeout
+        self.__future = Future()
+        # 满足条件时的主机时间(perf_counter，秒)
+        self.__done_time = None  # type: Optional[float]
+
+    @property
+    def future(self) -> Future:
+        return self.__future
+
+    @property
+    def done(self) -> bool:
+        return self.__future.done()
+
+    @property
+    def done_time(self) -> Optional[float]:
+        """
+        完成时的主机时间(perf_counter，秒)，未完成时为空
+        """
+        return self.__done_time
+
+    def _finish(self, result: bool):
+        """
+        设置结果，已经完成的时候忽略
+        """
+        if not self.__future.done():
+            self.__done_time = perf_counter()
+            try:
+                self.__future.set_result(result)
+            except Exception:
+                # 其他线程同时设置了结果
+                pass
+
+    def _fail(self, exception: Exception):
+        """
+        设置异常，已经完成的时候忽略
+        """
+        if not self.__future.done():
+            self.__done_time = perf_counter()
+            try:
+                self.__future.set_exception(exception)
+            except Exception:
+                # 其他线程同时设置了结果
+                pass
+
+    def cancel(self):
+        """
+        取消监听，结果为False
+        """
+        self._finish(False)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待监听结果，没有设置超时时间的监听者需要传入等待时间
+
+        :param timeout: 最长等待时间(秒)，为空的时候等待到监听者的超时时间
+
+        :return: 条件是否满足
+        """
+        if timeout is None and self.__deadline is not None:
+            timeout = max(self.__deadline - perf_counter(), 0)
+        try:
+            return self.__future.result(timeout)
+        except FutureTimeoutError:
+            self._finish(False)
+            return self.__future.result()
+
+    def feed(self, time_stamps: np.ndarray, lengths: np.ndarray, data: np.ndarray, now: float):
+        """
+        处理新收到的帧，由接收线程调用
+
+        :param time_stamps: 设备时间戳数组
+
+        :param lengths: 每一帧的数据长度数组
+
+        :param data: (N, dlc)的数据矩阵，每一行只有前lengths个字节是该帧的数据
+
+        :param now: 保存时的主机时间
+        """
+        pass
+
+    def poll(self, now: float):
+        """
+        定期检查，默认只检查超时
+
+        :param now: 当前的主机时间
+        """
+        if self.__deadline is not None and now >= self.__deadline:
+            self._finish(False)
+
+
+class SignalWatcher(Watcher):
+    """
+    监听signal的值，满足条件的帧累计达到count帧的时候完成
+    """
+
+    def __init__(self, message: Message, signal: Signal, predicate: SignalPredicate, count: int = 1,
+                 physical: bool = True, timeout: Optional[float] = None):
+        """
+        :param message: signal所在的message
+
+        :param signal: 监听的signal
+
+        :param predicate: 条件，如lambda values: values == 3
+
+        :param count: 满足条件的帧数量
+
+        :param physical: True计算物理值，False计算总线值
+
+        :param timeout: 超时时间(秒)
+        """
+        super().__init__(message.msg_id, timeout)
+        self.__signal = signal
+        self.__predicate = predicate
+        self.__count = count
+        self.__physical = physical
+        # 已经满足条件的帧数量
+        self.matched = 0
+
+    def _values(self, data: np.ndarray) -> np.ndarray:
+        raw = decode_raw(data, self.__signal.codec)
+        return to_physical(raw, self.__signal) if self.__physical else raw
+
+    def feed(self, time_stamps: np.ndarray, lengths: np.ndarray, data: np.ndarray, now: float):
+        # 数据长度不足的帧不包含该signal(接收缓冲区中超出长度的部分是之前的帧的数据)
+        rows = lengths > self.__signal.codec.last_byte
+        if not rows.all():
+            if not rows.any():
+                return
+            data = data[rows]
+        self.matched += int(np.count_nonzero(self.__predicate(self._values(data))))
+        if self.matched >= self.__count:
+            self._finish(True)
+
+
+class SignalChangedWatcher(SignalWatcher):
+    """
+    监听signal的值发生变化，参考值为空的时候以注册后收到的第一帧为准
+    """
+
+    def __init__(self, message: Message, signal: Signal, reference: Optional[int] = None, physical: bool = True,
+                 timeout: Optional[float] = None):
+        """
+        :param message: signal所在的message
+
+        :param signal: 监听的signal
+
+        :param reference: 参考值
+
+        :param physical: True计算物理值，False计算总线值
+
+        :param timeout: 超时时间(秒)
+        """
+        super().__init__(message, signal, self.__changed, physical=physical, timeout=timeout)
+        self.__reference = reference
+
+    def __changed(self, values: np.ndarray) -> np.ndarray:
+        if self.__reference is None and len(values) > 0:
+            self.__reference = values[0]
+        return values != self.__reference
+
+
+class MessageWatcher(Watcher):
+    """
+    监听收到count帧消息
+    """
+
+    def __init__(self, msg_id: Optional[int], count: int = 1, timeout: Optional[float] = None):
+        """
+        :param msg_id: 帧ID，为空表示任意帧
+
+        :param count: 帧数量
+
+        :param timeout: 超时时间(秒)
+        """
+        super().__init__(msg_id, timeout)
+        self.__count = count
+        self.received = 0
+
+    def feed(self, time_stamps: np.ndarray, lengths: np.ndarray, data: np.ndarray, now: float):
+        self.received += len(time_stamps)
+        if self.received >= self.__count:
+            self._finish(True)
+
+
+class MessageLostWatcher(Watcher):
+    """
+    监听消息丢失，从注册或者最后一次收到该帧开始，超过lost_time没有收到的时候完成
+    """
+
+    def __init__(self, msg_id: Optional[int], lost_time: float, timeout: Optional[float] = None):
+        """
+        :param msg_id: 帧ID，为空表示任意帧(即总线丢失)
+
+        :param lost_time: 丢失时间(秒)
+
+        :param timeout: 超时时间(秒)
+        """
+        super().__init__(msg_id, timeout)
+        self.__lost_time = lost_time
+        self.__last_time = perf_counter()
+
+    def feed(self, time_stamps: np.ndarray, lengths: np.ndarray, data: np.ndarray, now: float):
+        self.__last_time = now
+
+    def poll(self, now: float):
+        if now - self.__last_time >= self.__lost_time:
+            self._finish(True)
+        else:
+            super().poll(now)
+
+
+class WatcherSet(object):
+    """
+    接收线程中的监听者集合，按照msg id分组
+    """
+
+    def __init__(self):
+        self.__watchers = dict()  # type: Dict[Optional[int], List[Watcher]]
+        self.__lock = Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.__watchers)
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return sum(len(watchers) for watchers in self.__watchers.values())
+
+    def add(self, watcher: Watcher) -> Watcher:
+        """
+        添加监听者，添加后立即检查一次(如已经超时)
+
+        :param watcher: 监听者
+
+        :return: 监听者
+        """
+        with self.__lock:
+            self.__watchers.setdefault(watcher.msg_id, []).append(watcher)
+        self.__call(watcher, watcher.poll, perf_counter())
+        if watcher.done:
+            self.__remove_done(watcher.msg_id)
+        return watcher
+
+    def remove(self, watcher: Optional[Watcher] = None):
+        """
+        移除并取消监听者
+
+        :param watcher: 监听者，为空表示所有的监听者
+        """
+        with self.__lock:
+            if watcher is None:
+                watchers = [item for items in self.__watchers.values() for item in items]
+                self.__watchers.clear()
+            else:
+                watchers = [watcher]
+                items = self.__watchers.get(watcher.msg_id, [])
+                if watcher in items:
+                    items.remove(watcher)
+                    if not items:
+                        del self.__watchers[watcher.msg_id]
+        for item in watchers:
+            item.cancel()
+
+    @staticmethod
+    def __call(watcher: Watcher, function: Callable, *args):
+        """
+        调用监听者的feed或者poll，异常设置到监听者的结果中，不影响接收线程以及其他监听者
+        """
+        try:
+            function(*args)
+        except Exception as e:
+            logger.error(f"watcher {watcher.__class__.__name__} of msg id [{watcher.msg_id}] raise {e!r}, removed")
+            watcher._fail(e)
+
+    def __remove_done(self, msg_id: Optional[int]):
+        """
+        移除已经完成的监听者
+        """
+        with self.__lock:
+            watchers = [watcher for watcher in self.__watchers.get(msg_id, []) if not watcher.done]
+            if watchers:
+                self.__watchers[msg_id] = watchers
+            elif msg_id in self.__watchers:
+                del self.__watchers[msg_id]
+
+    def feed(self, msg_ids: np.ndarray, time_stamps: np.ndarray, lengths: np.ndarray, data: np.ndarray):
+        """
+        把批量收到的帧交给对应的监听者，由接收线程调用
+
+        :param msg_ids: 帧ID数组
+
+        :param time_stamps: 时间戳数组
+
+        :param lengths: 数据长度数组
+
+        :param data: (N, dlc)的数据矩阵
+        """
+        if not self.__watchers:
+            return
+        now = perf_counter()
+        with self.__lock:
+            groups = list(self.__watchers.items())
+        for msg_id, watchers in groups:
+            if msg_id is None:
+                rows = slice(None)
+            else:
+                rows = msg_ids == msg_id
+                if not rows.any():
+                    continue
+            frames_time_stamps, frames_lengths, frames_data = time_stamps[rows], lengths[rows], data[rows]
+            for watcher in watchers:
+                if not watcher.done:
+                    self.__call(watcher, watcher.feed, frames_time_stamps, frames_lengths, frames_data, now)
+            self.__remove_done(msg_id)
+
+    def feed_frame(self, msg_id: int, time_stamp: float, data: bytes):
+        """
+        把收到的一帧交给对应的监听者，由接收线程调用
+
+        :param msg_id: 帧ID
+
+        :param time_stamp: 时间戳
+
+        :param data: 数据
+        """
+        if not self.__watchers:
+            return
+        now = perf_counter()
+        frame_data = None
+        time_stamps = np.array([time_stamp if time_stamp is not None else np.nan], dtype=np.float64)
+        lengths = np.array([len(data)], dtype=np.int64)
+        for key in (msg_id, None):
+            with self.__lock:
+                watchers = list(self.__watchers.get(key, []))
+            if not watchers:
+                continue
+            if frame_data is None:
+                frame_data = np.frombuffer(bytes(data), dtype=np.uint8).reshape(1, -1)
+            for watcher in watchers:
+                if not watcher.done:
+                    self.__call(watcher, watcher.feed, time_stamps, lengths, frame_data, now)
+            self.__remove_done(key)
+
+    def poll(self):
+        """
+        检查超时以及和时间有关的条件，由接收线程定期调用
+        """
+        if not self.__watchers:
+            return
+        now = perf_counter()
+        with self.__lock:
+            groups = list(self.__watchers.items())
+        for msg_id, watchers in groups:
+            for watcher in watchers:
+                if not watcher.done:
+                    self.__call(watcher, watcher.poll, now)
+            self.__remove_done(msg_id)
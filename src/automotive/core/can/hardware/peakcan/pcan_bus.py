@@ -6,12 +6,12 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:39
 # --------------------------------------------------------
-from time import sleep
-from automotive.logger.logger import logger
+from automotive.logger.logger import logger, is_enabled
 from .pcan import PCanDevice
 from automotive.core.can.common.interfaces import BaseCanBus
-from automotive.core.can.common.enums import BaudRateEnum
-from automotive.core.can.message import Message
+from automotive.core.can.common.enums import BaudRateEnum, StackOverflowEnum
+from automotive.core.can.message import RawFrame
+from .pcanbasic import PCAN_MESSAGE_RTR, PCAN_MESSAGE_EXTENDED
 
 
 class PCanBus(BaseCanBus):
@@ -20,30 +20,15 @@ class PCanBus(BaseCanBus):
     """
 
     def __init__(self, baud_rate: BaudRateEnum = BaudRateEnum.HIGH, data_rate: BaudRateEnum = BaudRateEnum.DATA,
-                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300):
+                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300, stack_size: int = 1000000,
+                 stack_overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE):
         if can_fd:
             raise RuntimeError("pcan not support canfd")
         super().__init__(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index,
-                         can_fd=can_fd, max_workers=max_workers)
+                         can_fd=can_fd, max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
         # PCAN实例化
         self._can = PCanDevice(can_fd)
 
-    @staticmethod
-    def __get_data(data, length: int) -> list:
-        """
-        转换pcan收的data为list
-
-        :param data: 收到的data数据
-
-        :param length:  长度
-
-        :return: 8byte的list对象
-        """
-        msg_data = []
-        for i in range(length):
-            msg_data.append(data[i])
-        return msg_data
-
     @staticmethod
     def __get_time_stamp(timestamp) -> int:
         """
@@ -56,39 +41,35 @@ class PCanBus(BaseCanBus):
         time_stamp = timestamp.micros + 1000 * timestamp.millis + 0x100000000 * 1000 * timestamp.millis_overflow
         return int(time_stamp / 1000)
 
-    def __get_message(self, message, timestamp) -> Message:
+    def __get_frame(self, message, timestamp) -> RawFrame:
         """
-        获取message对象
+        获取接收帧
 
         :param message: message信息
 
-        :return: PeakCanMessage对象
+        :return: RawFrame对象
         """
-        msg = Message()
-        msg.msg_id = message.id
-        msg.time_stamp = self.__get_time_stamp(timestamp)
-        msg.send_type = message.msg_type
-        msg.data_length = 8 if message.len > 8 else message.len
-        msg.data = self.__get_data(message.data, msg.data_length)
-        return msg
+        data_length = 8 if message.len > 8 else message.len
+        msg_type = int(message.msg_type)
+        flags = RawFrame.REMOTE if msg_type & PCAN_MESSAGE_RTR.value else 0
+        if msg_type & PCAN_MESSAGE_EXTENDED.value:
+            flags |= RawFrame.EXTERNAL
+        return RawFrame(message.id, self.__get_time_stamp(timestamp), bytes(message.data[:data_length]), flags,
+                        msg_type)
 
-    def __receive(self):
+    def __read(self) -> int:
         """
-        CAN接收帧函数，在接收线程中执行
+        从设备中读取一帧数据，PCAN每次只能读取一帧，由接收线程循环调用直到读完
+
+        :return: 读取到的帧数量
         """
-        while self._can.is_open and self._need_receive:
-            try:
-                receive_msg, timestamp = self._can.receive()
-                msg_id = receive_msg.id
-                logger.trace(f"msg id = {hex(msg_id)}")
-                receive_message = self.__get_message(receive_msg, timestamp)
-                self._receive_messages[msg_id] = receive_message
-                self._stack.append(receive_message)
-            except RuntimeError as e:
-                logger.trace(e)
-                continue
-            finally:
-                sleep(0.001)
+        receive_msg, timestamp = self._can.receive()
+        msg_id = receive_msg.id
+        if is_enabled("trace"):
+            logger.trace(f"msg id = {hex(msg_id)}")
+        frame = self.__get_frame(receive_msg, timestamp)
+        self._save_frame(frame)
+        return 1
 
     def open_can(self):
         """
@@ -96,4 +77,4 @@ class PCanBus(BaseCanBus):
         """
         super()._open_can()
         # 把接收函数submit到线程池中
-        self._receive_thread.append(self._thread_pool.submit(self.__receive))
+        self._receive_thread.append(self._thread_pool.submit(self._receive, self.__read))
@@ -0,0 +1,8 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        __init__.py.py
+# @Author:      lizhe
+# @Created:     2022/3/15 - 21:10
+# --------------------------------------------------------
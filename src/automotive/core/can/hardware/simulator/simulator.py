@@ -0,0 +1,171 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        simulator.py
+# @Author:      lizhe
+# @Created:     2022/3/15 - 21:10
+# --------------------------------------------------------
+from collections import deque
+from threading import Thread, Lock
+from time import perf_counter, sleep
+from typing import Tuple, List, Sequence, Optional, Callable
+
+from automotive.logger.logger import logger
+from automotive.core.can.common.interfaces import BaseCanDevice
+from automotive.core.can.common.enums import BaudRateEnum
+from automotive.common.constant import check_connect, can_tips
+from automotive.core.can.message import Message
+
+# 模拟设备中的一帧数据(msg_id, 时间戳(毫秒), 数据)
+SimulatorFrame = Tuple[int, float, List[int]]
+
+
+class SimulatorDevice(BaseCanDevice):
+    """
+    模拟CAN设备，不需要硬件，用于测试接收线程的吞吐量和丢帧率
+
+    1、打开设备后由生成线程按照frame_rate产生数据帧，放入容量为fifo_size的FIFO中(模拟硬件缓冲区)
+
+    2、FIFO满的时候新产生的帧会被丢弃并计入lost
+
+    3、receive每次最多读取batch_size帧，batch_size为1的时候和PCAN一样每次只能读取一帧
+    """
+
+    def __init__(self, frame_rate: int = 2000, msg_ids: Sequence[int] = (0x100,), fifo_size: int = 2000,
+                 batch_size: int = 2500, is_fd: bool = False, loopback: bool = False):
+        """
+        :param frame_rate: 每秒产生的帧数量，为0表示不产生数据
+
+        :param msg_ids: 轮流产生的帧ID
+
+        :param fifo_size: 模拟的硬件缓冲区大小
+
+        :param batch_size: 每次receive最多读取的帧数量
+
+        :param is_fd: 是否CANFD
+
+        :param loopback: 发送的帧是否回环到接收缓冲区
+        """
+        super().__init__()
+        self.__frame_rate = frame_rate
+        self.__msg_ids = list(msg_ids)
+        self.__fifo_size = fifo_size
+        self.__batch_size = batch_size
+        self.__data_length = 64 if is_fd else 8
+        self.__loopback = loopback
+        self.__fifo = deque()
+        self.__lock = Lock()
+        self.__generate_thread = None
+        self.__callback = None
+        self.__start_time = 0.0
+        # 产生的帧数量
+        self.__generated = 0
+        # 由于FIFO满丢失的帧数量
+        self.__lost = 0
+        # 发送的帧数量
+        self.__transmitted = 0
+
+    @property
+    def generated(self) -> int:
+        return self.__generated
+
+    @property
+    def lost(self) -> int:
+        return self.__lost
+
+    @property
+    def transmitted(self) -> int:
+        return self.__transmitted
+
+    def set_callback(self, callback: Optional[Callable[[], None]]):
+        """
+        设置收到数据时候的回调函数，模拟设备驱动的接收通知
+
+        :param callback: 回调函数
+        """
+        self.__callback = callback
+
+    def __put(self, frames: List[SimulatorFrame]):
+        """
+        把帧放入FIFO，FIFO满的时候丢弃
+        """
+        with self.__lock:
+            for frame in frames:
+                if len(self.__fifo) >= self.__fifo_size:
+                    self.__lost += 1
+                else:
+                    self.__fifo.append(frame)
+        if self.__callback:
+            self.__callback()
+
+    def __get_time_stamp(self) -> float:
+        return (perf_counter() - self.__start_time) * 1000
+
+    def __generate(self):
+        """
+        生成线程，按照frame_rate产生数据帧，每毫秒左右产生一批，模拟总线上的数据
+        """
+        produced = 0
+        start_time = perf_counter()
+        while self._is_open:
+            due = int((perf_counter() - start_time) * self.__frame_rate) - produced
+            if due > 0:
+                frames = []
+                time_stamp = self.__get_time_stamp()
+                for i in range(produced, produced + due):
+                    msg_id = self.__msg_ids[i % len(self.__msg_ids)]
+                    data = [(i >> (8 * (index % 4))) & 0xff for index in range(self.__data_length)]
+                    frames.append((msg_id, time_stamp, data))
+                produced += due
+                self.__generated = produced
+                self.__put(frames)
+            sleep(0.001)
+
+    def open_device(self, baud_rate: BaudRateEnum = BaudRateEnum.HIGH, data_rate: BaudRateEnum = BaudRateEnum.DATA,
+                    channel: int = 1):
+        logger.info(f"open simulator device, frame rate is {self.__frame_rate}")
+        self.__fifo.clear()
+        self.__generated = 0
+        self.__lost = 0
+        self.__transmitted = 0
+        self.__start_time = perf_counter()
+        self._is_open = True
+        if self.__frame_rate > 0:
+            self.__generate_thread = Thread(target=self.__generate, daemon=True)
+            self.__generate_thread.start()
+
+    def close_device(self):
+        self._is_open = False
+        if self.__generate_thread:
+            self.__generate_thread.join()
+            self.__generate_thread = None
+
+    @check_connect("_is_open", can_tips)
+    def read_board_info(self):
+        return "simulator"
+
+    @check_connect("_is_open", can_tips)
+    def reset_device(self):
+        with self.__lock:
+            self.__fifo.clear()
+
+    @check_connect("_is_open", can_tips)
+    def transmit(self, message: Message):
+        self.__transmitted += 1
+        if self.__loopback:
+            self.__put([(message.msg_id, self.__get_time_stamp(), list(message.data))])
+
+    @check_connect("_is_open", can_tips)
+    def receive(self) -> Tuple[int, List[SimulatorFrame]]:
+        """
+        从FIFO中读取数据
+
+        :return: (帧数量, 帧列表)
+        """
+        with self.__lock:
+            count = min(len(self.__fifo), self.__batch_size)
+            frames = [self.__fifo.popleft() for _ in range(count)]
+        if count == 0:
+            raise RuntimeError("no data in simulator fifo")
+        return count, frames
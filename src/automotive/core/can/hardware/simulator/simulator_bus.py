@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        simulator_bus.py
+# @Author:      lizhe
+# @Created:     2022/3/15 - 21:40
+# --------------------------------------------------------
+from typing import Sequence, Dict
+
+from automotive.logger.logger import logger, is_enabled
+from .simulator import SimulatorDevice, SimulatorFrame
+from automotive.core.can.common.interfaces import BaseCanBus
+from automotive.core.can.common.enums import BaudRateEnum, StackOverflowEnum
+from automotive.core.can.message import RawFrame
+
+
+class SimulatorCanBus(BaseCanBus):
+    """
+    基于模拟设备的CANBus，不需要硬件，用于在Linux等环境下测试接收的吞吐量和丢帧率
+    """
+
+    def __init__(self, baud_rate: BaudRateEnum = BaudRateEnum.HIGH, data_rate: BaudRateEnum = BaudRateEnum.DATA,
+                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300, stack_size: int = 1000000,
+                 stack_overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE, frame_rate: int = 2000,
+                 msg_ids: Sequence[int] = (0x100,), fifo_size: int = 2000, batch_size: int = 2500,
+                 loopback: bool = False, notify: bool = True):
+        """
+        :param frame_rate: 模拟设备每秒产生的帧数量
+
+        :param msg_ids: 模拟设备轮流产生的帧ID
+
+        :param fifo_size: 模拟设备的硬件缓冲区大小
+
+        :param batch_size: 每次最多读取的帧数量，为1时模拟PCAN每次只能读取一帧
+
+        :param loopback: 发送的帧是否回环到接收
+
+        :param notify: 模拟设备收到数据的时候是否通知接收线程，为False时接收线程只依靠等待超时轮询
+        """
+        super().__init__(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index, can_fd=can_fd,
+                         max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
+        self._can = SimulatorDevice(frame_rate=frame_rate, msg_ids=msg_ids, fifo_size=fifo_size,
+                                    batch_size=batch_size, is_fd=can_fd, loopback=loopback)
+        if notify:
+            self._can.set_callback(self.notify_receive)
+        # 接收到的帧数量
+        self.__received = 0
+
+    def __get_frame(self, frame: SimulatorFrame) -> RawFrame:
+        """
+        获取接收帧
+
+        :param frame: 模拟设备中的帧
+
+        :return: RawFrame对象
+        """
+        msg_id, time_stamp, data = frame
+        return RawFrame(msg_id, time_stamp, bytes(data), RawFrame.CAN_FD if self._can_fd else 0)
+
+    def __read(self) -> int:
+        """
+        从设备中读取数据，由接收线程循环调用直到读完
+
+        :return: 读取到的帧数量
+        """
+        count, frames = self._can.receive()
+        if is_enabled("trace"):
+            logger.trace(f"receive count is {count}")
+        for frame in frames:
+            self._save_frame(self.__get_frame(frame))
+        self.__received += count
+        return count
+
+    def get_statistics(self) -> Dict[str, int]:
+        """
+        获取模拟设备的统计数据
+
+        :return: generated(产生的帧数量)、lost(设备缓冲区满丢失的帧数量)、received(接收线程读取到的帧数量)、
+        dropped(接收栈满丢弃的帧数量)
+        """
+        return {
+            "generated": self._can.generated,
+            "lost": self._can.lost,
+            "received": self.__received,
+            "dropped": self._stack.dropped
+        }
+
+    def open_can(self):
+        """
+        对CAN设备进行打开、初始化等操作，并同时开启设备的帧接收线程。
+        """
+        super()._open_can()
+        self.__received = 0
+        # 把接收函数submit到线程池中
+        self._receive_thread.append(self._thread_pool.submit(self._receive, self.__read))
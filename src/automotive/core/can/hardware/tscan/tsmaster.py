@@ -8,8 +8,11 @@
 # --------------------------------------------------------
 import os
 import platform
-from ctypes import CDLL, byref, c_size_t, c_int32, c_double, c_ubyte, POINTER, cast, c_int
-from typing import List, Tuple, Any
+from ctypes import CDLL, byref, c_size_t, c_int32, c_double, c_ubyte, c_int, pointer
+from typing import List, Tuple
+
+import numpy as np
+
 from .tsmasterbasic import TRUE, APP_CHANNEL, TLIBCANFDControllerMode, TLIBCANFDControllerType, TLibCAN, TLibCANFD, \
     FALSE
 from automotive.common.constant import tsmaster_control_decorator, check_connect, can_tips
@@ -24,6 +27,13 @@ class TSMasterDevice(BaseCanDevice):
     def __init__(self, is_fd: bool = False):
         super().__init__()
         self.__is_fd = is_fd
+        # 接收缓存，只在初始化的时候分配一次，每次接收重复使用
+        frame_type = TLibCANFD if is_fd else TLibCAN
+        self.__receive_buffer = (frame_type * 2500)()
+        self.__p_receive_buffer = pointer(self.__receive_buffer)
+        self.__receive_size = c_int(len(self.__receive_buffer))
+        # 接收缓存的numpy视图，和接收缓存共用内存
+        self.__receive_frames = np.frombuffer(self.__receive_buffer, dtype=np.dtype(frame_type))
         self.__device_handler = c_size_t(0)
         self.__channel = None
         # 需要在硬件文档中查询获取
@@ -193,20 +203,24 @@ class TSMasterDevice(BaseCanDevice):
                 raise RuntimeError(f"transmit failed. error code is {result}")
 
     @check_connect("_is_open", can_tips)
-    def receive(self) -> Tuple[int, Any]:
+    def receive(self) -> Tuple[int, np.ndarray]:
+        """
+        接收CAN消息
+
+        :return: (实际收到的帧数量, 收到的帧)，帧是接收缓存的numpy结构体数组视图(字段和TLibCAN/TLibCANFD一致)，
+        下一次调用receive的时候会被覆盖，需要在下一次调用之前处理完成
+        """
         # 设置缓存大小， 这个是IN OUT模式，即输入的2500不代表一定有这么多数据，这个只是一个最大值，在执行完成函数后在读取值能知道实际的数量
-        buffer_size = 2500
-        p_buffer_size = byref(c_int(buffer_size))
+        self.__receive_size.value = len(self.__receive_buffer)
+        p_buffer_size = byref(self.__receive_size)
         if self.__is_fd:
             # //读取CANFD报文
             # //ADeviceHandle：设备句柄；ACANBuffers:存储接收报文的数组；ACANBufferSize：存储数组的长度
             # //返回值：实际收到的报文数量
             # typedef c_uint(__stdcall* tsfifo_receive_canfd_msgs_t)(const size_t ADeviceHandle, const TLibCANFD* ACANBuffers, c_uint ACANBufferSize, c_uint8 AChn, c_uint8 ARXTX);
             # 0-RX, 1-TX
-            p_receive = [TLibCANFD() for _ in range(buffer_size)]
-            data = POINTER(TLibCANFD * len(p_receive))((TLibCANFD * len(p_receive))(*p_receive))
             result = self.__lib_can.tsfifo_receive_canfd_msgs(self.__device_handler,
-                                                              data,
+                                                              self.__p_receive_buffer,
                                                               p_buffer_size,
                                                               APP_CHANNEL[self.__channel],
                                                               c_ubyte(0))
@@ -216,19 +230,14 @@ class TSMasterDevice(BaseCanDevice):
             # //返回值：实际收到的报文数量
             # typedef c_uint(__stdcall* tsfifo_receive_can_msgs_t)(const size_t ADeviceHandle, const TLibCAN* ACANBuffers, c_uint ACANBufferSize, c_uint8 AChn, c_uint8 ARXTX);
             # 0-RX, 1-TX
-            # p_receive = (TLibCAN * buffer_size)()
-            # temp_size = copy.copy(p_buffer_size)
-            p_receive = [TLibCAN() for _ in range(buffer_size)]
-            data = POINTER(TLibCAN * len(p_receive))((TLibCAN * len(p_receive))(*p_receive))
             result = self.__lib_can.tsfifo_receive_can_msgs(self.__device_handler,
-                                                            data,
+                                                            self.__p_receive_buffer,
                                                             p_buffer_size,
                                                             APP_CHANNEL[self.__channel],
                                                             c_ubyte(0))
         if result == 0:
             # 真实收到的数据长度
-            cast_value = cast(p_buffer_size, POINTER(c_int32)).contents.value
-            # print(cast_value)
-            return cast_value, data.contents
+            count = self.__receive_size.value
+            return count, self.__receive_frames[:count]
         else:
             raise RuntimeError(f"receive failed, frame receive count is {result}")
@@ -6,73 +6,54 @@
 # @Author:      lizhe
 # @Created:     2021/10/27 - 21:26
 # --------------------------------------------------------
-from time import sleep
-from typing import List
-
-from automotive.logger.logger import logger
-from automotive.core.can.message import Message
+from automotive.logger.logger import logger, is_enabled
+from automotive.core.can.message import RawFrame
 from automotive.core.can.common.interfaces import BaseCanBus
-from automotive.core.can.common.enums import BaudRateEnum
+from automotive.core.can.common.enums import BaudRateEnum, StackOverflowEnum
 from .tsmaster import TSMasterDevice
 
 
 class TsMasterCanBus(BaseCanBus):
+    # 时间戳单位为微秒
+    _time_stamp_scale = 0.001
 
     def __init__(self, baud_rate: BaudRateEnum = BaudRateEnum.HIGH, data_rate: BaudRateEnum = BaudRateEnum.DATA,
-                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300):
+                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300, stack_size: int = 1000000,
+                 stack_overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE):
         super().__init__(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index, can_fd=can_fd,
-                         max_workers=max_workers)
+                         max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
         # 实例化同星
         self._can = TSMasterDevice(can_fd)
 
-    @staticmethod
-    def __get_data(data, length: int) -> List:
-        msg_data = []
-        for i in range(length):
-            msg_data.append(data[i])
-        return msg_data
-
-    def __get_message(self, p_receive) -> Message:
-        """
-        获取message对象
-
-        :param p_receive: message信息
-
-        :return: PeakCanMessage对象
+    def __read(self) -> int:
         """
-        msg = Message()
-        msg.msg_id = p_receive.FIdentifier
-        msg.time_stamp = p_receive.FTimeUS
-        msg.data = self.__get_data(p_receive.FData, self._get_dlc_length(p_receive.FDLC))
-        msg.data_length = len(msg.data)
-        return msg
+        从设备中读取数据，由接收线程循环调用直到读完
 
-    def __receive(self):
-        """
-        CAN接收帧函数，在接收线程中执行
+        :return: 读取到的帧数量
         """
-        logger.debug(f"start receive and tsmaster status {self._can.is_open} and need_receive {self._need_receive}")
-        while self._can.is_open and self._need_receive:
-            try:
-                count, p_receive = self._can.receive()
-                logger.trace(f"receive count is {count}")
-                # todo 同星的dll存在64bit， 标准can消息接收的问题，所以修改为过滤ID不为空的处理方式
-                messages = list(filter(lambda x: x.FIdentifier != 0x00, p_receive))
-                for p_receive in messages:
-                    message = self.__get_message(p_receive)
-                    logger.trace(f"message_id = {hex(message.msg_id)}")
-                    self._receive_messages[message.msg_id] = message
-                    self._stack.append(message)
-            except RuntimeError as e:
-                logger.trace(e)
-                continue
-            finally:
-                sleep(0.001)
+        count, frames = self._can.receive()
+        if is_enabled("trace"):
+            logger.trace(f"receive count is {count}")
+        # todo 同星的dll存在64bit， 标准can消息接收的问题，所以修改为过滤ID不为空的处理方式
+        frames = frames[frames["FIdentifier"] != 0x00]
+        if len(frames) == 0:
+            return 0
+        msg_ids = frames["FIdentifier"]
+        time_stamps = frames["FTimeUS"]
+        lengths = self._dlc_lengths[frames["FDLC"] & 0x0f]
+        data = frames["FData"]
+        flags = RawFrame.CAN_FD if self._can_fd else 0
+        for msg_id, index in self._save_frames(msg_ids, time_stamps, lengths, data).items():
+            length = int(lengths[index])
+            self._receive_messages[msg_id] = RawFrame(msg_id, int(time_stamps[index]), data[index, :length].tobytes(),
+                                                      flags)
+        return len(frames)
 
     def open_can(self):
         """
         对CAN设备进行打开、初始化等操作，并同时开启设备的帧接收线程。
                 """
         super()._open_can()
+        logger.debug(f"start receive and tsmaster status {self._can.is_open} and need_receive {self._need_receive}")
         # 把接收函数submit到线程池中
-        self._receive_thread.append(self._thread_pool.submit(self.__receive))
+        self._receive_thread.append(self._thread_pool.submit(self._receive, self.__read))
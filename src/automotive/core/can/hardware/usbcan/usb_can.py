@@ -14,7 +14,9 @@ from ctypes import c_int, byref, POINTER, memmove, c_long, CDLL
 from time import time
 from platform import architecture
 from inspect import stack
-from typing import Tuple, Any, List, Optional
+from typing import Tuple, List, Optional
+
+import numpy as np
 
 from automotive.core.can.hardware.usbcan.usb_can_basic import band_rate_list, VciInitConfig, UCHAR, DWORD, UINT, BYTE, \
     VciCanObj, VciBoardInfo
@@ -69,6 +71,19 @@ class UsbCanDevice(BaseCanDevice):
         self.__access_code = 0
         #  CAN通道索引。 第几路 CAN。即对应卡的CAN通道号， CAN1为0， CAN2为1
         self.__can_index = 0
+        # 接收缓存，重复使用，只有需要的长度超过当前缓存的时候才会重新分配
+        self.__receive_buffer = None
+        self.__receive_frames = None
+        self.__allocate_receive_buffer(2500)
+
+    def __allocate_receive_buffer(self, frame_length: int):
+        """
+        分配接收缓存以及缓存的numpy视图
+
+        :param frame_length: 缓存的帧数量
+        """
+        self.__receive_buffer = (VciCanObj * frame_length)()
+        self.__receive_frames = np.frombuffer(self.__receive_buffer, dtype=np.dtype(VciCanObj))
 
     @staticmethod
     def __get_string(raw: int) -> str:
@@ -474,7 +489,7 @@ class UsbCanDevice(BaseCanDevice):
             raise RuntimeError(error[1])
 
     @check_connect("_is_open", can_tips)
-    def receive(self, frame_length: int = 2500, wait_time: int = 100) -> Tuple[int, Any]:
+    def receive(self, frame_length: int = 2500, wait_time: int = 100) -> Tuple[int, np.ndarray]:
         """
         接收函数。此函数从指定的设备CAN通道的接收缓冲区中读取数据。
 
@@ -490,16 +505,19 @@ class UsbCanDevice(BaseCanDevice):
         :param wait_time: 保留参数。
 
 
-        :return: 返回实际读取的帧数
+        :return: (实际读取的帧数, 收到的帧)，帧是接收缓存的numpy结构体数组视图(字段和VciCanObj一致)，
+        下一次调用receive的时候会被覆盖，需要在下一次调用之前处理完成
         """
-        p_receive = (VciCanObj * frame_length)()
+        if frame_length > len(self.__receive_buffer):
+            self.__allocate_receive_buffer(frame_length)
+        p_receive = self.__receive_buffer
         self.__lib_can.VCI_Receive.restype = c_long
         try:
             ret = self.__lib_can.VCI_Receive(self.__device_type, self.__device_index, self.__can_index,
                                              byref(p_receive), frame_length, wait_time)
             if ret > 0:
                 logger.trace(f"Usb CAN CAN{self.__can_index} Receive Success.")
-                return ret, p_receive
+                return ret, self.__receive_frames[:ret]
             elif ret == 0:
                 raise RuntimeError(f"Usb CAN CAN{self.__can_index} Transmit Failed.")
             elif ret == -1:
@@ -6,12 +6,13 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:44
 # --------------------------------------------------------
-from time import sleep
-from automotive.logger.logger import logger
+import numpy as np
+
+from automotive.logger.logger import logger, is_enabled
 from .usb_can import UsbCanDevice
 from automotive.core.can.common.interfaces import BaseCanBus
-from automotive.core.can.common.enums import CanBoxDeviceEnum, BaudRateEnum
-from automotive.core.can.message import Message
+from automotive.core.can.common.enums import CanBoxDeviceEnum, BaudRateEnum, StackOverflowEnum
+from automotive.core.can.message import RawFrame
 
 
 class UsbCanBus(BaseCanBus):
@@ -21,9 +22,10 @@ class UsbCanBus(BaseCanBus):
 
     def __init__(self, can_box_device: CanBoxDeviceEnum, baud_rate: BaudRateEnum = BaudRateEnum.HIGH,
                  data_rate: BaudRateEnum = BaudRateEnum.DATA, channel_index: int = 1, can_fd: bool = False,
-                 max_workers: int = 300):
+                 max_workers: int = 300, stack_size: int = 1000000,
+                 stack_overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE):
         super().__init__(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index, can_fd=can_fd,
-                         max_workers=max_workers)
+                         max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
         if self._can_fd:
             raise RuntimeError("usb can not support can fd")
         # USB CAN BOX实例化
@@ -32,81 +34,46 @@ class UsbCanBus(BaseCanBus):
         self.__time_flag = 1
 
     @staticmethod
-    def __get_data(data, length: int) -> list:
-        """
-        转换CAN BOX收的data为list
-
-        :param data: 收到的data数据
-
-        :param length:  长度
-
-        :return: 8byte的列表
-        """
-        msg_data = []
-        for i in range(length):
-            msg_data.append(data[i])
-        return msg_data
-
-    @staticmethod
-    def __get_reserved(reserved_value) -> list:
+    def __get_frame(frame: np.void) -> RawFrame:
         """
-        获取reversed参数
-
-        :param reserved_value:  reversed的内容(can上收到的)
+        获取接收帧
 
-        :return: 解析后的列表
-        """
-        reserved_list = []
-        for i in range(3):
-            reserved_list.append(reserved_value[i])
-        return reserved_list
+        :param frame: 接收缓存中的一帧(字段和VciCanObj一致)
 
-    def __get_message(self, p_receive) -> Message:
+        :return: RawFrame对象
         """
-        获取message对象
-
-        :param p_receive: message信息
+        flags = RawFrame.REMOTE if frame["remote_flag"] else 0
+        if frame["extern_flag"]:
+            flags |= RawFrame.EXTERNAL
+        data_length = min(int(frame["data_len"]), 8)
+        # 时间戳转换成毫秒
+        return RawFrame(int(frame["id"]), int(frame["time_stamp"]) // 10, frame["data"][:data_length].tobytes(), flags,
+                        int(frame["send_type"]))
 
-        :return: PeakCanMessage对象
+    def __read(self) -> int:
         """
-        msg = Message()
-        msg.msg_id = p_receive.id
-        # 转换成毫秒
-        msg.time_stamp = int(p_receive.time_stamp / 10)
-        # msg.time_stamp = hex(p_receive.time_stamp)
-        msg.time_flag = p_receive.time_flag
-        msg.send_type = p_receive.send_type
-        msg.remote_flag = p_receive.remote_flag
-        msg.external_flag = p_receive.extern_flag
-        msg.reserved = self.__get_reserved(p_receive.reserved)
-        msg.data_length = 8 if p_receive.data_len > 8 else p_receive.data_len
-        msg.data = self.__get_data(p_receive.data, msg.data_length)
-        return msg
+        从设备中读取数据，由接收线程循环调用直到读完
 
-    def __receive(self):
-        """
-        CAN接收帧函数，在接收线程中执行
+        :return: 读取到的帧数量
         """
-        while self._can.is_open and self._need_receive:
-            try:
-                ret, p_receive = self._can.receive()
-                logger.trace(f"return size is {ret}")
-                for i in range(ret):
-                    receive_message = self.__get_message(p_receive[i])
-                    logger.trace(f"msg id = {hex(receive_message.msg_id)}")
-                    # 单帧数据
-                    if receive_message.external_flag == 0:
-                        # 获取数据并保存到self._receive_msg字典中
-                        self._receive_messages[receive_message.msg_id] = receive_message
-                        self._stack.append(receive_message)
-                    # 扩展帧
-                    else:
-                        logger.debug("type is external frame, not implement")
-            except RuntimeError as e:
-                logger.trace(e)
-                continue
-            finally:
-                sleep(0.001)
+        ret, frames = self._can.receive()
+        if is_enabled("trace"):
+            logger.trace(f"return size is {ret}")
+        # 扩展帧
+        external = frames["extern_flag"] != 0
+        if external.any():
+            logger.debug("type is external frame, not implement")
+            frames = frames[~external]
+        # 单帧数据
+        if len(frames) > 0:
+            msg_ids = frames["id"]
+            # 转换成毫秒
+            time_stamps = frames["time_stamp"] // 10
+            lengths = np.minimum(frames["data_len"], 8)
+            for msg_id, index in self._save_frames(msg_ids, time_stamps, lengths, frames["data"]).items():
+                # 获取数据并保存到self._receive_msg字典中
+                self._receive_messages[msg_id] = self.__get_frame(frames[index])
+        return ret
 
     def open_can(self):
         """
@@ -114,4 +81,4 @@ class UsbCanBus(BaseCanBus):
         """
         super()._open_can()
         # 把接收函数submit到线程池中
-        self._receive_thread.append(self._thread_pool.submit(self.__receive))
+        self._receive_thread.append(self._thread_pool.submit(self._receive, self.__read))
@@ -6,76 +6,65 @@
 # @Author:      lizhe
 # @Created:     2022/1/28 - 12:31
 # --------------------------------------------------------
-from time import sleep
-from typing import List
-
-from automotive.logger.logger import logger
+from automotive.logger.logger import logger, is_enabled
 from automotive.core.can.common.interfaces import BaseCanBus
-from automotive.core.can.common.enums import BaudRateEnum
-from automotive.core.can.message import Message
+from automotive.core.can.common.enums import BaudRateEnum, StackOverflowEnum
+from automotive.core.can.message import RawFrame
 from .zlg_usb_can import ZlgUsbCanDevice
 
 
 class ZlgCanBus(BaseCanBus):
+    # 时间戳单位为微秒
+    _time_stamp_scale = 0.001
 
     def __init__(self, baud_rate: BaudRateEnum = BaudRateEnum.HIGH, data_rate: BaudRateEnum = BaudRateEnum.DATA,
-                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300):
+                 channel_index: int = 1, can_fd: bool = False, max_workers: int = 300, stack_size: int = 1000000,
+                 stack_overflow: StackOverflowEnum = StackOverflowEnum.OVERWRITE):
         super().__init__(baud_rate=baud_rate, data_rate=data_rate, channel_index=channel_index, can_fd=can_fd,
-                         max_workers=max_workers)
+                         max_workers=max_workers, stack_size=stack_size, stack_overflow=stack_overflow)
         self.__can_fd = can_fd
         # 实例化周立功
         self._can = ZlgUsbCanDevice(can_fd)
 
-    @staticmethod
-    def __get_data(data, length: int) -> List:
-        msg_data = []
-        for i in range(length):
-            msg_data.append(data[i])
-        return msg_data
-
-    def __get_message(self, p_receive) -> Message:
+    def __get_frame(self, p_receive) -> RawFrame:
         """
-        获取message对象
+        获取接收帧
 
         :param p_receive: message信息
 
-        :return: PeakCanMessage对象
+        :return: RawFrame对象
         """
-        msg = Message()
-        msg.msg_id = p_receive.frame.can_id
-        msg.time_stamp = p_receive.timestamp
         if self.__can_fd:
             dlc = p_receive.frame.len
+            flags = RawFrame.CAN_FD
         else:
             dlc = p_receive.frame.can_dlc
-        msg.data = self.__get_data(p_receive.frame.data, self._get_dlc_length(dlc))
-        msg.data_length = len(msg.data)
-        return msg
+            flags = 0
+        data = bytes(p_receive.frame.data[:self._get_dlc_length(dlc)])
+        return RawFrame(p_receive.frame.can_id, p_receive.timestamp, data, flags)
 
-    def __receive(self):
+    def __read(self) -> int:
         """
-        CAN接收帧函数，在接收线程中执行
+        从设备中读取数据，由接收线程循环调用直到读完
+
+        :return: 读取到的帧数量
         """
-        logger.debug(f"start receive and tsmaster status {self._can.is_open} and need_receive {self._need_receive}")
-        while self._can.is_open and self._need_receive:
-            try:
-                count, p_receive = self._can.receive()
-                logger.trace(f"receive count is {count}")
-                for i in range(count):
-                    message = self.__get_message(p_receive)
-                    logger.trace(f"message_id = {hex(message.msg_id)}")
-                    self._receive_messages[message.msg_id] = message
-                    self._stack.append(message)
-            except RuntimeError as e:
-                logger.trace(e)
-                continue
-            finally:
-                sleep(0.001)
+        count, p_receive = self._can.receive()
+        trace = is_enabled("trace")
+        if trace:
+            logger.trace(f"receive count is {count}")
+        for i in range(count):
+            frame = self.__get_frame(p_receive[i])
+            if trace:
+                logger.trace(f"message_id = {hex(frame.msg_id)}")
+            self._save_frame(frame)
+        return count
 
     def open_can(self):
         """
         对CAN设备进行打开、初始化等操作，并同时开启设备的帧接收线程。
                 """
         super()._open_can()
+        logger.debug(f"start receive and zlg status {self._can.is_open} and need_receive {self._need_receive}")
         # 把接收函数submit到线程池中
-        self._receive_thread.append(self._thread_pool.submit(self.__receive))
+        self._receive_thread.append(self._thread_pool.submit(self._receive, self.__read))
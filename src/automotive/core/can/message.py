@@ -6,9 +6,10 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:42
 # --------------------------------------------------------
-from typing import Union, List, Tuple, Dict
+from functools import lru_cache
+from typing import Union, List, Tuple, Dict, Optional, Callable
 
-from automotive.logger.logger import logger
+from automotive.logger.logger import logger, is_enabled
 from automotive.utils.utils import Utils, Number
 from .common.typehints import Messages, MessageType, SignalType
 from .tools.parser.dbc_parser import DbcParser
@@ -18,6 +19,8 @@ from .tools.parser.dbc_parser import DbcParser
 
 该类的作用是根据start_bit和bit_length等值计算出来8byte的值或者反向计算。
 
+每个signal的布局只在第一次使用的时候编译成SignalCodec，之后的编解码都是整数运算。
+
 如需要可以将该类变成私有类
 """
 
@@ -25,83 +28,100 @@ from .tools.parser.dbc_parser import DbcParser
 _bit_length = 8
 
 
-def __completion_byte(byte_value: str, size: int = 8) -> str:
+class SignalCodec(object):
     """
-    如果不足size位，补齐size位
-    :return:
+    Signal的编解码器，根据start_bit、bit_length、byte_type预先计算出signal所占据的byte范围、移位和掩码，
+
+    编解码的时候只需要对所占据的几个byte做整数运算，不再需要构建二进制字符串
+
+    Intel: 所占据的byte按照小端方式组成整数，start_bit为信号的最低位
+
+    Motorola: 所占据的byte按照大端方式组成整数，start_bit为信号的最高位(DBC中的MSB模式)
     """
-    # 补齐8位
-    while len(byte_value) != size:
-        byte_value = "0" + byte_value
-    return byte_value
+    __slots__ = ("start_bit", "bit_length", "byte_type", "is_sign", "first_byte", "last_byte", "byte_order",
+                 "byte_size", "shift", "mask", "sign_bit", "clear_mask")
+
+    def __init__(self, start_bit: int, bit_length: int, byte_type: bool, is_sign: bool):
+        self.start_bit = start_bit
+        self.bit_length = bit_length
+        self.byte_type = byte_type
+        self.is_sign = is_sign
+        # 信号在1个byte中的位置(最低位为0)
+        bit_position = start_bit % _bit_length
+        self.first_byte = start_bit // _bit_length
+        if byte_type:
+            self.byte_order = "little"
+            self.last_byte = (start_bit + bit_length - 1) // _bit_length
+            self.shift = bit_position
+        else:
+            self.byte_order = "big"
+            # 第一个byte中能够放下的位数为bit_position + 1，剩余的位数依次放到后面的byte中
+            rest_length = bit_length - bit_position - 1
+            self.last_byte = self.first_byte + (rest_length + _bit_length - 1) // _bit_length \
+                if rest_length > 0 else self.first_byte
+            self.shift = (self.last_byte - self.first_byte) * _bit_length + bit_position + 1 - bit_length
+        self.byte_size = self.last_byte - self.first_byte + 1
+        self.mask = (1 << bit_length) - 1
+        self.sign_bit = 1 << (bit_length - 1)
+        self.clear_mask = ~(self.mask << self.shift)
+
+    def encode(self, data: List[int], value: int):
+        """
+        把signal的总线值写入到data中
+
+        :param data: 总线数据(会被直接修改)
+
+        :param value: signal总线值，有符号的负数会转换成补码
+        """
+        first, last = self.first_byte, self.last_byte + 1
+        byte_order = self.byte_order
+        raw = int.from_bytes(data[first:last], byte_order) & self.clear_mask
+        raw |= (int(value) & self.mask) << self.shift
+        data[first:last] = raw.to_bytes(self.byte_size, byte_order)
+
+    def decode(self, data: List[int]) -> int:
+        """
+        从data中读取signal的总线值
+
+        :param data: 总线数据
+
+        :return: signal总线值，有符号的时候返回负数
+        """
+        raw = (int.from_bytes(data[self.first_byte:self.last_byte + 1], self.byte_order) >> self.shift) & self.mask
+        if self.is_sign and raw & self.sign_bit:
+            raw -= self.mask + 1
+        return raw
 
 
-def __get_position(start_bit: int, byte_length: int = 8) -> Tuple[int, int]:
+@lru_cache(maxsize=None)
+def get_codec(start_bit: int, byte_type: bool, bit_length: int, is_sign: bool) -> SignalCodec:
     """
-    获取start_bit在整个8Byte中占据的位置以及在1 Byte中的位置
+    获取编解码器，相同布局的signal共用一个编解码器
+
+    :param start_bit: 起始位
 
-    :param start_bit: 起始点
+    :param byte_type: True表示Intel， False表示Motorola MSB模式
 
-    :return: 8 Byte中占据的位置，1 Byte中占据的位置
+    :param bit_length: signal 长度
+
+    :param is_sign: 有符号位或者无符号位
+
+    :return: SignalCodec对象
     """
-    # 根据start_bit以及bin_value_length计算占据的byte有几个
-    # 计算start_bit是在第几个byte中，以及在byte中占据第几个bit
-    # 获取开始点在整个8byte数据的位置
-    logger.trace(f"start_bit = [{start_bit}] && byte_length = [{byte_length}]")
-    byte_index = -1
-    for i in range(byte_length):
-        if _bit_length * i <= start_bit <= _bit_length * i + 7:
-            byte_index = i
-            break
-    # 获取在单独这个byte中所占据的位置
-    bit_index = 7 - (start_bit - (start_bit // 8 * 8))
-    logger.trace(f"byte_index = [{byte_index}] && bit_index = [{bit_index}]")
-    return byte_index, bit_index
-
-
-def __split_bytes(value: str, length: int, bit_index: int, byte_type: bool) -> List[str]:
+    return SignalCodec(start_bit, bit_length, byte_type, is_sign)
+
+
+def check_codec(codec: SignalCodec, byte_length: int):
     """
-    根据bit_index和length来算value拆分成几个byte
-    :param value:  要设置的值
-    :param length: 长度
-    :param bit_index: start_bit在一个byte中的位置
-    :return: byte集合
+    检查signal是否超出了数据长度，数据不足的时候编解码会写到数据末尾或者读到0，所以必须先检查
+
+    :param codec: 编解码器
+
+    :param byte_length: 数据长度
     """
-    logger.trace(f"length is {length}, bit_index = {bit_index}")
-    values = []
-    if byte_type:
-        if length > bit_index + 1:
-            values.append(value[-bit_index - 1:])
-            # 把剩下的拿出来
-            value = value[:-bit_index - 1]
-            logger.trace(f"rest value is [{value}]")
-            while len(value) > _bit_length:
-                # 当剩余数据长度大于8表示还有一个byte， 先把数据加入列表中
-                values.append(value[-_bit_length:])
-                # 然后截取剩余的部分
-                value = value[:-_bit_length]
-            # 最后把剩余的部分加到列表中
-            values.append(value)
-        else:
-            # 只有一个byte
-            values.append(value)
-    else:
-        if length > (_bit_length - bit_index):
-            values.append(value[:_bit_length - bit_index])
-            # 把剩下的拿出来
-            value = value[_bit_length - bit_index:]
-            logger.trace(f"rest value is [{value}]")
-            while len(value) > _bit_length:
-                # 当剩余数据长度大于8表示还有一个byte， 先把数据加入列表中
-                values.append(value[:_bit_length])
-                # 然后截取剩余的部分
-                value = value[_bit_length:]
-            # 最后把剩余的部分加到列表中
-            values.append(value)
-        else:
-            # 只有一个byte
-            values.append(value)
-    return values
+    if codec.last_byte >= byte_length:
+        raise ValueError(f"start_bit[{codec.start_bit}] and bit_length[{codec.bit_length}] "
+                         f"out of data length[{byte_length}]")
 
 
 def check_value(value: Number, min_: Number, max_: Number) -> bool:
@@ -121,21 +141,6 @@ def check_value(value: Number, min_: Number, max_: Number) -> bool:
     return min_ <= value <= max_
 
 
-def __calc_singed_set_value(value: int, size: int) -> int:
-    value = abs(value)
-    value = __completion_byte(bin(value)[2:], size - 1)
-    # 原码，带符号位
-    true_code = f"1{value}"
-    logger.debug(f"true code is {true_code}")
-    # 除符号位的反码
-    no_sign_ones_complement_code = "".join(map(lambda x: "1" if x == "0" else "0", value))
-    ones_complement_code = f"1{no_sign_ones_complement_code}"
-    logger.debug(f"ones-complement code is {ones_complement_code}")
-    complemental_code = int(ones_complement_code, 2) + 1
-    logger.debug(f"complemental code = {bin(complemental_code)[2:]}")
-    return complemental_code
-
-
 def set_data(data: List[int], start_bit: int, byte_type: bool, value: int, bit_length: int, is_sign: bool,
              byte_length: int = 8):
     """
@@ -157,63 +162,9 @@ def set_data(data: List[int], start_bit: int, byte_type: bool, value: int, bit_l
 
     :param byte_length: 字段长度，默认值为8，CAN FD可调整
     """
-    if value < 0 and is_sign:
-        value = __calc_singed_set_value(value, bit_length)
-    logger.trace(f"data = {list(map(lambda x: hex(x), data))}), start_bit = [{start_bit}], "
-                 f"byte_type = [{byte_type}], value = [{value}], bit_length = [{bit_length}]")
-    byte_index, bit_index = __get_position(start_bit, byte_length)
-    # True表示Intel， False表示Motorola MSB模式, DBC解析出来只支持MSB模式, 不支持LSB模式，
-    # 对于LSB来说，在变成DBC的时候就处理了start bit
-    # 根据位数来算， 其中把value转换成了二进制的字符串
-    bin_value = __completion_byte(bin(value)[2:], bit_length)
-    logger.trace(f"bin_value = {bin_value}")
-    # 计算占据几个byte
-    holder_bytes = __split_bytes(bin_value, bit_length, bit_index, byte_type)
-    logger.trace(f"holder_bytes = {holder_bytes}")
-    for index, byte in enumerate(holder_bytes):
-        actual_index = byte_index + index
-        logger.trace(f"actual index = {actual_index}")
-        byte_value = __completion_byte(bin(data[actual_index])[2:])
-        logger.trace(f"the [{byte_index}] value is [{byte_value}]")
-        length = len(byte)
-        logger.trace(f"byte  = {byte}")
-        # 填充第一位
-        if index == 0:
-            if byte_type:
-                logger.trace(f"intel mode")
-                byte_value = byte_value[:bit_index + 1 - length] + byte + byte_value[bit_index + 1:]
-            else:
-                logger.trace("motorola mode")
-                byte_value = byte_value[:bit_index] + byte + byte_value[bit_index + length:]
-            logger.trace(f"first byte value = {byte_value}")
-        # 填充最后一位
-        elif index == len(holder_bytes) - 1:
-            if byte_type:
-                logger.trace(f"intel mode")
-                byte_value = byte_value[:_bit_length - length] + byte
-            else:
-                logger.trace("motorola mode")
-                byte_value = byte + byte_value[length:]
-            logger.trace(f"last byte value = {byte_value}")
-        # 填充中间的数据
-        else:
-            byte_value = byte
-        logger.trace(f"after handle byte_value = {byte_value}")
-        logger.trace(f"set {actual_index} data {bin(data[actual_index])[2:]} to {byte_value}")
-        # 把计算后的值设置会data中去, 此处注意字符串要转成2进制
-        data[actual_index] = int(byte_value, 2)
-    logger.trace(f"parser data is = {list(map(lambda x: hex(x), data))}")
-
-
-def __calc_singed_get_value(value: str) -> int:
-    value = int(value, 2) - 1
-    value = bin(value)[2:]
-    # 去掉了符号位
-    value1 = value[1:]
-    # 取反码
-    value = "".join(map(lambda x: "1" if x == "0" else "0", value1))
-    value = int(value, 2)
-    return 0 - value
+    codec = get_codec(start_bit, byte_type, bit_length, is_sign)
+    check_codec(codec, min(byte_length, len(data)))
+    codec.encode(data, value)
 
 
 def get_data(data: List[int], start_bit: int, byte_type: bool, bit_length: int, is_sign: bool,
@@ -237,63 +188,9 @@ def get_data(data: List[int], start_bit: int, byte_type: bool, bit_length: int,
 
     :return 查询到的值
     """
-    logger.trace(f"data = {list(map(lambda x: hex(x), data))}), start_bit = [{start_bit}], "
-                 f"byte_type = [{byte_type}], bit_length = [{bit_length}]")
-    byte_index, bit_index = __get_position(start_bit, byte_length)
-    byte_value = __completion_byte(bin(data[byte_index])[2:])
-    logger.trace(f"the [{byte_index}] value is [{byte_value}]")
-    if byte_type:
-        logger.trace(f"intel mode")
-        if bit_length > bit_index + 1:
-            signal_value = byte_value[:bit_index + 1]
-            logger.trace(f"intel first signal_value = {signal_value}")
-            rest_length = bit_length - bit_index - 1
-            logger.trace(f"intel rest length = {rest_length}")
-            while rest_length > _bit_length:
-                byte_index += 1
-                byte_value = __completion_byte(bin(data[byte_index])[2:])
-                logger.trace(f"the [{byte_index}] value is [{byte_value}]")
-                signal_value = byte_value[:_bit_length] + signal_value
-                logger.trace(f"intel middle signal_value = {signal_value}")
-                rest_length = rest_length - _bit_length
-            # 最后一个value
-            byte_index += 1
-            byte_value = __completion_byte(bin(data[byte_index])[2:])
-            logger.trace(f"the [{byte_index}] value is [{byte_value}]")
-            logger.trace(f"rest_length = {rest_length}")
-            signal_value = byte_value[-rest_length:] + signal_value
-            logger.trace(f"intel last signal_value = {signal_value}")
-        else:
-            signal_value = byte_value[bit_index + 1 - bit_length:bit_index + 1]
-            logger.trace(f"only one byte value = {signal_value}")
-    else:
-        logger.trace(f"motorola mode")
-        if bit_length > (_bit_length - bit_index):
-            signal_value = byte_value[bit_index:]
-            logger.trace(f"motorola first signal_value = {signal_value}")
-            rest_length = bit_length - (_bit_length - bit_index)
-            logger.trace(f"rest length = {rest_length}")
-            while rest_length > _bit_length:
-                byte_index += 1
-                byte_value = __completion_byte(bin(data[byte_index])[2:])
-                logger.trace(f"the [{byte_index}] value is [{byte_value}]")
-                signal_value = signal_value + byte_value[:_bit_length]
-                logger.trace(f"motorola middle signal_value = {signal_value}")
-                rest_length = rest_length - _bit_length
-            # 最后一个value
-            byte_index += 1
-            byte_value = __completion_byte(bin(data[byte_index])[2:])
-            logger.trace(f"the [{byte_index}] value is [{byte_value}]")
-            logger.trace(f"rest_length = {rest_length}")
-            signal_value = signal_value + byte_value[:rest_length]
-            logger.trace(f"motorola last signal_value = {signal_value}")
-        else:
-            signal_value = byte_value[bit_index:bit_index + bit_length]
-    if is_sign and signal_value[0] == "1":
-        return __calc_singed_get_value(signal_value)
-    else:
-        # 字符串转换成数字
-        return int(signal_value, 2)
+    codec = get_codec(start_bit, byte_type, bit_length, is_sign)
+    check_codec(codec, min(byte_length, len(data)))
+    return codec.decode(data)
 
 
 def get_message(messages: Union[str, Messages], encoding: str = "utf-8") -> Tuple[Dict, Dict]:
@@ -381,6 +278,10 @@ class Message(object):
         self.diag_state = False
         # 是否标准can
         self.is_standard_can = None
+        # 自上一次快照之后signal的值或者数据是否被修改过
+        self.modified = False
+        # 第一次被修改的时候的回调，快照通过该回调记录被修改过的message
+        self.on_modified = None  # type: Optional[Callable[[Message], None]]
 
     def __str__(self):
         return f"{hex(self.msg_id)} = {self.data}"
@@ -407,6 +308,15 @@ class Message(object):
         """
         pass
 
+    def mark_modified(self):
+        """
+        标记message被修改过，signal的值变化的时候自动调用，直接修改data的时候需要手动调用
+        """
+        if not self.modified:
+            self.modified = True
+            if self.on_modified:
+                self.on_modified(self)
+
     def check_message(self, need_check_data: bool = False):
         """
         检查message， 包含:
@@ -435,22 +345,23 @@ class Message(object):
         """
         # 发送数据
         if type_:
-            logger.trace("send message")
-            for name, signal in self.signals.items():
-                logger.trace(f"signal name = {signal.signal_name} and signal value = {signal.value}")
+            data = self.data
+            length = len(data)
+            for signal in self.signals.values():
+                check_codec(signal.codec, length)
                 # 根据原来的数据message_data，替换某一部分的内容
-                set_data(self.data, signal.start_bit, signal.byte_type, signal.value, signal.bit_length,
-                         signal.is_sign, self.data_length)
-            logger.trace(f"msg id {hex(self.msg_id)} and data is {list(map(lambda x: hex(x), self.data))}")
+                signal.codec.encode(data, signal.value)
+            if is_enabled("trace"):
+                logger.trace(f"send message {hex(self.msg_id)} and data is {list(map(lambda x: hex(x), data))}")
         # 收到数据
         else:
-            logger.trace("receive message")
-            for name, signal in self.signals.items():
-                logger.trace(f"signal name = {signal.signal_name} and signal value = {signal.value}")
-                value = get_data(self.data, signal.start_bit, signal.byte_type, signal.bit_length, signal.is_sign,
-                                 self.data_length)
-                logger.trace(f"value is {value}")
-                signal.value = value
+            data = self.data
+            length = len(data)
+            for signal in self.signals.values():
+                check_codec(signal.codec, length)
+                signal.value = signal.codec.decode(data)
+            if is_enabled("trace"):
+                logger.trace(f"receive message {hex(self.msg_id)} and data is {list(map(lambda x: hex(x), data))}")
 
     def set_value(self, message: MessageType):
         """
@@ -509,6 +420,7 @@ class Message(object):
         for sig in message["signals"]:
             signal = Signal()
             signal.set_value(sig)
+            signal.owner = self
             self.signals[signal.signal_name] = signal
 
 
@@ -544,6 +456,10 @@ class Signal(object):
         self.__value = 0
         # 物理值
         self.__physical_value = None
+        # 编解码器
+        self.__codec = None
+        # 所属的message，值变化的时候通知message
+        self.owner = None  # type: Optional[Message]
 
     def set_value(self, signal: SignalType):
         """
@@ -609,6 +525,18 @@ class Signal(object):
         if not check_value(self.bit_length, 0, 0x3f):
             raise ValueError(f"start bit[{self.bit_length}] must in [0, 0x3f]")
 
+    @property
+    def codec(self) -> SignalCodec:
+        """
+        signal的编解码器，当start_bit等布局参数变化的时候重新获取
+        """
+        codec = self.__codec
+        if codec is None or codec.start_bit != self.start_bit or codec.bit_length != self.bit_length \
+                or codec.byte_type != self.byte_type or codec.is_sign != self.is_sign:
+            codec = get_codec(self.start_bit, self.byte_type, self.bit_length, self.is_sign)
+            self.__codec = codec
+        return codec
+
     @property
     def value(self):
         return self.__value
@@ -620,7 +548,11 @@ class Signal(object):
         """
         self.__value = value
         self.__physical_value = int((float(value) * float(self.factor)) + float(self.offset))
-        logger.debug(f"signal[{self.signal_name}]value is {self.__value} and physical value is {self.__physical_value}")
+        if self.owner:
+            self.owner.mark_modified()
+        if is_enabled("debug"):
+            logger.debug(f"signal[{self.signal_name}]value is {self.__value} and physical value is "
+                         f"{self.__physical_value}")
 
     @property
     def physical_value(self):
@@ -630,7 +562,127 @@ class Signal(object):
     def physical_value(self, physical_value: Number):
         self.__physical_value = physical_value
         self.__value = int((float(physical_value) - float(self.offset)) / float(self.factor))
+        if self.owner:
+            self.owner.mark_modified()
         if not self.is_sign:
             if self.__value < 0 or self.__value > (2 ** self.bit_length - 1):
                 raise RuntimeError("it need input physical value not bus value")
-        logger.debug(f"physical value is {self.__physical_value} and value is {self.__value}")
+        if is_enabled("debug"):
+            logger.debug(f"physical value is {self.__physical_value} and value is {self.__value}")
+
+
+class RawFrame(object):
+    """
+    接收到的原始帧，只保存帧ID、时间戳、数据长度、标志位以及数据(bytes)
+
+    接收线程中每一帧都会创建，所以使用__slots__，不包含signals等矩阵表相关的内容，
+
+    需要按照Message使用的时候调用to_message构建Message对象
+    """
+    __slots__ = ("msg_id", "time_stamp", "data_length", "flags", "send_type", "data")
+
+    # 扩展帧
+    EXTERNAL = 0x1
+    # 远程帧
+    REMOTE = 0x2
+    # CAN FD帧
+    CAN_FD = 0x4
+
+    def __init__(self, msg_id: int, time_stamp: Union[int, float, None], data: bytes, flags: int = 0,
+                 send_type: int = 0):
+        """
+        :param msg_id: 帧ID
+
+        :param time_stamp: 时间戳
+
+        :param data: 数据
+
+        :param flags: 标志位，EXTERNAL/REMOTE/CAN_FD的组合
+
+        :param send_type: 设备返回的帧类型(如USBCAN的send_type、PCAN的msg_type)
+        """
+        self.msg_id = msg_id
+        self.time_stamp = time_stamp
+        self.data_length = len(data)
+        self.flags = flags
+        self.send_type = send_type
+        self.data = data
+
+    def __str__(self):
+        return f"{hex(self.msg_id)} = {list(self.data)}"
+
+    def to_message(self) -> Message:
+        """
+        构建Message对象，每次调用都返回新的对象
+
+        :return: Message对象
+        """
+        message = Message()
+        message.msg_id = self.msg_id
+        message.time_stamp = self.time_stamp
+        message.data_length = self.data_length
+        message.data = list(self.data)
+        message.send_type = self.send_type
+        message.external_flag = 1 if self.flags & RawFrame.EXTERNAL else 0
+        message.remote_flag = 1 if self.flags & RawFrame.REMOTE else 0
+        return message
+
+
+class MessageSnapshot(object):
+    """
+    message默认值的快照，用于恢复message的初始值
+
+    1、快照只保存每个message的数据(bytes)以及每个signal的总线值，不拷贝Message和Signal对象
+
+    2、signal的值变化的时候message会通知快照，恢复的时候只恢复被修改过的message，耗时和修改过的message数量成正比
+
+    3、恢复的时候直接修改原有的Message对象，发送线程中引用的message不会失效
+    """
+
+    def __init__(self, messages: Dict[int, Message]):
+        """
+        :param messages: 需要保存快照的message，{msg_id: Message}
+        """
+        self.__messages = messages
+        self.__values = dict()  # type: Dict[int, Tuple[bytes, Tuple[int, ...]]]
+        self.__modified = []  # type: List[Message]
+        self.take()
+
+    @property
+    def modified(self) -> List[Message]:
+        """
+        自上一次快照之后被修改过的message
+        """
+        return list(self.__modified)
+
+    def __on_modified(self, message: Message):
+        self.__modified.append(message)
+
+    def take(self):
+        """
+        把当前的值保存为快照
+        """
+        self.__values.clear()
+        self.__modified.clear()
+        for msg_id, message in self.__messages.items():
+            values = tuple(signal.value for signal in message.signals.values())
+            self.__values[msg_id] = bytes(message.data), values
+            message.modified = False
+            message.on_modified = self.__on_modified
+
+    def restore(self) -> int:
+        """
+        把被修改过的message恢复成快照中的值
+
+        :return: 恢复的message数量
+        """
+        count = len(self.__modified)
+        for message in self.__modified:
+            data, values = self.__values[message.msg_id]
+            message.data = list(data)
+            for signal, value in zip(message.signals.values(), values):
+                signal.value = value
+            message.modified = False
+        self.__modified.clear()
+        logger.debug(f"restore {count} messages")
+        return count
@@ -0,0 +1,163 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        multi_can_service.py
+# @Author:      lizhe
+# @Created:     2022/3/21 - 21:15
+# --------------------------------------------------------
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Union, Optional
+
+import numpy as np
+
+from .can_service import CANService
+from .common.typehints import MessageType
+from .common.enums import CanBoxDeviceEnum, BaudRateEnum, StackOverflowEnum
+from .common.scheduler import TransmitScheduler
+from automotive.logger.logger import logger
+
+
+class MultiCANService(object):
+    """
+    多路CAN服务，在一个进程中同时操作多个CAN设备或者同一个CAN设备的多个通道(如车身CAN + 娱乐CAN FD)
+
+    1、每一路是一个独立的CANService，使用各自的矩阵表，通过添加时的名字访问，如service["body"].send_can_signals(...)
+
+    2、所有通道共用一个发送调度器，周期信号和事件信号都在同一个发送线程中按照计划时间发送，每个通道的接收线程独立运行
+
+    3、每个通道的接收栈都记录了保存时的主机时间，不同通道的帧可以在同一个时间轴上比较，如计算网关的转发时间
+    """
+
+    def __init__(self, spin_time: float = 0.0005):
+        """
+        :param spin_time: 发送调度器忙等待的时间(秒)
+        """
+        self.__services = dict()  # type: Dict[str, CANService]
+        self.__scheduler = TransmitScheduler(spin_time=spin_time)
+        self.__thread_pool = None  # type: Optional[ThreadPoolExecutor]
+        self.__transmit_thread = None  # type: Optional[Future]
+
+    def __getitem__(self, name: str) -> CANService:
+        if name not in self.__services:
+            raise KeyError(f"channel {name} not found, only support {list(self.__services)}")
+        return self.__services[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__services
+
+    @property
+    def channels(self) -> List[str]:
+        """
+        所有通道的名字
+        """
+        return list(self.__services)
+
+    @property
+    def is_open(self) -> bool:
+        return self.__thread_pool is not None
+
+    def add_channel(self,
+                    name: str,
+                    messages: Union[str, MessageType],
+                    encoding: str = "utf-8",
+                    can_box_device: Union[CanBoxDeviceEnum, str, None] = None,
+                    baud_rate: Union[BaudRateEnum, int] = BaudRateEnum.HIGH,
+                    data_rate: Union[BaudRateEnum, int] = BaudRateEnum.DATA,
+                    channel_index: int = 1,
+                    can_fd: bool = False,
+                    max_workers: int = 300,
+                    stack_size: int = 1000000,
+                    stack_overflow: Union[StackOverflowEnum, str] = StackOverflowEnum.OVERWRITE) -> CANService:
+        """
+        添加一路CAN，参数和CANService一致，已经打开的时候同时打开该通道
+
+        :param name: 通道的名字，如body、infotainment
+
+        :return: 该通道的CANService
+        """
+        if name in self.__services:
+            raise RuntimeError(f"channel {name} already exist")
+        service = CANService(messages, encoding=encoding, can_box_device=can_box_device, baud_rate=baud_rate,
+                             data_rate=data_rate, channel_index=channel_index, can_fd=can_fd, max_workers=max_workers,
+                             stack_size=stack_size, stack_overflow=stack_overflow)
+        service.can_bus.set_scheduler(self.__scheduler)
+        self.__services[name] = service
+        logger.info(f"add channel {name} with {service.can_box_device.name} channel {channel_index}")
+        if self.is_open:
+            service.open_can()
+        return service
+
+    def open_can(self):
+        """
+        启动发送调度线程并打开所有通道
+        """
+        if self.is_open:
+            return
+        self.__scheduler.start()
+        self.__thread_pool = ThreadPoolExecutor(max_workers=1)
+        self.__transmit_thread = self.__thread_pool.submit(self.__scheduler.run)
+        for name, service in self.__services.items():
+            logger.debug(f"open channel {name}")
+            service.open_can()
+
+    def close_can(self):
+        """
+        关闭所有通道并停止发送调度线程
+        """
+        if not self.is_open:
+            return
+        for name, service in self.__services.items():
+            logger.debug(f"close channel {name}")
+            service.close_can()
+        self.__scheduler.stop()
+        self.__transmit_thread.result()
+        self.__thread_pool.shutdown()
+        self.__thread_pool = None
+        self.__transmit_thread = None
+
+    def clear_stack_data(self):
+        """
+        清空所有通道的接收栈
+        """
+        for service in self.__services.values():
+            service.clear_stack_data()
+
+    def get_latency(self,
+                    source: str,
+                    source_id: int,
+                    target: str,
+                    target_id: int,
+                    host_time: bool = True,
+                    max_latency: Optional[float] = None) -> np.ndarray:
+        """
+        计算两个通道之间的延迟(如网关把source通道的帧转发到target通道的时间)
+
+        对target通道收到的每一帧，找到source通道在此之前收到的最后一帧，两者时间的差值即为延迟
+
+        :param source: 源通道名字
+
+        :param source_id: 源通道的帧ID
+
+        :param target: 目标通道名字
+
+        :param target_id: 目标通道的帧ID
+
+        :param host_time: True使用保存时的主机时间，精度受接收线程读取间隔的影响；
+        False使用设备时间戳，仅适用于同一个设备的不同通道(时钟和单位相同)
+
+        :param max_latency: 最大延迟，超过的部分认为没有对应的源帧(如源帧丢失)，为空表示不限制
+
+        :return: 每一帧的延迟(主机时间为毫秒，设备时间戳为设备的单位)，之前没有源帧的目标帧不计算
+        """
+        source_times, _ = self[source].get_stack().get_array(source_id, host_time=host_time)
+        target_times, _ = self[target].get_stack().get_array(target_id, host_time=host_time)
+        # 接收栈按照保存顺序存放，主机时间是递增的
+        indexes = np.searchsorted(source_times, target_times, side="right") - 1
+        valid = indexes >= 0
+        latency = target_times[valid] - source_times[indexes[valid]]
+        if host_time:
+            latency = latency * 1000
+        if max_latency is not None:
+            latency = latency[latency <= max_latency]
+        return latency
@@ -0,0 +1,238 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        signal_decoder.py
+# @Author:      lizhe
+# @Created:     2022/3/12 - 10:21
+# --------------------------------------------------------
+from typing import List, Dict, Tuple, Optional, Sequence, Iterable, Union
+
+import numpy as np
+
+from .message import Message, Signal, SignalCodec
+from .common.frame_stack import FrameStack
+from .common.typehints import TraceFrame
+from .tools.reader.binary_trace_reader import BinaryTrace
+
+"""
+批量解析CAN数据
+
+把某一个msg id收到的所有帧转换成(N, dlc)的uint8矩阵，然后按照每个signal的编解码器(SignalCodec)
+
+用移位和掩码一次性计算出所有帧的signal值，得到按列存放的{signal_name: ndarray}结果。
+
+相比逐帧调用Message.update(False)解析所有signal，只需要计算需要的signal，并且运算都在numpy中完成。
+"""
+
+# 用uint64计算时能够处理的最大byte数
+_max_span_size = 8
+
+
+def filter_frames(stack: Sequence[Message], msg_id: int) -> List[Message]:
+    """
+    从栈中过滤出某一个msg id的所有帧
+
+    :param stack: 记录下来的CAN消息
+
+    :param msg_id: 信号ID
+
+    :return: 该msg id的所有帧
+    """
+    return [frame for frame in stack if frame.msg_id == msg_id]
+
+
+def to_array(frames: Sequence[Message], length: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把帧列表转换成时间戳数组和(N, dlc)的数据矩阵
+
+    :param frames: 帧列表
+
+    :param length: 数据长度，不足的部分补0，默认以最长的帧为准
+
+    :return: (时间戳数组, 数据矩阵)
+    """
+    size = len(frames)
+    time_stamps = np.array([frame.time_stamp for frame in frames], dtype=np.float64)
+    if size == 0:
+        return time_stamps, np.zeros((0, length), dtype=np.uint8)
+    lengths = set(len(frame.data) for frame in frames)
+    max_length = max(lengths)
+    if len(lengths) == 1 and max_length >= length:
+        data = np.array([frame.data for frame in frames], dtype=np.uint8).reshape(size, max_length)
+    else:
+        data = np.zeros((size, max(max_length, length)), dtype=np.uint8)
+        for index, frame in enumerate(frames):
+            data[index, :len(frame.data)] = frame.data
+    return time_stamps, data
+
+
+def get_array(stack: Sequence[Message], msg_id: int, length: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    获取某一个msg id的时间戳数组和数据矩阵，FrameStack和BinaryTrace直接通过msg id索引获取，其他类型的栈逐帧过滤
+
+    :param stack: 记录下来的CAN消息
+
+    :param msg_id: 信号ID
+
+    :param length: 数据长度，不足的部分补0
+
+    :return: (时间戳数组, 数据矩阵)
+    """
+    if isinstance(stack, (FrameStack, BinaryTrace)):
+        time_stamps, data = stack.get_array(msg_id)
+        if data.shape[1] < length:
+            data = np.pad(data, ((0, 0), (0, length - data.shape[1])))
+        return time_stamps, data
+    return to_array(filter_frames(stack, msg_id), length)
+
+
+def get_trace_array(frames: Iterable[TraceFrame], msg_id: int, length: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    从trace的帧迭代器(TraceReader.iter_frames)中获取某一个msg id的时间戳数组和数据矩阵，只保存该msg id的帧
+
+    :param frames: trace中的帧
+
+    :param msg_id: 信号ID
+
+    :param length: 数据长度，不足的部分补0
+
+    :return: (时间戳数组, 数据矩阵)
+    """
+    time_stamps = []
+    rows = []
+    for time_stamp, frame_id, data in frames:
+        if frame_id == msg_id:
+            time_stamps.append(time_stamp)
+            rows.append(data)
+    width = max([length] + [len(row) for row in rows])
+    data = np.zeros((len(rows), width), dtype=np.uint8)
+    for index, row in enumerate(rows):
+        data[index, :len(row)] = row
+    return np.array(time_stamps, dtype=np.float64), data
+
+
+def decode_raw(data: np.ndarray, codec: SignalCodec) -> np.ndarray:
+    """
+    根据编解码器计算数据矩阵中每一行的signal总线值
+
+    :param data: (N, dlc)的数据矩阵
+
+    :param codec: signal的编解码器
+
+    :return: 每一帧的signal总线值(int64, 无符号64位信号为uint64)
+    """
+    if codec.last_byte >= data.shape[1]:
+        raise ValueError(f"start_bit[{codec.start_bit}] and bit_length[{codec.bit_length}] "
+                         f"out of data length[{data.shape[1]}]")
+    if codec.byte_size > _max_span_size:
+        # 超出uint64范围的signal（如非对齐的64位信号）逐行计算
+        return np.array([codec.decode(row) for row in data.tolist()], dtype=np.int64)
+    span = data[:, codec.first_byte:codec.last_byte + 1].astype(np.uint64)
+    raw = np.zeros(data.shape[0], dtype=np.uint64)
+    for index in range(codec.byte_size):
+        if codec.byte_type:
+            byte_shift = index * 8
+        else:
+            byte_shift = (codec.byte_size - 1 - index) * 8
+        raw |= span[:, index] << np.uint64(byte_shift)
+    raw = (raw >> np.uint64(codec.shift)) & np.uint64(codec.mask)
+    if codec.bit_length == 64:
+        return raw.view(np.int64) if codec.is_sign else raw
+    value = raw.astype(np.int64)
+    if codec.is_sign:
+        negative = (raw & np.uint64(codec.sign_bit)) != 0
+        value[negative] |= np.int64(-(1 << codec.bit_length))
+    return value
+
+
+def to_physical(raw: np.ndarray, signal: Signal) -> np.ndarray:
+    """
+    把总线值转换成物理值，和Signal.value的计算方式一致（乘以factor加上offset后取整）
+
+    :param raw: 总线值
+
+    :param signal: signal对象
+
+    :return: 物理值
+    """
+    return (raw.astype(np.float64) * float(signal.factor) + float(signal.offset)).astype(np.int64)
+
+
+def decode_signals(data: np.ndarray,
+                   signals: Sequence[Signal],
+                   physical: bool = True) -> Dict[str, np.ndarray]:
+    """
+    一次性计算数据矩阵中多个signal的值
+
+    :param data: (N, dlc)的数据矩阵
+
+    :param signals: 需要计算的signal
+
+    :param physical: True返回物理值，False返回总线值
+
+    :return: {signal_name: 每一帧的值}
+    """
+    result = dict()
+    for signal in signals:
+        raw = decode_raw(data, signal.codec)
+        result[signal.signal_name] = to_physical(raw, signal) if physical else raw
+    return result
+
+
+def __get_signals(message: Message, signal_names: Optional[Sequence[str]]) -> List[Signal]:
+    """
+    获取需要解析的signal
+    """
+    if signal_names is None:
+        return list(message.signals.values())
+    signals = []
+    for signal_name in signal_names:
+        if signal_name not in message.signals:
+            raise RuntimeError(f"{signal_name} is not in {hex(message.msg_id)}")
+        signals.append(message.signals[signal_name])
+    return signals
+
+
+def decode_stack(stack: Union[Sequence[Message], BinaryTrace],
+                 message: Message,
+                 signal_names: Optional[Sequence[str]] = None,
+                 physical: bool = True) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    从栈中解析某一个message的signal时间序列
+
+    :param stack: 记录下来的CAN消息(或者trace中读取到的消息、二进制trace)
+
+    :param message: 矩阵表中定义的message
+
+    :param signal_names: 需要解析的signal名字，默认解析全部
+
+    :param physical: True返回物理值，False返回总线值
+
+    :return: (时间戳数组, {signal_name: 每一帧的值})
+    """
+    signals = __get_signals(message, signal_names)
+    time_stamps, data = get_array(stack, message.msg_id, message.data_length)
+    return time_stamps, decode_signals(data, signals, physical)
+
+
+def decode_trace(frames: Iterable[TraceFrame],
+                 message: Message,
+                 signal_names: Optional[Sequence[str]] = None,
+                 physical: bool = True) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    边读取trace边解析某一个message的signal时间序列，只保存该message的帧
+
+    :param frames: trace中的帧，如TraceReader.iter_frames(file)
+
+    :param message: 矩阵表中定义的message
+
+    :param signal_names: 需要解析的signal名字，默认解析全部
+
+    :param physical: True返回物理值，False返回总线值
+
+    :return: (时间戳数组, {signal_name: 每一帧的值})
+    """
+    signals = __get_signals(message, signal_names)
+    time_stamps, data = get_trace_array(frames, message.msg_id, message.data_length)
+    return time_stamps, decode_signals(data, signals, physical)
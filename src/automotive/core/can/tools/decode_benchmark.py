@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        decode_benchmark.py
+# @Author:      lizhe
+# @Created:     2022/3/27 - 10:52
+# --------------------------------------------------------
+import random
+from time import perf_counter
+from typing import Dict, Sequence, Union
+
+from automotive.logger import logger as logger_module
+from automotive.logger.logger import logger
+from ..common.typehints import MessageType
+from ..message import get_message
+
+
+def benchmark_decode(messages: Union[str, MessageType],
+                     encoding: str = "utf-8",
+                     rounds: int = 100,
+                     levels: Sequence[str] = ("info", "trace"),
+                     enqueue: bool = False) -> Dict[str, float]:
+    """
+    测试不同log等级下解析帧(Message.update)的吞吐量
+
+    每个等级都把log输出到一个不做任何事情的sink，只统计构建和分发log的开销，测试完成后恢复配置文件中的logger设置
+
+    :param messages: 矩阵表(dbc文件或者messages)
+
+    :param encoding: 编码格式
+
+    :param rounds: 每个message解析的次数
+
+    :param levels: 测试的log等级
+
+    :param enqueue: 是否使用异步模式
+
+    :return: {level: 每秒解析的帧数}
+    """
+    id_messages, _ = get_message(messages, encoding)
+    frames = list(id_messages.values())
+    for message in frames:
+        message.data = [random.randint(0, 0xFF) for _ in range(message.data_length)]
+    result = dict()
+    try:
+        for level in levels:
+            logger_module.set_logger(level, enqueue=enqueue, sink=lambda _: None)
+            start = perf_counter()
+            for _ in range(rounds):
+                for message in frames:
+                    message.update(False)
+            result[level] = len(frames) * rounds / (perf_counter() - start)
+            # 异步模式下等待队列中的log处理完成再测试下一个等级
+            logger.complete()
+    finally:
+        logger_module.set_logger(logger_module.logger_level, logger_module.logger_folder,
+                                 logger_module.logger_enqueue)
+    for level, speed in result.items():
+        logger.info(f"decode with log level {level}: {speed:.0f} frames/s")
+    return result
@@ -7,14 +7,29 @@
 # @Created:     2021/5/1 - 23:38
 # --------------------------------------------------------
 import copy
+import hashlib
 import json
 import os
+import pickle
 import re
-from typing import List, Dict, Any
+from threading import Lock
+from typing import List, Dict, Any, Optional, Tuple
 
 from automotive.logger.logger import logger
 from automotive.utils.excel_utils import ExcelUtils
 
+# 缓存格式的版本，解析结果的结构发生变化的时候需要修改，旧版本的缓存文件会被忽略
+_cache_version = 2
+# 缓存文件夹，放在当前用户的目录中(不放在DBC文件旁边，避免其他人写入的缓存文件被反序列化)
+_cache_folder = os.path.join(os.path.expanduser("~"), ".automotive", "dbc_cache")
+# 缓存文件的后缀
+_cache_suffix = ".pkl"
+# 缓存文件的头部(一行纯文本: 标记 版本 内容哈希)，反序列化之前先检查头部
+_cache_magic = b"AUTOMOTIVE-DBC-CACHE"
+# 进程内的解析缓存，{内容哈希: 序列化后的解析结果}
+_parse_cache = dict()  # type: Dict[str, bytes]
+_parse_cache_lock = Lock()
+
 
 class DbcParser(object):
     # 定义常量
@@ -82,18 +97,113 @@ class DbcParser(object):
     RIGHT_BRACKETS = ")"
     RIGHT_CENTER_BRACKETS = "]"
 
-    def parse(self, dbc_file: str, encoding: str = "gbk") -> List[Dict[str, Any]]:
+    def __init__(self):
+        # 解析过程中的索引，{msg id: message}以及{(msg id, signal name): signal}
+        self.__message_index = dict()  # type: Dict[int, Dict[str, Any]]
+        self.__signal_index = dict()  # type: Dict[Tuple[int, str], Dict[str, Any]]
+
+    def parse(self, dbc_file: str, encoding: str = "gbk", use_cache: bool = True) -> List[Dict[str, Any]]:
         """
         解析DBC文件为列表类型
+
+        使用缓存的时候以文件内容的哈希作为key，先查找进程内的缓存，再查找用户目录中的缓存文件(~/.automotive/dbc_cache/key.pkl)，
+        都没有的时候才解析DBC文件并写入缓存，DBC文件内容不变的情况下不需要重新解析
         :param encoding: 编码格式
         :param dbc_file: DBC文件
+        :param use_cache: 是否使用解析缓存
         :return: messages
         """
+        if not use_cache:
+            return self.__parse(dbc_file, encoding)
+        key = self.__get_cache_key(dbc_file, encoding)
+        with _parse_cache_lock:
+            data = _parse_cache.get(key)
+        if data is not None:
+            # 每次都反序列化出新的对象，调用者修改返回值不会影响缓存
+            return pickle.loads(data)
+        cache_file = os.path.join(_cache_folder, f"{key}{_cache_suffix}")
+        data = self.__load_cache(cache_file, key)
+        messages = None
+        if data is not None:
+            try:
+                messages = pickle.loads(data)
+            except Exception as e:
+                logger.debug(f"dbc cache file[{cache_file}] is invalid, error is {e}")
+                data = None
+        if data is None:
+            messages = self.__parse(dbc_file, encoding)
+            data = pickle.dumps(messages, pickle.HIGHEST_PROTOCOL)
+            self.__save_cache(cache_file, key, data)
+        with _parse_cache_lock:
+            _parse_cache[key] = data
+        return messages
+
+    def __parse(self, dbc_file: str, encoding: str) -> List[Dict[str, Any]]:
+        """
+        解析DBC文件(不使用缓存)
+        """
         contents = self.__read_content(dbc_file, encoding)
         logger.trace(f"contents = {contents}")
         messages = self.__parse_message(contents)
         return self.__filter_messages(messages)
 
+    @staticmethod
+    def __get_cache_key(dbc_file: str, encoding: str) -> str:
+        """
+        根据缓存版本、编码格式以及文件内容计算缓存的key
+        """
+        sha256 = hashlib.sha256(f"{_cache_version}:{encoding}:".encode("utf-8"))
+        with open(dbc_file, "rb") as f:
+            sha256.update(f.read())
+        return sha256.hexdigest()
+
+    @staticmethod
+    def __get_cache_header(key: str) -> bytes:
+        """
+        缓存文件的头部，一行纯文本: 标记 版本 内容哈希
+        """
+        return b" ".join((_cache_magic, str(_cache_version).encode("ascii"), key.encode("ascii"))) + b"\n"
+
+    def __load_cache(self, cache_file: str, key: str) -> Optional[bytes]:
+        """
+        读取缓存文件，缓存文件不存在、头部的版本或者内容哈希不一致的时候返回None
+
+        只读取文件中序列化后的解析结果，不在这里反序列化
+        """
+        if not os.path.exists(cache_file):
+            return None
+        header = self.__get_cache_header(key)
+        try:
+            with open(cache_file, "rb") as f:
+                if f.readline(len(header)) != header:
+                    logger.debug(f"dbc cache file[{cache_file}] header is not match, ignore it")
+                    return None
+                data = f.read()
+            logger.debug(f"load dbc cache file[{cache_file}]")
+            return data
+        except OSError as e:
+            logger.debug(f"dbc cache file[{cache_file}] is invalid, error is {e}")
+        return None
+
+    def __save_cache(self, cache_file: str, key: str, data: bytes):
+        """
+        写入缓存文件(头部加上序列化后的解析结果)，先写入临时文件再替换，避免并发读取到不完整的文件，
+        写入失败(如目录只读)的时候只使用进程内缓存
+        """
+        header = self.__get_cache_header(key)
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+            with open(temp_file, "wb") as f:
+                f.write(header)
+                f.write(data)
+            os.replace(temp_file, cache_file)
+            logger.debug(f"save dbc cache file[{cache_file}]")
+        except OSError as e:
+            logger.debug(f"save dbc cache file[{cache_file}] failed, error is {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
     def parse_to_file(self, dbc_file: str, output_file: str):
         """
         解析DBC文件并以json方式写入到文件中
@@ -283,26 +393,34 @@ class DbcParser(object):
             .replace(f"{self.BLANK}{self.QUOTATION}{self.BLANK}", f"{self.BLANK}{self.QUOTATION}") \
             .strip()
 
-    @staticmethod
-    def __get_message_by_id(messages: List[Dict[str, List[Any]]],
-                            message_id: int) -> Dict[str, List[Any]]:
+    def __add_message(self, messages: List[Dict[str, Any]], message: Dict[str, Any], signals: List[Dict[str, Any]]):
+        """
+        把解析完成的message加入到列表中并建立索引，id或者signal重复的时候和之前一样以第一个为准
+        """
+        message["signals"] = signals
+        messages.append(message)
+        message_id = message.get("id")
+        if message_id not in self.__message_index:
+            self.__message_index[message_id] = message
+            for signal in signals:
+                self.__signal_index.setdefault((message_id, signal["name"]), signal)
+
+    def __get_message_by_id(self, message_id: int) -> Dict[str, Any]:
         """
         根据id获取message字典
         """
-        for message in messages:
-            if message["id"] == message_id:
-                return message
-        raise RuntimeError(f"no message id[{message_id}] found in messages")
+        if message_id not in self.__message_index:
+            raise RuntimeError(f"no message id[{message_id}] found in messages")
+        return self.__message_index[message_id]
 
-    @staticmethod
-    def __get_signal_by_name(signals: List[Dict[str, Any]], name: str) -> Dict[str, Any]:
+    def __get_signal_by_name(self, message_id: int, name: str) -> Dict[str, Any]:
         """
-        根据名字获取signal
+        根据message id和名字获取signal
         """
-        for signal in signals:
-            if signal["name"] == name:
-                return signal
-        raise RuntimeError(f"no signal name[{name}] found in signal")
+        self.__get_message_by_id(message_id)
+        if (message_id, name) not in self.__signal_index:
+            raise RuntimeError(f"no signal name[{name}] found in signal")
+        return self.__signal_index[(message_id, name)]
 
     @staticmethod
     def __read_from_file(dbc_file: str, encoding: str) -> List[str]:
@@ -380,14 +498,15 @@ class DbcParser(object):
         messages = []
         message = dict()
         signals = []
+        self.__message_index.clear()
+        self.__signal_index.clear()
         # 上一行是BO，这一行不是BO导致没有把数据传上去
         for content in contents:
             # 处理BO行，及Message
             if content.startswith(self.BO):
                 if len(message) != 0:
                     if not content.startswith(self.SG):
-                        message["signals"] = signals
-                        messages.append(message)
+                        self.__add_message(messages, message, signals)
                         message = dict()
                         signals = []
                     if content.startswith(self.BO):
@@ -403,12 +522,11 @@ class DbcParser(object):
             if content.startswith(self.CM):
                 # 处理剩下的BO
                 if cm_flag:
-                    message["signals"] = signals
-                    messages.append(message)
+                    self.__add_message(messages, message, signals)
                     signals = []
                     # message.clear()
                     cm_flag = False
-                self.__set_comments(messages, content)
+                self.__set_comments(content)
             # 处理BA_DEF行 （BA的定义）
             if content.startswith(self.BA_DEF):
                 self.__set_message_attribute(attr_dict, content)
@@ -417,14 +535,14 @@ class DbcParser(object):
                 self.__set_default_value(messages, content)
             # 处理BA行
             if content.startswith(self.BA):
-                self.__set_ba_values(messages, attr_dict, content)
+                self.__set_ba_values(attr_dict, content)
             # 处理VAL行
             if content.startswith(self.VAL):
-                self.__set_val_values(messages, content)
+                self.__set_val_values(content)
         logger.trace(f"messages = {messages}")
         return messages
 
-    def __set_val_values(self, messages: List[Dict[str, Any]], content: str):
+    def __set_val_values(self, content: str):
         """
         /*
          *  处理VAL模块，返回键值对
@@ -455,11 +573,10 @@ class DbcParser(object):
                 value = other[:quotation_index].strip()
                 other = other[quotation_index + 1:].strip()
                 values[key] = re.sub(self.TRIM_BLANK, self.BLANK, value)
-            message = self.__get_message_by_id(messages, message_id)
-            signal = self.__get_signal_by_name(message["signals"], signal_name)
+            signal = self.__get_signal_by_name(message_id, signal_name)
             signal["values"] = values
 
-    def __set_ba_values(self, messages: List[Dict[str, Any]], attr_dict: Dict[str, Any], content: str):
+    def __set_ba_values(self, attr_dict: Dict[str, Any], content: str):
         """
         /*
          * 处理BA_ "GenMsgDelayTime" BO_ 1069 0;
@@ -479,7 +596,7 @@ class DbcParser(object):
             name = split[0].strip()
             message_id = int(split[2].strip())
             value = split[3].strip()
-            message = self.__get_message_by_id(messages, message_id)
+            message = self.__get_message_by_id(message_id)
             logger.trace(f"msg id = [{message_id}] && message is {message}")
             self.__handle_bo(message, name, value, attr_dict)
         elif self.SG in ba:
@@ -488,9 +605,8 @@ class DbcParser(object):
             message_id = int(split[2].strip())
             signal_name = split[3].strip()
             value = split[4].strip()
-            message = self.__get_message_by_id(messages, message_id)
-            logger.trace(f"msg id = [{message_id}] && message is {message}")
-            self.__handle_sg(message, name, signal_name, value)
+            logger.trace(f"msg id = [{message_id}] && signal is {signal_name}")
+            self.__handle_sg(message_id, name, signal_name, value)
         else:
             logger.trace(f"not standard ba")
 
@@ -536,8 +652,8 @@ class DbcParser(object):
         else:
             logger.debug(f"type is {name}, so nothing to do")
 
-    def __handle_sg(self, message: Dict[str, Any], name: str, signal_name: str, value: str):
-        signal = self.__get_signal_by_name(message["signals"], signal_name)
+    def __handle_sg(self, message_id: int, name: str, signal_name: str, value: str):
+        signal = self.__get_signal_by_name(message_id, signal_name)
         if name.upper() == self.GEN_SIG_START_VALUE.upper():
             logger.trace(f"value is {value}")
             if self.POINT in value:
@@ -643,7 +759,7 @@ class DbcParser(object):
                     attr_dict[name] = other.split(self.COMMA)
                     logger.trace(f"ENUM attr_dict[{name}] = {other}")
 
-    def __set_comments(self, messages: List[Dict[str, Any]], content: str):
+    def __set_comments(self, content: str):
         """
         /*
          *  处理CM模块的，返回键值对
@@ -676,8 +792,7 @@ class DbcParser(object):
             logger.trace(f"parse blank_index other = [{other}]")
             # "Seat Vertical Adjust Motor Target Position 座椅垂直调节电机目标位置";
             comment = other.replace(self.QUOTATION, self.BLANK).replace(self.SEMICOLON, self.BLANK)
-            message = self.__get_message_by_id(messages, message_id)
-            signal = self.__get_signal_by_name(message["signals"], signal_name)
+            signal = self.__get_signal_by_name(message_id, signal_name)
             signal["comment"] = re.sub(self.TRIM_BLANK, self.BLANK, comment).strip()
 
     def __set_message(self, message: Dict[str, Any], content: str):
@@ -7,13 +7,71 @@
 # @Created:     2021/5/1 - 23:42
 # --------------------------------------------------------
 import importlib
-from typing import List, Any, Tuple, Optional
-from time import sleep
+from typing import List, Tuple, Optional, Iterable, Iterator
+from time import sleep, perf_counter_ns
+
+import numpy as np
 
 from automotive.logger.logger import logger
 from ..can_service import Can
 from ..message import Message
 from ..common.enums import CanBoxDeviceEnum, BaudRateEnum, TraceTypeEnum
+from ..common.typehints import TraceFrame
+from .reader.trace_reader import TraceReader
+from .reader.binary_trace_reader import open_trace
+
+
+class PlaybackStatistics(object):
+    """
+    回放的统计数据
+
+    时间误差指每批帧实际开始发送的时间和计划时间的差值(毫秒)，按照1微秒的精度放入直方图中计算百分位，内存占用固定
+    """
+    # 直方图的范围(微秒)，超过的部分计入最后一格
+    __max_error = 100000
+
+    def __init__(self):
+        # 发送的帧数量
+        self.count = 0
+        # 发送失败的帧数量
+        self.failed = 0
+        # 发送的批次(时间相同的帧为一批)
+        self.batches = 0
+        # 回放总耗时(秒)
+        self.duration = 0.0
+        # 最大时间误差(毫秒)
+        self.max_error = 0.0
+        self.__histogram = np.zeros(self.__max_error + 1, dtype=np.int64)
+        self.__total = 0
+
+    def add_error(self, error: float):
+        """
+        记录一次时间误差
+
+        :param error: 时间误差(毫秒)
+        """
+        self.__histogram[min(max(int(error * 1000), 0), self.__max_error)] += 1
+        self.__total += 1
+        if error > self.max_error:
+            self.max_error = error
+
+    def percentile(self, value: float) -> float:
+        """
+        获取时间误差的百分位
+
+        :param value: 百分位，如50、99
+
+        :return: 时间误差(毫秒)
+        """
+        if self.__total == 0:
+            return 0.0
+        position = int(np.searchsorted(np.cumsum(self.__histogram), self.__total * value / 100))
+        return position / 1000
+
+    def __repr__(self):
+        return f"count={self.count}, failed={self.failed}, batches={self.batches}, duration={self.duration:.3f}s, " \
+               f"error(p50={self.percentile(50):.3f}ms, p90={self.percentile(90):.3f}ms, " \
+               f"p99={self.percentile(99):.3f}ms, max={self.max_error:.3f}ms)"
 
 
 class TracePlayback(object):
@@ -24,26 +82,42 @@ class TracePlayback(object):
     """
 
     def __init__(self, can_box_device: Optional[CanBoxDeviceEnum] = None, baud_rate: BaudRateEnum = BaudRateEnum.HIGH,
-                 can_fd: bool = False):
+                 can_fd: bool = False, spin_time: float = 0.0005):
+        """
+        :param spin_time: 距离发送时间小于spin_time(秒)的时候不再睡眠而是忙等待，减少系统睡眠精度带来的误差
+        """
         self.__can = Can(can_box_device=can_box_device, baud_rate=baud_rate, can_fd=can_fd)
+        self.__spin_time = int(spin_time * 1000000000)
+
+    @staticmethod
+    def __get_reader(trace_type: TraceTypeEnum) -> TraceReader:
+        """
+        根据trace类型获取读取器
+
+        :param trace_type: 存trace的类型
+
+        :return: 读取器
+        """
+        module_name, class_name = trace_type.value
+        # 动态导入模块
+        module = importlib.import_module(f"automotive.core.can.tools.reader.{module_name}")
+        # 实例化模块的类名
+        return getattr(module, class_name)()
 
     @staticmethod
-    def __handle_traces(traces: List[Tuple[float, Message]]) -> List[Tuple[float, Any]]:
-        """
-        把需要间隔的时间提前计算出来
-        :param traces:
-        """
-        handle_traces = []
-        for i, trace in enumerate(traces):
-            message = traces[i][1]
-            if i == 0:
-                handle_traces.append((0, message))
-            else:
-                # 计算间隔时间
-                last_time = traces[i - 1][0]
-                current_time = traces[i][0]
-                handle_traces.append((current_time - last_time, message))
-        return handle_traces
+    def __handle_traces(frames: Iterable[TraceFrame]) -> Iterator[Tuple[float, Message]]:
+        """
+        把需要间隔的时间计算出来，逐帧生成Message
+        :param frames: trace中的帧
+        """
+        last_time = None
+        for time, msg_id, data in frames:
+            message = Message()
+            message.msg_id = msg_id
+            message.data = data
+            # 计算间隔时间
+            yield (0 if last_time is None else time - last_time), message
+            last_time = time
 
     def open_can(self):
         """
@@ -57,41 +131,134 @@ class TracePlayback(object):
         """
         self.__can.close_can()
 
-    def read_trace(self, file: str, trace_type: TraceTypeEnum) -> List[Tuple[float, Message]]:
+    def iter_trace(self, file: str, trace_type: TraceTypeEnum,
+                   use_cache: bool = False) -> Iterator[Tuple[float, Message]]:
+        """
+        从文件中逐帧读取trace，不会把整个文件读到内存中
+
+        :param file: trace文件
+
+        :param trace_type:  存trace的类型，支持vspy3和cantools以及pcan， canoe存的log以及二进制trace
+
+        :param use_cache: 是否使用二进制trace缓存(trace文件名加上.btr)，第一次读取的时候转换，之后直接读取缓存
+
+        :return: (和上一帧的间隔时间, Message)的迭代器
+        """
+        logger.info(f"read messages in trace file[{file}]")
+        if use_cache:
+            return self.__handle_traces(open_trace(file, trace_type).iter_frames())
+        # 由于统一了接口，调用统一的方法就可以实现读取的功能
+        return self.__handle_traces(self.__get_reader(trace_type).iter_frames(file))
+
+    def read_trace(self, file: str, trace_type: TraceTypeEnum, use_cache: bool = False) -> List[Tuple[float, Message]]:
         """
         从文件中读取并生成可以发送的trace列表
 
         :param file: trace文件
 
-        :param trace_type:  存trace的类型，支持vspy3和cantools以及pcan， canoe存的log
+        :param trace_type:  存trace的类型，支持vspy3和cantools以及pcan， canoe存的log以及二进制trace
+
+        :param use_cache: 是否使用二进制trace缓存
 
         :return: trace 列表
         """
-        module_name, class_name = trace_type.value
-        # 动态导入模块
-        module = importlib.import_module(f"automotive.core.can.trace_reader.{module_name}")
-        # 实例化模块的类名
-        reader = getattr(module, class_name)()
-        logger.info(f"read all messages in trace file[{file}]")
-        # 由于统一了接口，调用统一的方法就可以实现读取的功能
-        traces = reader.read(file)
+        traces = list(self.iter_trace(file, trace_type, use_cache))
         logger.info(f"done read work, it will send {len(traces)} messages")
-        return self.__handle_traces(traces)
+        return traces
 
-    def send_trace(self, traces: List[Tuple[float, Message]]):
+    def __wait(self, deadline: int):
         """
-        回放trace
+        等待到计划时间，先睡眠，剩余spin_time的时候忙等待
 
-        :param traces: trace列表
+        :param deadline: 计划时间(perf_counter_ns)
         """
-        # 初始的时间
-        logger.info("start to send message")
-        for index, trace in enumerate(traces):
-            sleep_time, msg = trace
-            if index != 0:
-                sleep(sleep_time)
+        remain = deadline - perf_counter_ns()
+        if remain > self.__spin_time:
+            sleep((remain - self.__spin_time) / 1000000000)
+        while perf_counter_ns() < deadline:
+            pass
+
+    def __send_batch(self, index: int, messages: List[Message]) -> int:
+        """
+        发送同一个时间的一批帧
+
+        :return: 发送失败的帧数量
+        """
+        failed = 0
+        for offset, message in enumerate(messages):
             try:
-                self.__can.transmit_one(msg)
+                self.__can.transmit_one(message)
             except RuntimeError:
-                logger.error(f"the {index + 1} message transmit failed")
-        logger.info("message send done")
+                failed += 1
+                logger.error(f"the {index + offset + 1} message transmit failed")
+        return failed
+
+    def send_trace(self, traces: Iterable[Tuple[float, Message]], speed: float = 1.0) -> PlaybackStatistics:
+        """
+        回放trace
+
+        每一帧按照trace中的时间换算成绝对的计划时间发送，发送耗时和睡眠误差不会累计，时间相同的帧作为一批连续发送
+
+        :param traces: trace列表或者iter_trace返回的迭代器
+
+        :param speed: 回放速度，如0.5表示慢放一倍，2表示快放一倍，小于等于0表示不等待尽快发送
+
+        :return: 回放的时间误差统计
+        """
+        statistics = PlaybackStatistics()
+        # 初始的时间
+        logger.info(f"start to send message, speed is {speed}")
+        start_time = perf_counter_ns()
+        # 当前帧在trace中相对于第一帧的时间(秒)
+        trace_time = 0.0
+        batch = []
+        batch_time = 0.0
+        index = 0
+        for sleep_time, msg in traces:
+            trace_time += sleep_time
+            if batch and trace_time == batch_time:
+                batch.append(msg)
+                continue
+            if batch:
+                index = self.__play_batch(statistics, start_time, batch_time, batch, speed, index)
+            batch = [msg]
+            batch_time = trace_time
+        if batch:
+            self.__play_batch(statistics, start_time, batch_time, batch, speed, index)
+        statistics.duration = (perf_counter_ns() - start_time) / 1000000000
+        logger.info(f"message send done, {statistics}")
+        return statistics
+
+    def __play_batch(self, statistics: PlaybackStatistics, start_time: int, batch_time: float, batch: List[Message],
+                     speed: float, index: int) -> int:
+        """
+        等待并发送一批帧，记录时间误差
+
+        :return: 下一帧的序号
+        """
+        if speed > 0:
+            deadline = start_time + int(batch_time / speed * 1000000000)
+            self.__wait(deadline)
+            statistics.add_error((perf_counter_ns() - deadline) / 1000000)
+        failed = self.__send_batch(index, batch)
+        statistics.count += len(batch)
+        statistics.failed += failed
+        statistics.batches += 1
+        return index + len(batch)
+
+    def play_trace(self, file: str, trace_type: TraceTypeEnum, speed: float = 1.0,
+                   use_cache: bool = False) -> PlaybackStatistics:
+        """
+        边读取边回放trace，内存占用和trace文件大小无关
+
+        :param file: trace文件
+
+        :param trace_type:  存trace的类型
+
+        :param speed: 回放速度，小于等于0表示尽快发送
+
+        :param use_cache: 是否使用二进制trace缓存
+
+        :return: 回放的时间误差统计
+        """
+        return self.send_trace(self.iter_trace(file, trace_type, use_cache), speed)
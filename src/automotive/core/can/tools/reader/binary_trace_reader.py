@@ -0,0 +1,388 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        binary_trace_reader.py
+# @Author:      lizhe
+# @Created:     2022/3/20 - 14:26
+# --------------------------------------------------------
+import importlib
+import os
+import struct
+from typing import Iterator, Optional, Tuple, List, Iterable
+
+import numpy as np
+
+from automotive.core.can.message import Message
+from automotive.core.can.common.enums import TraceTypeEnum
+from automotive.core.can.common.typehints import TraceFrame
+from .trace_reader import TraceReader
+from automotive.logger.logger import logger
+
+"""
+二进制trace缓存
+
+把文本trace转换成定长记录的二进制文件，打开的时候使用内存映射，不需要解析，可以直接按照msg id和时间查找
+
+文件结构(小端)：
+
+    1、文件头：magic、版本、数据宽度、时间索引间隔、帧数量、msg id数量以及各部分的偏移
+
+    2、帧记录：按照时间排序的定长记录(时间、msg id、数据长度、数据)
+
+    3、msg id索引：每个msg id的帧数量以及在id_order中的起始位置
+
+    4、id_order：按照msg id分组(组内按照时间排序)的帧序号
+
+    5、时间索引：每block_size帧记录一次时间，用于快速定位时间
+"""
+
+_magic = b"ATRC"
+_version = 1
+# magic, 版本, 数据宽度, 时间索引间隔, 帧数量, msg id数量, 帧记录偏移, msg id索引偏移, id_order偏移, 时间索引偏移
+_header = struct.Struct("<4sIIIQQQQQQ")
+# 数据对齐
+_align = 64
+# 转换的时候每次写入的帧数量
+_chunk_size = 65536
+# msg id索引的记录
+_id_dtype = np.dtype([("msg_id", "<u4"), ("reserved", "<u4"), ("offset", "<i8"), ("count", "<i8")])
+
+
+def _record_dtype(width: int) -> np.dtype:
+    """
+    帧记录的格式
+
+    :param width: 数据宽度，CAN为8，CAN FD为64
+    """
+    return np.dtype([("time", "<f8"), ("msg_id", "<u4"), ("dlc", "u1"), ("reserved", "u1", (3,)),
+                     ("data", "u1", (width,))])
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _align - 1) // _align * _align
+
+
+class BinaryTrace(object):
+    """
+    内存映射方式打开的二进制trace，提供和FrameStack一致的get_array以及get_frames接口，可以直接用于signal_decoder
+    """
+
+    def __init__(self, file: str):
+        """
+        :param file: 二进制trace文件
+        """
+        self.__file = file
+        with open(file, "rb") as f:
+            header = f.read(_header.size)
+        if len(header) < _header.size:
+            raise ValueError(f"{file} is not binary trace file")
+        magic, version, width, block_size, count, id_count, records_offset, id_offset, order_offset, time_offset = \
+            _header.unpack(header)
+        if magic != _magic:
+            raise ValueError(f"{file} is not binary trace file")
+        if version != _version:
+            raise ValueError(f"binary trace version[{version}] not support, only support version[{_version}]")
+        self.__width = width
+        self.__block_size = block_size
+        self.__count = count
+        self.__records = self.__map(_record_dtype(width), records_offset, count)
+        ids = self.__map(_id_dtype, id_offset, id_count)
+        self.__index = dict((int(msg_id), (int(offset), int(size)))
+                            for msg_id, offset, size in zip(ids["msg_id"], ids["offset"], ids["count"]))
+        self.__id_order = self.__map(np.dtype("<i8"), order_offset, count)
+        self.__time_index = self.__map(np.dtype("<f8"), time_offset, (count + block_size - 1) // block_size)
+
+    def __map(self, dtype: np.dtype, offset: int, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.__file, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+    @property
+    def file(self) -> str:
+        return self.__file
+
+    @property
+    def width(self) -> int:
+        return self.__width
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def close(self):
+        """
+        释放内存映射
+        """
+        self.__records = np.zeros(0, dtype=self.__records.dtype)
+        self.__id_order = np.zeros(0, dtype=self.__id_order.dtype)
+        self.__time_index = np.zeros(0, dtype=self.__time_index.dtype)
+        self.__index.clear()
+        self.__count = 0
+
+    def msg_ids(self) -> List[int]:
+        """
+        获取trace中的所有msg id
+        """
+        return list(self.__index.keys())
+
+    def count(self, msg_id: int) -> int:
+        """
+        获取某个msg id的帧数量
+        """
+        return self.__index[msg_id][1] if msg_id in self.__index else 0
+
+    def __search(self, time_stamp: float, right: bool) -> int:
+        """
+        通过时间索引查找时间在帧记录中的位置，只会访问时间索引和一个block的数据
+        """
+        side = "right" if right else "left"
+        block = int(np.searchsorted(self.__time_index, time_stamp, side=side))
+        # 目标位置在前一个block中
+        start = max(block - 1, 0) * self.__block_size
+        end = min(block * self.__block_size + 1, self.__count)
+        return start + int(np.searchsorted(self.__records["time"][start:end], time_stamp, side=side))
+
+    def __get_range(self, start_time: Optional[float], end_time: Optional[float]) -> Tuple[int, int]:
+        """
+        获取时间范围内所有帧的起止位置
+        """
+        low = 0 if start_time is None else self.__search(start_time, False)
+        high = self.__count if end_time is None else self.__search(end_time, True)
+        return low, max(low, high)
+
+    def __get_indexes(self, msg_id: int, start_time: Optional[float], end_time: Optional[float]) -> np.ndarray:
+        """
+        获取某个msg id满足条件的帧序号
+        """
+        if msg_id not in self.__index:
+            return np.zeros(0, dtype=np.int64)
+        offset, size = self.__index[msg_id]
+        indexes = np.asarray(self.__id_order[offset:offset + size])
+        if start_time is not None or end_time is not None:
+            time_stamps = self.__records["time"][indexes]
+            low = 0 if start_time is None else int(np.searchsorted(time_stamps, start_time, side="left"))
+            high = len(indexes) if end_time is None else int(np.searchsorted(time_stamps, end_time, side="right"))
+            indexes = indexes[low:high]
+        return indexes
+
+    def get_array(self,
+                  msg_id: Optional[int] = None,
+                  start_time: Optional[float] = None,
+                  end_time: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取帧的时间戳数组和(N, width)的数据矩阵
+
+        :param msg_id: 帧ID，为空表示所有帧
+
+        :param start_time: 开始时间(包含)，为空表示不限制
+
+        :param end_time: 结束时间(包含)，为空表示不限制
+
+        :return: (时间戳数组, 数据矩阵)
+        """
+        if msg_id is None:
+            low, high = self.__get_range(start_time, end_time)
+            records = self.__records[low:high]
+        else:
+            records = self.__records[self.__get_indexes(msg_id, start_time, end_time)]
+        return np.array(records["time"]), np.array(records["data"])
+
+    def iter_frames(self,
+                    msg_id: Optional[int] = None,
+                    start_time: Optional[float] = None,
+                    end_time: Optional[float] = None) -> Iterator[TraceFrame]:
+        """
+        按照时间顺序逐帧返回，每次只读取一部分数据
+
+        :param msg_id: 帧ID，为空表示所有帧
+
+        :param start_time: 开始时间(包含)，为空表示不限制
+
+        :param end_time: 结束时间(包含)，为空表示不限制
+
+        :return: (时间, msg_id, 数据)的迭代器
+        """
+        if msg_id is None:
+            low, high = self.__get_range(start_time, end_time)
+            indexes = None
+        else:
+            indexes = self.__get_indexes(msg_id, start_time, end_time)
+            low, high = 0, len(indexes)
+        for start in range(low, high, _chunk_size):
+            end = min(start + _chunk_size, high)
+            records = self.__records[start:end] if indexes is None else self.__records[indexes[start:end]]
+            frames = zip(records["time"].tolist(), records["msg_id"].tolist(), records["dlc"].tolist(),
+                         records["data"].tolist())
+            for time_stamp, frame_id, dlc, data in frames:
+                yield time_stamp, frame_id, data[:dlc]
+
+    def get_frames(self,
+                   msg_id: Optional[int] = None,
+                   start_time: Optional[float] = None,
+                   end_time: Optional[float] = None) -> List[Message]:
+        """
+        获取帧列表
+
+        :param msg_id: 帧ID，为空表示所有帧
+
+        :param start_time: 开始时间(包含)，为空表示不限制
+
+        :param end_time: 结束时间(包含)，为空表示不限制
+
+        :return: Message对象列表
+        """
+        messages = []
+        for time_stamp, frame_id, data in self.iter_frames(msg_id, start_time, end_time):
+            message = Message()
+            message.msg_id = frame_id
+            message.time_stamp = time_stamp
+            message.data_length = len(data)
+            message.data = data
+            messages.append(message)
+        return messages
+
+
+class BinaryTraceReader(TraceReader):
+
+    def iter_frames(self, file: str) -> Iterator[TraceFrame]:
+        """
+        读取二进制trace
+
+        :param file: 二进制trace文件
+        :return: (时间, msg_id, 数据)
+        """
+        return BinaryTrace(file).iter_frames()
+
+
+def __to_records(frames: List[TraceFrame], dtype: np.dtype) -> np.ndarray:
+    """
+    把一批帧转换成帧记录
+    """
+    width = dtype["data"].shape[0]
+    records = np.zeros(len(frames), dtype=dtype)
+    if len(frames) == 0:
+        return records
+    time_stamps, msg_ids, data = zip(*frames)
+    lengths = [len(row) for row in data]
+    if max(lengths) > width:
+        raise ValueError(f"data length[{max(lengths)}] greater than width[{width}]")
+    records["time"] = time_stamps
+    records["msg_id"] = msg_ids
+    records["dlc"] = lengths
+    records["data"] = [row + [0] * (width - len(row)) if len(row) < width else row for row in data]
+    return records
+
+
+def write_binary_trace(frames: Iterable[TraceFrame], file: str, width: int = 8, block_size: int = 1024) -> str:
+    """
+    把帧写入二进制trace文件
+
+    :param frames: 帧，如TraceReader.iter_frames(file)
+
+    :param file: 二进制trace文件
+
+    :param width: 数据宽度，CAN为8，CAN FD为64
+
+    :param block_size: 时间索引的间隔(帧数量)
+
+    :return: 二进制trace文件
+    """
+    dtype = _record_dtype(width)
+    records_offset = _aligned(_header.size)
+    count = 0
+    is_sorted = True
+    last_time = float("-inf")
+    temp_file = f"{file}.tmp"
+    try:
+        with open(temp_file, "wb") as f:
+            f.write(b"\0" * records_offset)
+            chunk = []
+            for frame in frames:
+                time_stamp = frame[0]
+                if time_stamp < last_time:
+                    is_sorted = False
+                last_time = time_stamp
+                chunk.append(frame)
+                if len(chunk) == _chunk_size:
+                    f.write(__to_records(chunk, dtype).tobytes())
+                    count += len(chunk)
+                    chunk = []
+            f.write(__to_records(chunk, dtype).tobytes())
+            count += len(chunk)
+        records = np.memmap(temp_file, dtype=dtype, mode="r+", offset=records_offset, shape=(count,)) \
+            if count > 0 else np.zeros(0, dtype=dtype)
+        if not is_sorted:
+            # trace中的时间不是递增的时候按照时间重新排序
+            records[:] = records[np.argsort(records["time"], kind="stable")]
+        msg_ids = np.array(records["msg_id"])
+        id_order = np.argsort(msg_ids, kind="stable").astype("<i8")
+        unique_ids, offsets, sizes = np.unique(msg_ids[id_order], return_index=True, return_counts=True)
+        ids = np.zeros(len(unique_ids), dtype=_id_dtype)
+        ids["msg_id"] = unique_ids
+        ids["offset"] = offsets
+        ids["count"] = sizes
+        time_index = np.array(records["time"][::block_size], dtype="<f8")
+        if isinstance(records, np.memmap):
+            records.flush()
+        del records
+        with open(temp_file, "r+b") as f:
+            id_offset = _aligned(records_offset + count * dtype.itemsize)
+            order_offset = _aligned(id_offset + ids.nbytes)
+            time_offset = _aligned(order_offset + id_order.nbytes)
+            for offset, array in ((id_offset, ids), (order_offset, id_order), (time_offset, time_index)):
+                f.seek(offset)
+                f.write(array.tobytes())
+            f.seek(0)
+            f.write(_header.pack(_magic, _version, width, block_size, count, len(ids), records_offset, id_offset,
+                                 order_offset, time_offset))
+        os.replace(temp_file, file)
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    logger.debug(f"write {count} frames to binary trace {file}")
+    return file
+
+
+def convert_trace(file: str, trace_type: TraceTypeEnum, output: Optional[str] = None, width: int = 8) -> str:
+    """
+    把文本trace转换成二进制trace
+
+    :param file: trace文件
+
+    :param trace_type: 存trace的类型
+
+    :param output: 二进制trace文件，默认为trace文件名加上.btr
+
+    :param width: 数据宽度，CAN为8，CAN FD为64
+
+    :return: 二进制trace文件
+    """
+    module_name, class_name = trace_type.value
+    module = importlib.import_module(f"automotive.core.can.tools.reader.{module_name}")
+    reader = getattr(module, class_name)()
+    output = output if output else f"{file}.btr"
+    logger.info(f"convert trace file[{file}] to binary trace file[{output}]")
+    return write_binary_trace(reader.iter_frames(file), output, width)
+
+
+def open_trace(file: str, trace_type: TraceTypeEnum, output: Optional[str] = None, width: int = 8) -> BinaryTrace:
+    """
+    打开trace对应的二进制trace，二进制trace不存在或者比trace文件旧的时候重新转换
+
+    :param file: trace文件
+
+    :param trace_type: 存trace的类型
+
+    :param output: 二进制trace文件，默认为trace文件名加上.btr
+
+    :param width: 数据宽度，CAN为8，CAN FD为64
+
+    :return: 二进制trace
+    """
+    if trace_type == TraceTypeEnum.BINARY:
+        return BinaryTrace(file)
+    output = output if output else f"{file}.btr"
+    if not os.path.exists(output) or os.path.getmtime(output) < os.path.getmtime(file):
+        convert_trace(file, trace_type, output, width)
+    return BinaryTrace(output)
@@ -7,42 +7,34 @@
 # @Created:     2021/5/1 - 23:44
 # --------------------------------------------------------
 import re
-from typing import List, Tuple
+from typing import Iterator
 
-from automotive.core.can.message import Message
+from automotive.core.can.common.typehints import TraceFrame
 from .trace_reader import TraceReader
 from automotive.logger.logger import logger
 
+_time_pattern = re.compile(r"\d+\.\d{6}")
+_data_pattern = re.compile(r"(\s\w{2}){8}")
+_id_pattern = re.compile(r"ID\s=\s(\d+)")
 
-class CanoeAscReader(TraceReader):
-
-    def read(self, file: str) -> List[Tuple[float, Message]]:
-        contents = self.__filter_content(file)
-        logger.debug(f"trace size = {len(contents)}")
-        return self.__convert(contents)
 
-    @staticmethod
-    def __filter_content(file: str):
-        with open(file, "r") as f:
-            lines = f.readlines()
-            return list(filter(lambda x: len(x.split(" ")) == 41, lines))
+class CanoeAscReader(TraceReader):
 
-    @staticmethod
-    def __convert(contents: List[str]) -> List[Tuple[float, Message]]:
+    def iter_frames(self, file: str) -> Iterator[TraceFrame]:
         """
-        解析content，并生成message对象
+        解析content，并生成帧
           10.868138 1  406             Rx   d 8 06 01 00 00 00 00 00 00  Length = 237910 BitCount = 123 ID = 1030
-        :param contents:
-        :return: List<Message>
+        :param file: trace文件
+        :return: (时间, msg_id, 数据)
         """
-        trace = []
-        for content in contents:
-            time = re.search(r"\d+\.\d{6}", content).group(0)
-            data = re.search(r"(\s\w{2}){8}", content).group(0).strip().split(" ")
-            msg_id = re.search(r"ID\s=\s\d+", content).group(0).split("=")[1]
-            logger.debug(f"{time}, {data}, {msg_id}")
-            message = Message()
-            message.msg_id = int(msg_id)
-            message.data = list(map(lambda x: int(x, 16), data))
-            trace.append((float(time), message))
-        return trace
+        count = 0
+        with open(file, "r") as f:
+            for content in f:
+                if len(content.split(" ")) != 41:
+                    continue
+                time = _time_pattern.search(content).group(0)
+                data = _data_pattern.search(content).group(0).split()
+                msg_id = _id_pattern.search(content).group(1)
+                count += 1
+                yield float(time), int(msg_id), [int(x, 16) for x in data]
+        logger.debug(f"trace size = {count}")
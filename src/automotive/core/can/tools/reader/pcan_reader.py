@@ -7,42 +7,34 @@
 # @Created:     2021/5/1 - 23:44
 # --------------------------------------------------------
 import re
-from typing import Tuple, List
+from typing import Iterator
 
-from automotive.core.can.message import Message
+from automotive.core.can.common.typehints import TraceFrame
 from .trace_reader import TraceReader
 from automotive.logger.logger import logger
 
+_time_pattern = re.compile(r"\s\d+\.\d+\s")
+_data_pattern = re.compile(r"(\s\w{2}){8}")
+_id_pattern = re.compile(r"\s\w{4}\s")
 
-class PCanReader(TraceReader):
-
-    def read(self, file: str) -> List[Tuple[float, Message]]:
-        contents = self.__filter_content(file)
-        logger.debug(f"trace size = {len(contents)}")
-        return self.__convert(contents)
 
-    @staticmethod
-    def __filter_content(file: str):
-        with open(file, "r") as f:
-            lines = f.readlines()
-            return list(filter(lambda x: "Rx" in x, lines))
+class PCanReader(TraceReader):
 
-    @staticmethod
-    def __convert(contents: List[str]) -> List[Tuple[float, Message]]:
+    def iter_frames(self, file: str) -> Iterator[TraceFrame]:
         """
-        解析content，并生成message对象
+        解析content，并生成帧
              3)    216628.2  Rx         0406  8  06 01 00 00 00 00 00 00
-        :param contents:
-        :return: List<Message>
+        :param file: trace文件
+        :return: (时间, msg_id, 数据)
         """
-        trace = []
-        for content in contents:
-            time = re.search(r"\s\d+\.\d+\s", content).group(0)
-            data = re.search(r"(\s\w{2}){8}", content).group(0).strip().split(" ")
-            msg_id = re.search(r"\s\w{4}\s", content).group(0)
-            logger.debug(f"{time}, {data}, {msg_id}")
-            message = Message()
-            message.msg_id = int(msg_id, 16)
-            message.data = list(map(lambda x: int(x, 16), data))
-            trace.append((float(time) / 1000, message))
-        return trace
+        count = 0
+        with open(file, "r") as f:
+            for content in f:
+                if "Rx" not in content:
+                    continue
+                time = _time_pattern.search(content).group(0)
+                data = _data_pattern.search(content).group(0).split()
+                msg_id = _id_pattern.search(content).group(0)
+                count += 1
+                yield float(time) / 1000, int(msg_id, 16), [int(x, 16) for x in data]
+        logger.debug(f"trace size = {count}")
@@ -7,19 +7,38 @@
 # @Created:     2021/5/1 - 23:45
 # --------------------------------------------------------
 from abc import ABCMeta, abstractmethod
-from typing import Tuple, List
+from typing import Tuple, List, Iterator
 
 from automotive.core.can.message import Message
+from automotive.core.can.common.typehints import TraceFrame
 
 
 class TraceReader(metaclass=ABCMeta):
 
     @abstractmethod
+    def iter_frames(self, file: str) -> Iterator[TraceFrame]:
+        """
+        逐行读取trace文件，每解析出一帧就返回一帧，不会把整个文件读到内存中
+
+        :param file: trace文件
+
+        :return: (时间(秒), msg_id, 数据)的迭代器
+        """
+        pass
+
     def read(self, file: str) -> List[Tuple[float, Message]]:
         """
         从文件中读取内容，并生成一个Message对象的列表，
         列表中包含元组， (时间，Message对象)
+
+        会把整个trace读到内存中，trace文件较大的时候请使用iter_frames
         :param file: trace文件
         :return: 有序列表
         """
-        pass
+        trace = []
+        for time, msg_id, data in self.iter_frames(file):
+            message = Message()
+            message.msg_id = msg_id
+            message.data = data
+            trace.append((time, message))
+        return trace
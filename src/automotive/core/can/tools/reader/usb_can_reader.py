@@ -7,53 +7,40 @@
 # @Created:     2021/5/1 - 23:45
 # --------------------------------------------------------
 import re
-from typing import List, Tuple
+from typing import Iterator
 
-from automotive.core.can.message import Message
+from automotive.core.can.common.typehints import TraceFrame
 from .trace_reader import TraceReader
 from automotive.logger.logger import logger
 
+_time_pattern = re.compile(r"(\d{2}):(\d{2}):(\d{2})\.(\d{3})")
+_data_pattern = re.compile(r"(\s\w{2}){8}")
+_id_pattern = re.compile(r"0x(\w{4}),")
 
-class UsbCanReader(TraceReader):
-
-    def read(self, file: str) -> List[Tuple[float, Message]]:
-        contents = self.__filter_content(file)
-        logger.debug(f"trace size = {len(contents)}")
-        return self.__convert(contents)
 
-    @staticmethod
-    def __filter_content(file: str):
-        with open(file, "r") as f:
-            lines = f.readlines()
-            lines.pop(0)
-            return lines
+class UsbCanReader(TraceReader):
 
-    def __convert(self, contents: list) -> List[Tuple[float, Message]]:
+    def iter_frames(self, file: str) -> Iterator[TraceFrame]:
         """
-        解析content，并生成message对象
+        解析content，并生成帧
         00345,="09:35:34.992",0x376549,ch1,接收,0x0406,数据帧,标准帧,0x08,x| 06 01 00 00 00 00 00 00
-        :param contents:
-        :return: List<Message>
+        :param file: trace文件
+        :return: (时间, msg_id, 数据)
         """
-        trace = []
-        for content in contents:
-            time = re.search(r"\d{2}:\d{2}:\d{2}\.\d{3}", content).group(0)
-            data = re.search(r"(\s\w{2}){8}", content).group(0).strip().split(" ")
-            msg_id = re.search(r"0x\w{4},", content).group(0)[:-1]
-            logger.debug(f"{time}, {data}, {msg_id}")
-            message = Message()
-            message.msg_id = int(msg_id, 16)
-            message.data = list(map(lambda x: int(x, 16), data))
-            trace.append((self.__get_time(time), message))
-        return trace
+        count = 0
+        with open(file, "r") as f:
+            # 第一行是标题
+            next(f, None)
+            for content in f:
+                time = _time_pattern.search(content)
+                data = _data_pattern.search(content).group(0).split()
+                msg_id = _id_pattern.search(content).group(1)
+                count += 1
+                yield self.__get_time(time), int(msg_id, 16), [int(x, 16) for x in data]
+        logger.debug(f"trace size = {count}")
 
     @staticmethod
-    def __get_time(hex_time):
-        splits = hex_time.split(".")
-        date_time = splits[0].split(":")
-        hour = date_time[0]
-        minutes = date_time[1]
-        seconds = date_time[2]
-        millisecond = splits[1]
+    def __get_time(time) -> float:
+        hour, minutes, seconds, millisecond = time.groups()
         current_time = (int(hour) * 60 * 60 + int(minutes) * 60 + int(seconds)) * 1000 + int(millisecond)
         return current_time / 1000
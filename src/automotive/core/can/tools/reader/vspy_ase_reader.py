@@ -7,43 +7,34 @@
 # @Created:     2021/5/1 - 23:45
 # --------------------------------------------------------
 import re
-from typing import List, Tuple
+from typing import Iterator
 
-from automotive.core.can.message import Message
+from automotive.core.can.common.typehints import TraceFrame
 from .trace_reader import TraceReader
 from automotive.logger.logger import logger
 
+_time_pattern = re.compile(r"\d+.\d{6}")
+_id_pattern = re.compile(r"\s\w{3}")
+_data_pattern = re.compile(r"(\s\w{2}){8}")
 
-class VspyAseReader(TraceReader):
-
-    def read(self, file: str) -> List[Tuple[float, Message]]:
-        contents = self.__filter_content(file)
-        logger.debug(f"trace size = {len(contents)}")
-        return self.__convert(contents)
 
-    @staticmethod
-    def __filter_content(file: str):
-        with open(file, "r") as f:
-            lines = f.readlines()
-            return list(filter(lambda x: len(x.split(" ")) >= 28, lines))
+class VspyAseReader(TraceReader):
 
-    @staticmethod
-    def __convert(contents: list) -> List[Tuple[float, Message]]:
+    def iter_frames(self, file: str) -> Iterator[TraceFrame]:
         """
-        解析content，并生成message对象
+        解析content，并生成帧
         0.000000 0 25C             Tx   d 8 00 00 00 00 00 00 00 00
-        :param contents:
-        :return: List<Message>
+        :param file: trace文件
+        :return: (时间, msg_id, 数据)
         """
-        traces = []
-        for content in contents:
-            logger.trace(f"content = {content}")
-            time = re.search(r"\d+.\d{6}", content).group(0)
-            msg_id = re.search(r"\s\w{3}", content).group(0).strip()
-            data = re.search(r"(\s\w{2}){8}", content).group(0).strip().split(" ")
-            logger.debug(f"{time}, {msg_id}")
-            message = Message()
-            message.msg_id = int(msg_id, 16)
-            message.data = list(map(lambda x: int(x, 16), data))
-            traces.append((float(time), message))
-        return traces
+        count = 0
+        with open(file, "r") as f:
+            for content in f:
+                if len(content.split(" ")) < 28:
+                    continue
+                time = _time_pattern.search(content).group(0)
+                msg_id = _id_pattern.search(content).group(0).strip()
+                data = _data_pattern.search(content).group(0).split()
+                count += 1
+                yield float(time), int(msg_id, 16), [int(x, 16) for x in data]
+        logger.debug(f"trace size = {count}")
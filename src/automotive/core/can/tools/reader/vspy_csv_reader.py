@@ -6,53 +6,41 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:45
 # --------------------------------------------------------
-from typing import List, Tuple
+from typing import Iterator
 
-from automotive.core.can.message import Message
+from automotive.core.can.common.typehints import TraceFrame
 from .trace_reader import TraceReader
 from automotive.logger.logger import logger
 
 
 class VspyCsvReader(TraceReader):
 
-    def read(self, file: str) -> List[Tuple[float, Message]]:
-        contents = self.__filter_content(file)
-        logger.debug(f"trace size = {len(contents)}")
-        return self.__convert(contents)
-
-    @staticmethod
-    def __filter_content(file: str):
-        with open(file, "r") as f:
-            lines = f.readlines()
-            return list(filter(lambda x: len(x.split(",")) >= 23, lines))
-
-    @staticmethod
-    def __convert(contents: list) -> List[Tuple[float, Message]]:
+    def iter_frames(self, file: str) -> Iterator[TraceFrame]:
         """
-        解析content，并生成message对象
+        解析content，并生成帧
         2,0.281,0,67108866,F,T,PDC_1,HS CAN,BCM1,25C,F,F,00,00,00,00,00,00,00,00,,,SysSt_PDC,Off,
-        :param contents:
-        :return: List<Message>
+        :param file: trace文件
+        :return: (时间, msg_id, 数据)
         """
-        traces = []
-        for content in contents:
-            values = content.split(",")
-            try:
-                index = int(values[0])
-                time = float(values[1])
-                msg_id = int(values[9], 16)
-                logger.debug(f"{index}, {time}, {msg_id}")
-                message = Message()
-                message.msg_id = int(msg_id)
-                message.data = []
-                for i in range(8):
-                    message.data.append(int(values[i + 12], 16))
-                traces.append((time, message))
-            except ValueError:
-                logger.debug("skip handle, because index is no integer")
-        dates = []
-        # 隔一行取一个数据(去掉重复的部分)
-        for index, trace in enumerate(traces):
-            if index % 2 == 0:
-                dates.append(trace)
-        return dates
+        # 解析成功的帧的数量
+        parsed = 0
+        count = 0
+        with open(file, "r") as f:
+            for content in f:
+                values = content.split(",")
+                if len(values) < 23:
+                    continue
+                try:
+                    int(values[0])
+                    time = float(values[1])
+                    msg_id = int(values[9], 16)
+                    data = [int(value, 16) for value in values[12:20]]
+                except ValueError:
+                    logger.trace("skip handle, because index is no integer")
+                    continue
+                parsed += 1
+                # 隔一行取一个数据(去掉重复的部分)
+                if parsed % 2 == 1:
+                    count += 1
+                    yield time, msg_id, data
+        logger.debug(f"trace size = {count}")
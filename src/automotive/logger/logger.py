@@ -8,7 +8,7 @@
 # --------------------------------------------------------
 import os
 import sys
-from typing import List, Tuple, Any, Optional
+from typing import List, Tuple, Any, Optional, Dict, Union, TextIO, Callable
 
 import yaml
 
@@ -24,14 +24,54 @@ from loguru import logger as _logger
     2、 在运行代码目录及父目录到根目录的任意目录放置config.yml文件，其中yml中包含level和log_folder用于定义log等级及log存放文件路径
 
     3、 如果找不到配置文件，默认使用info级别输出log，并且不保存log内容到文件
+
+    4、 配置文件中enqueue为true的时候使用异步模式，log先放入队列，由后台线程写入控制台和文件，调用的线程不需要等待IO
+
+    5、 热点代码(如每一帧的收发)中构建log内容之前先用is_enabled判断该等级是否会输出，不输出的时候不进行格式化，
+        判断依据是loguru所有handler中最低的等级，直接用logger.add添加的handler同样有效
 """
 
 config_file_name = "config.yml"
 current_path = os.getcwd()
 log_level_type = "trace", "debug", "info", "warning", "error"
+# set_logger添加的handler，重新设置的时候先移除
+_handler_ids = []  # type: List[int]
+# 每个log等级对应的数值
+_level_numbers = dict((level, _logger.level(level.upper()).no) for level in log_level_type)  # type: Dict[str, int]
+# loguru内部记录了所有handler的最低等级，add/remove的时候自动更新，低版本没有的时候认为都会输出
+_core = getattr(_logger, "_core", None)
+
+
+def is_enabled(level: str) -> bool:
+    """
+    判断某个log等级是否会输出，用于热点代码中延迟构建log内容，如
+
+        if is_enabled("trace"):
+            logger.trace(f"data is {list(map(hex, data))}")
 
+    :param level: log等级(小写)
+
+    :return: 是否会输出
+    """
+    min_level = getattr(_core, "min_level", None)
+    if min_level is None or level not in _level_numbers:
+        return True
+    return _level_numbers[level] >= min_level
 
-def set_logger(level: str = "debug", folder: Optional[str] = None):
+
+def set_logger(level: str = "debug", folder: Optional[str] = None, enqueue: bool = False,
+               sink: Union[TextIO, Callable[[str], Any]] = sys.stdout):
+    """
+    设置logger，重复调用的时候替换之前设置的输出
+
+    :param level: log等级
+
+    :param folder: log文件存放的文件夹，为空的时候不保存到文件
+
+    :param enqueue: 是否异步输出，True的时候log放入队列由后台线程写入，调用的线程不会被IO阻塞
+
+    :param sink: 控制台输出的目标，默认为标准输出
+    """
     # LOG的格式
     formats = "<g>[{time:YYYY-MM-DD HH:mm:ss.SSS}]</g>" \
               "<level>[{level: ^9}]</level>|" \
@@ -49,8 +89,10 @@ def set_logger(level: str = "debug", folder: Optional[str] = None):
         except ValueError:
             _logger.trace("There is no existing handler with id")
             flag = False
+    while _handler_ids:
+        _logger.remove(_handler_ids.pop())
     # 控制台输出
-    _logger.add(sys.stdout, level=level.upper(), format=formats)
+    _handler_ids.append(_logger.add(sink, level=level.upper(), format=formats, enqueue=enqueue))
 
     if folder:
         file_path = folder
@@ -59,7 +101,8 @@ def set_logger(level: str = "debug", folder: Optional[str] = None):
             file_path = os.getcwd() + "\\logs"
             if not os.path.exists(file_path):
                 os.makedirs(file_path)
-        _logger.add(os.path.join(file_path, "log_{time}.log"), level=level.upper(), format=formats, rotation=rotation)
+        _handler_ids.append(_logger.add(os.path.join(file_path, "log_{time}.log"), level=level.upper(), format=formats,
+                                        rotation=rotation, enqueue=enqueue))
 
 
 def get_files(folder: str) -> List[str]:
@@ -75,13 +118,13 @@ def get_files(folder: str) -> List[str]:
     return files
 
 
-def get_config(config_file: str) -> Tuple[str, str]:
+def get_config(config_file: str) -> Tuple[str, str, bool]:
     """
     读取配置文件中的相关配置
 
     :param config_file:配置文件
 
-    :return: level, log_folder
+    :return: level, log_folder, enqueue
     """
     with open(config_file, "r", encoding="UTF-8") as fp:
         content = yaml.full_load(fp)
@@ -97,7 +140,8 @@ def get_config(config_file: str) -> Tuple[str, str]:
                 log_folder = None
         except KeyError:
             log_folder = None
-        return level, log_folder
+        enqueue = content.get("enqueue", False) is True
+        return level, log_folder, enqueue
 
 
 def find_config_file(folder: str, config_yml_file: str) -> Tuple[str, Any]:
@@ -112,7 +156,7 @@ def find_config_file(folder: str, config_yml_file: str) -> Tuple[str, Any]:
 
     :param config_yml_file: 配置文件名字
 
-    :return:level, log_folder
+    :return:level, log_folder, enqueue
     """
     flag = True
     while flag:
@@ -137,13 +181,13 @@ def find_config_file(folder: str, config_yml_file: str) -> Tuple[str, Any]:
                 else:
                     # _logger.info(f"{folder}的父级目录是{parent_path}")
                     folder = parent_path
-    return "info", None
+    return "info", None, False
 
 
 # 从文件中读取log等级，然后设置存放文件位置
-logger_level, logger_folder = find_config_file(current_path, config_file_name)
+logger_level, logger_folder, logger_enqueue = find_config_file(current_path, config_file_name)
 if logger_level.lower() not in log_level_type:
     logger_level = "info"
-set_logger(logger_level, logger_folder)
+set_logger(logger_level, logger_folder, logger_enqueue)
 # 返回logger对象
 logger = _logger
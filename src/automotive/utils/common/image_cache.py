@@ -0,0 +1,129 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        image_cache.py
+# @Author:      lizhe
+# @Created:     2022/3/29 - 20:15
+# --------------------------------------------------------
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+
+from automotive.logger.logger import logger, is_enabled
+
+"""
+图片解码缓存
+
+同一个图片文件在多次对比中只解码一次，按照(文件路径, 读取方式)缓存解码后的矩阵，每次获取的时候检查文件的修改时间和大小，
+
+文件被修改后重新解码。缓存的总字节数超过上限的时候按照最近最少使用(LRU)的顺序淘汰。
+
+缓存中的矩阵是只读的，区域截取直接返回视图(不拷贝)，需要修改矩阵的地方必须先拷贝。
+"""
+
+
+class ImageCache(object):
+    """
+    解码后图片矩阵的LRU缓存，线程安全
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        """
+        :param max_bytes: 缓存的最大字节数，为0表示不缓存
+        """
+        self.__max_bytes = max_bytes
+        self.__bytes = 0
+        # (路径, 读取方式) -> (修改时间, 文件大小, 矩阵)
+        self.__images = OrderedDict()  # type: OrderedDict[Tuple[str, int], Tuple[int, int, np.ndarray]]
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self.__max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value: int):
+        with self.__lock:
+            self.__max_bytes = value
+            self.__evict()
+
+    @property
+    def current_bytes(self) -> int:
+        return self.__bytes
+
+    def __len__(self) -> int:
+        return len(self.__images)
+
+    def __evict(self):
+        """
+        淘汰最久没有使用的图片，直到总字节数不超过上限
+        """
+        while self.__images and self.__bytes > self.__max_bytes:
+            _, (_, _, matrix) = self.__images.popitem(last=False)
+            self.__bytes -= matrix.nbytes
+
+    def read(self, file: str, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+        """
+        读取图片，文件没有修改的时候直接返回缓存中的矩阵
+
+        :param file: 图片文件
+
+        :param flags: cv2.imread的读取方式
+
+        :return: 只读的图片矩阵，文件不存在或者无法解码的时候返回None(和cv2.imread相同)
+        """
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        key = os.path.abspath(file), flags
+        with self.__lock:
+            item = self.__images.get(key)
+            if item and item[0] == stat.st_mtime_ns and item[1] == stat.st_size:
+                self.__images.move_to_end(key)
+                self.hits += 1
+                return item[2]
+        # 解码不加锁，多个线程可以同时解码不同的图片
+        matrix = cv2.imread(file, flags)
+        if matrix is None:
+            return None
+        matrix.flags.writeable = False
+        with self.__lock:
+            self.misses += 1
+            old = self.__images.pop(key, None)
+            if old:
+                self.__bytes -= old[2].nbytes
+            if matrix.nbytes <= self.__max_bytes:
+                self.__images[key] = stat.st_mtime_ns, stat.st_size, matrix
+                self.__bytes += matrix.nbytes
+                self.__evict()
+        if is_enabled("trace"):
+            logger.trace(f"decode image [{file}] with flags[{flags}]")
+        return matrix
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self.__lock:
+            self.__images.clear()
+            self.__bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> Dict[str, int]:
+        """
+        缓存的统计信息
+
+        :return: {"hits": 命中次数, "misses": 解码次数, "count": 缓存的图片数量, "bytes": 缓存的字节数, "max_bytes": 最大字节数}
+        """
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "count": len(self.__images), "bytes": self.__bytes,
+                    "max_bytes": self.__max_bytes}
@@ -0,0 +1,301 @@
+# -*- coding:utf-8 -*-
+# --------------------------------------------------------
+# Copyright (C), 2016-2022, lizhe, All rights reserved
+# --------------------------------------------------------
+# @Name:        image_hash.py
+# @Author:      lizhe
+# @Created:     2022/3/30 - 21:40
+# --------------------------------------------------------
+import os
+from threading import Lock
+from typing import List, Tuple, Optional, Sequence
+
+import cv2
+import numpy as np
+import scipy.fftpack
+
+from automotive.logger.logger import logger
+
+"""
+感知哈希(平均哈希、感知哈希、差异值哈希)
+
+哈希值按位打包成uint64数组(hash_size为8的时候每种哈希一个uint64，更大的hash_size使用多个uint64)，
+
+汉明距通过异或加位计数(popcount)计算，可以一次计算一张图片和成千上万张图片之间的汉明距。
+
+HashIndex把模板文件夹中所有图片的哈希值保存到文件中，文件没有修改的时候不需要重新计算。
+"""
+
+# 三种哈希的顺序，image_hashes以及hamming_distance的结果都按照这个顺序
+HASH_TYPES = "average", "perceptual", "difference"
+# 每个字节中1的个数
+_popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """
+    转换成灰度图片
+
+    :param image: 图片矩阵(灰度、BGR或者BGRA)
+
+    :return: 灰度图片矩阵
+    """
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def average_hash(gray: np.ndarray, hash_size: int = 8) -> np.ndarray:
+    """
+    平均哈希，缩小后每个像素是否大于平均值
+
+    :return: (hash_size, hash_size)的bool矩阵
+    """
+    pixels = cv2.resize(gray, (hash_size, hash_size), interpolation=cv2.INTER_CUBIC)
+    return pixels > np.mean(pixels)
+
+
+def perceptual_hash(gray: np.ndarray, hash_size: int = 8, highfreq_factor: int = 4) -> np.ndarray:
+    """
+    感知哈希，DCT变换后低频部分是否大于中位数
+
+    :return: (hash_size, hash_size)的bool矩阵
+    """
+    image_size = hash_size * highfreq_factor
+    pixels = cv2.resize(gray, (image_size, image_size), interpolation=cv2.INTER_CUBIC).astype(np.float64)
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+    low_frequency = dct[:hash_size, :hash_size]
+    return low_frequency > np.median(low_frequency)
+
+
+def difference_hash(gray: np.ndarray, hash_size: int = 8) -> np.ndarray:
+    """
+    差异值哈希，缩小到(hash_size + 1) * hash_size后每个像素是否大于左边的像素
+
+    :return: (hash_size, hash_size)的bool矩阵
+    """
+    pixels = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_CUBIC)
+    return pixels[:, 1:] > pixels[:, :-1]
+
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+    """
+    把bool矩阵按位打包成uint64数组，不足64位的部分补0
+
+    :param bits: bool矩阵
+
+    :return: uint64数组
+    """
+    packed = np.packbits(bits.ravel())
+    padding = -len(packed) % 8
+    if padding:
+        packed = np.concatenate([packed, np.zeros(padding, dtype=np.uint8)])
+    return packed.view("<u8").astype(np.uint64)
+
+
+def image_hashes(image: np.ndarray, hash_size: int = 8) -> np.ndarray:
+    """
+    计算图片的三种哈希值
+
+    :param image: 图片矩阵
+
+    :param hash_size: 哈希的边长，哈希的位数为hash_size * hash_size
+
+    :return: (3, words)的uint64矩阵，顺序见HASH_TYPES
+    """
+    gray = to_gray(image)
+    return np.stack([pack_bits(average_hash(gray, hash_size)),
+                     pack_bits(perceptual_hash(gray, hash_size)),
+                     pack_bits(difference_hash(gray, hash_size))])
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """
+    计算最后一维所有uint64中1的个数
+
+    :param words: uint64矩阵
+
+    :return: 去掉最后一维的矩阵
+    """
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return _popcount_table[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def hamming_distance(hash1: np.ndarray, hash2: np.ndarray) -> np.ndarray:
+    """
+    计算汉明距(不同的位数)，支持广播，如(N, 3, words)和(3, words)计算得到(N, 3)
+
+    :param hash1: 打包后的哈希值
+
+    :param hash2: 打包后的哈希值
+
+    :return: 汉明距
+    """
+    return popcount(np.bitwise_xor(hash1, hash2))
+
+
+def to_hex(words: np.ndarray) -> str:
+    """
+    把打包后的哈希值转换成十六进制字符串(和imagehash的格式一致)
+    """
+    return np.ascontiguousarray(words, dtype="<u8").view(np.uint8).tobytes().hex()
+
+
+class HashIndex(object):
+    """
+    模板文件夹的哈希索引
+
+    计算文件夹(包括子文件夹)中所有图片的哈希值并保存到索引文件中，再次加载的时候只重新计算修改过的图片，
+
+    查找的时候一次计算截图和所有模板图片的汉明距。
+    """
+
+    def __init__(self, folder: str, hash_size: int = 8, index_file: Optional[str] = None,
+                 extensions: Sequence[str] = (".jpg", ".jpeg", ".png", ".bmp")):
+        """
+        :param folder: 模板文件夹
+
+        :param hash_size: 哈希的边长
+
+        :param index_file: 索引文件，默认为模板文件夹中的.image_hash_{hash_size}.npz
+
+        :param extensions: 图片文件的后缀
+        """
+        self.folder = os.path.abspath(folder)
+        self.hash_size = hash_size
+        self.index_file = index_file or os.path.join(self.folder, f".image_hash_{hash_size}.npz")
+        self.__extensions = tuple(extension.lower() for extension in extensions)
+        self.__words = (hash_size * hash_size + 63) // 64
+        self.files = []  # type: List[str]
+        # (修改时间, 文件大小)
+        self.__stats = np.zeros((0, 2), dtype=np.int64)
+        self.hashes = np.zeros((0, len(HASH_TYPES), self.__words), dtype=np.uint64)
+        self.__lock = Lock()
+        self.__load()
+        self.update()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __load(self):
+        """
+        加载索引文件，文件不存在或者格式不对的时候忽略
+        """
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with np.load(self.index_file) as data:
+                if int(data["hash_size"]) != self.hash_size:
+                    return
+                self.files = [str(file) for file in data["files"]]
+                self.__stats = data["stats"]
+                self.hashes = data["hashes"]
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"load image hash index [{self.index_file}] failed: {e}")
+
+    def __save(self):
+        """
+        保存索引文件，先写入临时文件再替换，避免中断后索引文件损坏，写入失败(如模板文件夹只读)的时候只使用内存中的索引
+        """
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                np.savez(f, hash_size=self.hash_size, files=np.array(self.files, dtype=str), stats=self.__stats,
+                         hashes=self.hashes)
+            os.replace(temp_file, self.index_file)
+        except OSError as e:
+            logger.debug(f"save image hash index [{self.index_file}] failed, error is {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def __scan(self) -> List[Tuple[str, int, int]]:
+        """
+        查找文件夹中所有的图片
+
+        :return: [(相对路径, 修改时间, 文件大小)]
+        """
+        images = []
+        for root, _, files in os.walk(self.folder):
+            for file in files:
+                if file.lower().endswith(self.__extensions):
+                    path = os.path.join(root, file)
+                    stat = os.stat(path)
+                    images.append((os.path.relpath(path, self.folder), stat.st_mtime_ns, stat.st_size))
+        images.sort()
+        return images
+
+    def update(self) -> int:
+        """
+        更新索引，只重新计算新增或者修改过的图片，有变化的时候保存索引文件
+
+        :return: 重新计算的图片数量
+        """
+        with self.__lock:
+            old = dict((file, index) for index, file in enumerate(self.files))
+            files, stats, hashes = [], [], []
+            count = 0
+            for file, mtime, size in self.__scan():
+                index = old.get(file)
+                if index is not None and self.__stats[index][0] == mtime and self.__stats[index][1] == size:
+                    file_hash = self.hashes[index]
+                else:
+                    image = cv2.imread(os.path.join(self.folder, file), cv2.IMREAD_UNCHANGED)
+                    if image is None:
+                        logger.warning(f"image [{file}] in [{self.folder}] can not be decoded")
+                        continue
+                    file_hash = image_hashes(image, self.hash_size)
+                    count += 1
+                files.append(file)
+                stats.append((mtime, size))
+                hashes.append(file_hash)
+            changed = count > 0 or files != self.files
+            self.files = files
+            self.__stats = np.array(stats, dtype=np.int64).reshape(-1, 2)
+            self.hashes = np.array(hashes, dtype=np.uint64).reshape(-1, len(HASH_TYPES), self.__words)
+            if changed:
+                logger.debug(f"update image hash index [{self.index_file}], {count} images hashed")
+                self.__save()
+            return count
+
+    def distances(self, image: np.ndarray) -> np.ndarray:
+        """
+        计算图片和所有模板图片的汉明距
+
+        :param image: 图片矩阵
+
+        :return: (N, 3)的汉明距矩阵，行的顺序和files相同，列的顺序见HASH_TYPES
+        """
+        return hamming_distance(self.hashes, image_hashes(image, self.hash_size))
+
+    def search(self, image: np.ndarray, top: int = 5,
+               threshold: Optional[int] = None) -> List[Tuple[str, Tuple[int, int, int]]]:
+        """
+        查找最相似的模板图片，按照三种汉明距之和从小到大排序
+
+        :param image: 图片矩阵
+
+        :param top: 返回的数量
+
+        :param threshold: 三种汉明距之和的最大值，为空表示不限制
+
+        :return: [(模板图片的绝对路径, (平均哈希汉明距, 感知哈希汉明距, 差异值哈希汉明距))]
+        """
+        if len(self.files) == 0:
+            return []
+        distances = self.distances(image)
+        total = distances.sum(axis=1)
+        if top < len(total):
+            candidates = np.argpartition(total, top)[:top]
+            candidates = candidates[np.argsort(total[candidates], kind="stable")]
+        else:
+            candidates = np.argsort(total, kind="stable")
+        result = []
+        for index in candidates:
+            if threshold is not None and total[index] > threshold:
+                break
+            result.append((os.path.join(self.folder, self.files[index]), tuple(int(x) for x in distances[index])))
+        return result
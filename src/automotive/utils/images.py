@@ -6,21 +6,26 @@
 # @Author:      lizhe
 # @Created:     2021/5/1 - 23:33
 # --------------------------------------------------------
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from time import perf_counter
+
 import cv2
 import numpy as np
-import imagehash
 from PIL import Image
-from airtest.aircv import NoModuleError
-from typing import List, Optional, Union
+from airtest.aircv.error import BaseError
+from typing import List, Optional, Union, Tuple, Dict, Sequence
 
 # 2960*1440设备 内存耗费： kaze (2GB) >> sift > akaze >> surf > brisk > brief > orb > tpl
 # 单纯效果,推荐程度： tpl > surf ≈ sift > kaze > brisk > akaze> brief > orb
 # 有限内存,推荐程度： tpl > surf > sift > brisk > akaze > brief > orb >kaze
 from airtest.aircv.keypoint_matching import KAZEMatching, BRISKMatching, AKAZEMatching, ORBMatching
-from airtest.aircv.keypoint_matching_contrib import SIFTMatching, SURFMatching, BRIEFMatching, \
-    NoMatchPointError
+from airtest.aircv.keypoint_matching_contrib import SIFTMatching, SURFMatching, BRIEFMatching
 from airtest.aircv.template_matching import TemplateMatching
 from .common.enums import FindTypeEnum, HammingCompareTypeEnum, ImageCompareTypeEnum
+from .common.image_cache import ImageCache
+from .common.image_hash import HashIndex, image_hashes, hamming_distance, to_gray
 from ..common.typehints import NumpyArray, Position, ImageFile, CompareResult, RGB, AirTestResult
 from ..logger.logger import logger
 
@@ -28,25 +33,44 @@ from ..logger.logger import logger
 class Images(object):
     """
     图片相关的工具类，主要有基于像素点的图片对比，mask部分图片对比，汉明距图片对比等功能
+
+    图片文件解码后缓存在所有Images对象共用的缓存中(见ImageCache)，同一个文件多次对比只解码一次，
+
+    从文件读取的矩阵是只读的，内部对比直接使用缓存中的视图，cut_image_array返回的是可以修改的数组
     """
+    # 解码后的图片缓存，默认最多512MB
+    __cache = ImageCache()
+    # 模板文件夹的哈希索引，{(文件夹, hash_size): HashIndex}
+    __hash_indexes = dict()  # type: Dict[Tuple[str, int], HashIndex]
+    __hash_indexes_lock = Lock()
+    # find_best_result_in_templates第二步查找共用的线程池，已经开始的查找(如KAZE、SIFT)无法取消，
+    # 共用一个有上限的线程池，多次调用的时候后台查找的数量不会无限叠加(线程在使用时才创建)
+    __find_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="images_find")
 
-    # 计算汉明距
     @staticmethod
-    def __hamming_distance(hash1: str, hash2: str) -> int:
+    def set_cache_size(max_bytes: int):
         """
-        比较两个哈希值之间的差异，即汉明距
+        设置图片缓存的最大字节数
 
-        :param hash1: 哈希值1
+        :param max_bytes: 最大字节数，为0表示不缓存
+        """
+        Images.__cache.max_bytes = max_bytes
+
+    @staticmethod
+    def clear_cache():
+        """
+        清空图片缓存
+        """
+        Images.__cache.clear()
 
-        :param hash2: 哈希值2
+    @staticmethod
+    def cache_info() -> dict:
+        """
+        图片缓存的统计信息
 
-        :return: 差异值
+        :return: {"hits": 命中次数, "misses": 解码次数, "count": 缓存的图片数量, "bytes": 缓存的字节数, "max_bytes": 最大字节数}
         """
-        num = 0
-        for i in range(len(hash1)):
-            if hash1[i] != hash2[i]:
-                num += 1
-        return num
+        return Images.__cache.info()
 
     @staticmethod
     def __binarization(img: NumpyArray, threshold: int) -> NumpyArray:
@@ -77,11 +101,11 @@ class Images(object):
             return image
         else:
             if gray:
-                return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+                return Images.__cache.read(image, cv2.IMREAD_GRAYSCALE)
             elif image.endswith(".png"):
-                return cv2.imread(image, cv2.IMREAD_UNCHANGED)
+                return Images.__cache.read(image, cv2.IMREAD_UNCHANGED)
             else:
-                return cv2.imread(image)
+                return Images.__cache.read(image)
 
     @staticmethod
     def __check_area(start_x: int, start_y: int, end_x: int, end_y: int, width: int, height: int):
@@ -176,9 +200,12 @@ class Images(object):
 
         :param gray: 是否灰度
 
-        :return: position未设置的时候直接返回原始图片的matrix，否则返回position的matrix
+        :return: position未设置的时候直接返回原始图片的matrix，否则返回position的matrix(视图，不拷贝)
         """
-        matrix_image = cv2.imread(image, cv2.IMREAD_GRAYSCALE) if gray else cv2.imread(image)
+        if isinstance(image, NumpyArray):
+            matrix_image = image
+        else:
+            matrix_image = self.__cache.read(image, cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR)
         if matrix_image is None:
             raise RuntimeError(f"no image [{image}] found")
         if position:
@@ -210,32 +237,90 @@ class Images(object):
 
             total_pixel: 两张图片每一张的总像素点的个数
         """
-        if threshold:
-            self.__check_threshold(threshold)
         matrix_image1 = self.__get_image_nd_array(image1)
         matrix_image2 = self.__get_image_nd_array(image2)
-        if gray and threshold:
-            matrix_image1 = self.__binarization(matrix_image1, threshold)
-            matrix_image2 = self.__binarization(matrix_image2, threshold)
         self.__check_image_same_size(matrix_image1, matrix_image2)
-        total_pixel = matrix_image1.size
-        if gray:
-            temp = matrix_image2 - matrix_image1
-            different_count = np.count_nonzero(temp)
-            logger.debug(f"gray different_count = {different_count}")
-        else:
-            total_pixel = total_pixel // 3
-            b1, g1, r1 = cv2.split(matrix_image1)
-            b2, g2, r2 = cv2.split(matrix_image2)
-            temp_b = b2 - b1
-            temp_g = g2 - g1
-            temp_r = r2 - r1
-            temp = np.abs(temp_b) + np.abs(temp_g) + np.abs(temp_r)
-            different_count = np.count_nonzero(temp)
-            logger.debug(f"different_count = {different_count}")
+        height, width = matrix_image1.shape[:2]
+        (different_count, total_pixel), = self.__count_different(matrix_image1, matrix_image2,
+                                                                 [(0, 0, width, height)],
+                                                                 gray_threshold=threshold if gray else None)
         logger.debug(f"different_count[{different_count}] and total_pixel[{total_pixel}]")
         return different_count, total_pixel
 
+    def __count_different(self,
+                          matrix_image1: NumpyArray,
+                          matrix_image2: NumpyArray,
+                          positions: List[Position],
+                          tolerance: int = 0,
+                          mask: Optional[NumpyArray] = None,
+                          gray_threshold: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        一次计算多个区域中不同的像素点数量
+
+        只在所有区域的外接矩形中计算一次差值(cv2.absdiff，不会溢出)，任意一个通道的差值大于tolerance即表示该像素点不同，
+
+        再通过积分图得到每个区域中不同的像素点数量，不需要拷贝每个区域的图片
+
+        :param matrix_image1: 图片1矩阵
+
+        :param matrix_image2: 图片2矩阵(和图片1大小相同)
+
+        :param positions: 区域列表start_x, start_y, end_x, end_y
+
+        :param tolerance: 每个通道允许的差值[0, 255]，差值小于等于该值的时候认为相同
+
+        :param mask: 不对比的区域，和图片同样大小的矩阵，不为0的像素点不对比
+
+        :param gray_threshold: 二值化的阈值, [0, 255]，为空表示不进行二值化
+
+        :return: [(不同的像素点数量, 对比的像素点数量)]，顺序和positions相同
+        """
+        self.__check_threshold(tolerance)
+        if gray_threshold:
+            self.__check_threshold(gray_threshold)
+        height, width = matrix_image1.shape[:2]
+        for start_x, start_y, end_x, end_y in positions:
+            self.__check_cut_area(start_x, start_y, end_x, end_y, width, height)
+        if mask is not None and mask.shape[:2] != (height, width):
+            raise ValueError(f"mask size{mask.shape[:2]} is not same as image size{(height, width)}")
+        # 所有区域的外接矩形
+        left = min(position[0] for position in positions)
+        top = min(position[1] for position in positions)
+        right = max(position[2] for position in positions)
+        bottom = max(position[3] for position in positions)
+        area1 = matrix_image1[top:bottom, left:right]
+        area2 = matrix_image2[top:bottom, left:right]
+        if gray_threshold:
+            area1 = self.__binarization(area1, gray_threshold)
+            area2 = self.__binarization(area2, gray_threshold)
+        difference = cv2.absdiff(area1, area2)
+        if difference.ndim == 3:
+            # 每个像素点取所有通道中最大的差值
+            channels = cv2.split(difference)
+            difference = channels[0]
+            for channel in channels[1:]:
+                difference = cv2.max(difference, channel)
+        # 差值大于tolerance的像素点为1，其他为0
+        _, changed = cv2.threshold(difference, tolerance, 1, cv2.THRESH_BINARY)
+        valid_integral = None
+        if mask is not None:
+            valid = (mask[top:bottom, left:right] == 0).view(np.uint8)
+            changed = cv2.bitwise_and(changed, valid)
+            valid_integral = cv2.integral(valid)
+        changed_integral = cv2.integral(changed)
+        results = []
+        for start_x, start_y, end_x, end_y in positions:
+            x1, y1, x2, y2 = start_x - left, start_y - top, end_x - left, end_y - top
+            different_count = int(changed_integral[y2, x2] - changed_integral[y1, x2] - changed_integral[y2, x1] +
+                                  changed_integral[y1, x1])
+            if valid_integral is None:
+                total_pixel = (end_x - start_x) * (end_y - start_y)
+            else:
+                total_pixel = int(valid_integral[y2, x2] - valid_integral[y1, x2] - valid_integral[y2, x1] +
+                                  valid_integral[y1, x1])
+            results.append((different_count, total_pixel))
+        return results
+
     def __compare_by_matrix_exclude(self,
                                     image1: ImageFile,
                                     image2: ImageFile,
@@ -252,7 +337,7 @@ class Images(object):
 
         :param position: 不对比的区域start_x, start_y, end_x, end_y
 
-        :param rgb: 设置不比较区域的BGR颜色，默认为0， 0， 0
+        :param rgb: 不比较区域的BGR颜色(不比较的区域直接跳过，该参数不影响结果，保留用于兼容)
 
         :param gray: 是否读取灰度图像
 
@@ -263,9 +348,17 @@ class Images(object):
 
             total_pixel: 两张图片每一张的总像素点的个数
         """
-        image1 = self.set_area_to_white(image=image1, position=position, rgb=rgb, gray=gray)
-        image2 = self.set_area_to_white(image=image2, position=position, rgb=rgb, gray=gray)
-        return self.__compare_by_matrix(image1, image2, gray, threshold)
+        matrix_image1 = self.__get_image_matrix(image1, gray=gray)
+        matrix_image2 = self.__get_image_matrix(image2, gray=gray)
+        self.__check_image_same_size(matrix_image1, matrix_image2)
+        height, width = matrix_image1.shape[:2]
+        # 不对比的区域当作相同，总像素点仍然是整张图片(和设置成相同颜色后对比的结果一致)
+        start_x, start_y, end_x, end_y = position
+        mask = np.zeros((height, width), dtype=np.uint8)
+        mask[start_y:end_y, start_x:end_x] = 1
+        (different_count, _), = self.__count_different(matrix_image1, matrix_image2, [(0, 0, width, height)],
+                                                       mask=mask, gray_threshold=threshold if gray else None)
+        return different_count, height * width
 
     def __compare_by_matrix_in_same_area(self,
                                          image1: ImageFile,
@@ -351,30 +444,6 @@ class Images(object):
             # 识别特征点少,只适合强特征图像的匹配
             return BRIEFMatching(small_image, big_image, threshold=threshold, rgb=rgb).find_best_result()
 
-    @staticmethod
-    def __average_hash(img: NumpyArray, hash_size: int = 8):
-        pixels = cv2.resize(img, (hash_size, hash_size), interpolation=cv2.INTER_CUBIC)
-        avg = np.mean(pixels)
-        diff = pixels > avg
-        return imagehash.ImageHash(diff)
-
-    @staticmethod
-    def __phash(img: NumpyArray, hash_size: int = 8, highfreq_factor: int = 4):
-        import scipy.fftpack
-        img_size = hash_size * highfreq_factor
-        pixels = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_CUBIC)
-        dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
-        dctlowfreq = dct[:hash_size, :hash_size]
-        med = np.median(dctlowfreq)
-        diff = dctlowfreq > med
-        return imagehash.ImageHash(diff)
-
-    @staticmethod
-    def __dhash(img: NumpyArray, hash_size: int = 8):
-        pixels = cv2.resize(img, (hash_size, hash_size), interpolation=cv2.INTER_CUBIC)
-        diff = pixels[:, 1:] > pixels[:, :-1]
-        return imagehash.ImageHash(diff)
-
     def __get_position(self, position: Position, is_convert: bool) -> Position:
         if is_convert:
             x, y, w, h = position
@@ -396,7 +465,8 @@ class Images(object):
 
         :return: 白色化指定区域后的图片矩阵
         """
-        image = self.__get_image_matrix(image, gray=gray)
+        # 缓存中的矩阵是只读的，修改前需要拷贝
+        image = self.__get_image_matrix(image, gray=gray).copy()
         start_x, start_y, end_x, end_y = position
         blue, green, red = rgb
         if gray:
@@ -467,10 +537,11 @@ class Images(object):
 
         :param position:  剪贴区域，位置start_x, start_y, end_x, end_y
 
-        :return:NumpyArray
+        :return:NumpyArray，可以直接修改，缓存中的只读数据会先拷贝一份
         """
         position = self.__get_position(position, is_convert)
-        return self.__get_image_matrix(image, position)
+        matrix = self.__get_image_matrix(image, position)
+        return matrix if matrix.flags.writeable else matrix.copy()
 
     def cut_image(self, image: ImageFile, target_image: str, position: Position, is_convert: bool = False):
         """
@@ -498,7 +569,9 @@ class Images(object):
 
         :param compare_type: 比较类型， 一种/两种/三种比较算法都小于阈值  平均值小于阈值
 
-        :param threshold: 阈值, 当阈值不为空的时候，会返回比较的结果
+        :param threshold: 阈值, 当阈值不为空的时候，会返回比较的结果，汉明距按照不同的位数计算(灰度图的64位哈希，每种哈希[0, 64])，
+
+            默认值10。注意: 之前的版本按照彩色图片哈希字符串中不同的十六进制字符数量计算([0, 48])，阈值的含义不同
 
         :param img1: 图片1
 
@@ -509,17 +582,8 @@ class Images(object):
         if isinstance(compare_type, str):
             compare_type = HammingCompareTypeEnum.from_value(compare_type)
         logger.debug(f"img1 = {img1} and img2 = {img2}")
-        image1 = self.__get_image_nd_array(img1)
-        image2 = self.__get_image_nd_array(img2)
-        a_hash1 = str(self.__average_hash(image1))
-        a_hash2 = str(self.__average_hash(image2))
-        p_hash1 = str(self.__phash(image1))
-        p_hash2 = str(self.__phash(image2))
-        d_hash1 = str(self.__dhash(image1))
-        d_hash2 = str(self.__dhash(image2))
-        a_distance = self.__hamming_distance(a_hash1, a_hash2)
-        p_distance = self.__hamming_distance(p_hash1, p_hash2)
-        d_distance = self.__hamming_distance(d_hash1, d_hash2)
+        a_distance, p_distance, d_distance = map(int, hamming_distance(self.get_image_hash(img1),
+                                                                       self.get_image_hash(img2)))
         logger.info(f"a_distance = {a_distance} and p_distance = {p_distance} and d_distance = {d_distance}")
         if compare_type == HammingCompareTypeEnum.DEFAULT:
             return a_distance < threshold
@@ -537,6 +601,55 @@ class Images(object):
         else:
             raise RuntimeError("compare type is wrong")
 
+    def get_image_hash(self, image: ImageFile, hash_size: int = 8) -> NumpyArray:
+        """
+        计算图片(灰度)的平均哈希、感知哈希、差异值哈希，哈希值按位打包成uint64
+
+        :param image: 图片/图片矩阵
+
+        :param hash_size: 哈希的边长，哈希的位数为hash_size * hash_size
+
+        :return: (3, hash_size * hash_size / 64)的uint64矩阵
+        """
+        matrix = self.__get_image_nd_array(image)
+        if matrix is None:
+            raise RuntimeError(f"no image [{image}] found")
+        return image_hashes(matrix, hash_size)
+
+    def find_similar_images(self,
+                            image: ImageFile,
+                            template_folder: str,
+                            top: int = 5,
+                            threshold: Optional[int] = None,
+                            hash_size: int = 8) -> List[Tuple[str, Tuple[int, int, int]]]:
+        """
+        在模板文件夹中查找和图片最相似的模板(按照三种汉明距之和从小到大排序)
+
+        模板文件夹的哈希值保存在文件夹中的索引文件里，只有新增或者修改过的模板才会重新计算
+
+        :param image: 图片/图片矩阵
+
+        :param template_folder: 模板文件夹
+
+        :param top: 返回的数量
+
+        :param threshold: 三种汉明距之和的最大值，为空表示不限制，汉明距按照不同的位数计算(每种哈希[0, hash_size * hash_size])
+
+        :param hash_size: 哈希的边长
+
+        :return: [(模板图片, (平均哈希汉明距, 感知哈希汉明距, 差异值哈希汉明距))]
+        """
+        key = os.path.abspath(template_folder), hash_size
+        with self.__hash_indexes_lock:
+            index = self.__hash_indexes.get(key)
+            if index is None:
+                index = HashIndex(template_folder, hash_size)
+                self.__hash_indexes[key] = index
+            else:
+                index.update()
+        image = self.__get_image_nd_array(image)
+        return index.search(image, top, threshold)
+
     def compare_by_matrix(self,
                           image1: ImageFile,
                           image2: ImageFile,
@@ -577,7 +690,7 @@ class Images(object):
 
         :param position: 不对比的区域start_x, start_y, end_x, end_y
 
-        :param rgb: 设置不比较区域的BGR颜色，默认为0， 0， 0
+        :param rgb: 不比较区域的BGR颜色(不比较的区域直接跳过，该参数不影响结果，保留用于兼容)
 
         :param gray: 是否读取灰度图像
 
@@ -630,6 +743,60 @@ class Images(object):
         diff, total = self.__compare_by_matrix_in_same_area(image1, image2, position1, position2, gray, threshold)
         return self.__calc_compare_result(diff, total)
 
+    def compare_by_matrix_in_areas(self,
+                                   image1: ImageFile,
+                                   image2: ImageFile,
+                                   positions: List[Position],
+                                   tolerance: int = 0,
+                                   mask: Optional[Union[NumpyArray, List[Position]]] = None,
+                                   gray: bool = False,
+                                   threshold: Optional[int] = None,
+                                   is_convert: bool = False) -> List[CompareResult]:
+        """
+        一次比较image1和image2图片中的多个区域(两张图片大小相同，区域位置相同)
+
+        只计算一次差值，不拷贝每个区域的图片
+
+        :param image1: 图片1/图片1矩阵
+
+        :param image2: 图片2/图片2矩阵
+
+        :param positions: 对比区域列表
+
+        :param tolerance: 每个通道允许的差值[0, 255]，差值小于等于该值的时候认为相同
+
+        :param mask: 不对比的部分，可以是和图片同样大小的矩阵(不为0的像素点不对比)，也可以是区域列表
+
+        :param gray: 是否读取灰度图像
+
+        :param threshold: 是否将灰度进行二值化处理后再对比 二值化的阈值, [0, 255]
+
+        :param is_convert: 是否需要转换成为start_x, start_y, end_x, end_y模式，可以直接传入x, y, w, h
+
+        :return: 每个区域的(相同像素点的百分比, 不同像素点的百分比)，不对比的像素点不计算在内
+        """
+        matrix_image1 = self.__get_image_matrix(image1, gray=gray)
+        matrix_image2 = self.__get_image_matrix(image2, gray=gray)
+        self.__check_image_same_size(matrix_image1, matrix_image2)
+        positions = [self.__get_position(position, is_convert) for position in positions]
+        if len(positions) == 0:
+            return []
+        if mask is not None and not isinstance(mask, NumpyArray):
+            areas = mask
+            mask = np.zeros(matrix_image1.shape[:2], dtype=np.uint8)
+            for area in areas:
+                start_x, start_y, end_x, end_y = self.__get_position(area, is_convert)
+                mask[start_y:end_y, start_x:end_x] = 1
+        results = self.__count_different(matrix_image1, matrix_image2, positions, tolerance, mask,
+                                         threshold if gray else None)
+        compare_results = []
+        for position, (different_count, total_pixel) in zip(positions, results):
+            if total_pixel == 0:
+                raise ValueError(f"position[{position}] is fully excluded by mask")
+            compare_results.append(self.__calc_compare_result(different_count, total_pixel))
+        logger.debug(f"compare results = {compare_results}")
+        return compare_results
+
     def rectangle_image_matrix(self,
                                image: Image,
                                positions: List[Position],
@@ -649,6 +816,9 @@ class Images(object):
         :return: 添加方框后的matrix
         """
         image_array = self.__get_image_nd_array(image, False)
+        if not image_array.flags.writeable:
+            # 从文件读取的矩阵在缓存中，不能直接修改
+            image_array = image_array.copy()
         for position in positions:
             start_x, start_y, end_x, end_y = self.__get_position(position, is_convert)
             # 图片， 左上角， 右下角， 颜色， 线条粗细， 线条类型，点类型
@@ -727,13 +897,88 @@ class Images(object):
         big_image = self.__get_image_nd_array(big_image)
         return self.__find_by_template(small_image, big_image, threshold=threshold, rgb=rgb, find_type=find_type)
 
+    @staticmethod
+    def __offset_result(result: AirTestResult, offset_x: int, offset_y: int) -> AirTestResult:
+        """
+        把区域中的查找结果转换成原图中的坐标
+        """
+        if result and (offset_x or offset_y):
+            center_x, center_y = result["result"]
+            result["result"] = center_x + offset_x, center_y + offset_y
+            result["rectangle"] = tuple((x + offset_x, y + offset_y) for x, y in result["rectangle"])
+        return result
+
+    def __find_by_pyramid(self,
+                          small_image: NumpyArray,
+                          big_image: NumpyArray,
+                          threshold: float,
+                          rgb: bool,
+                          scale: float) -> AirTestResult:
+        """
+        先在缩小的灰度图中粗略查找位置，再在原图中该位置附近精确匹配
+
+        模板缩小后太小(小于8个像素)的时候直接在原图中匹配
+        """
+        small_height, small_width = small_image.shape[:2]
+        big_height, big_width = big_image.shape[:2]
+        if small_height > big_height or small_width > big_width:
+            return None
+        if scale >= 1 or min(small_height, small_width) * scale < 8:
+            return self.__find_by_template(small_image, big_image, threshold, rgb, FindTypeEnum.TEMPLATE)
+        coarse_small = cv2.resize(to_gray(small_image), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        coarse_big = cv2.resize(to_gray(big_image), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        matched = cv2.matchTemplate(coarse_big, coarse_small, cv2.TM_CCOEFF_NORMED)
+        _, _, _, (coarse_x, coarse_y) = cv2.minMaxLoc(matched)
+        # 缩小后的一个像素对应原图中1/scale个像素，在该范围外再留一些余量
+        margin = int(2 / scale) + 2
+        start_x = max(int(coarse_x / scale) - margin, 0)
+        start_y = max(int(coarse_y / scale) - margin, 0)
+        end_x = min(int(coarse_x / scale) + small_width + margin, big_width)
+        end_y = min(int(coarse_y / scale) + small_height + margin, big_height)
+        result = self.__find_by_template(small_image, big_image[start_y:end_y, start_x:end_x], threshold, rgb,
+                                         FindTypeEnum.TEMPLATE)
+        return self.__offset_result(result, start_x, start_y)
+
+    def __find_by_type(self,
+                       small_image: NumpyArray,
+                       big_image: NumpyArray,
+                       threshold: float,
+                       rgb: bool,
+                       find_type: FindTypeEnum) -> Tuple[AirTestResult, float]:
+        """
+        用一种方式查找，不支持或者找不到特征点的时候返回None
+
+        :return: 查找结果, 耗时(秒)
+        """
+        start = perf_counter()
+        try:
+            result = self.__find_by_template(small_image, big_image, threshold, rgb, find_type)
+        except (BaseError, cv2.error) as e:
+            logger.debug(f"skip {find_type.value}: {type(e).__name__}")
+            result = None
+        return result, perf_counter() - start
+
     def find_best_result_in_templates(self,
                                       small_image: ImageFile,
                                       big_image: ImageFile,
                                       threshold: float = 0.7,
-                                      rgb: bool = True) -> AirTestResult:
+                                      rgb: bool = True,
+                                      position: Optional[Position] = None,
+                                      is_convert: bool = False,
+                                      scale: float = 0.5,
+                                      find_types: Optional[Sequence[Union[FindTypeEnum, str]]] = None,
+                                      max_workers: Optional[int] = None,
+                                      timing: Optional[Dict[str, float]] = None) -> AirTestResult:
         """
-        查找小图是否在大图中匹配, 当小图在大图中无法找到，尝试所有FindType的所有比较方式
+        查找小图是否在大图中匹配, 由粗到细查找，找到相似度大于阈值的结果后立即返回
+
+        1、在position区域中(为空表示整张图片)先用缩小scale倍的灰度图粗略查找位置，再在原图中该位置附近精确匹配
+
+        2、相似度小于阈值的时候，在position区域中并行使用find_types中的方式(默认所有FindType)查找，
+
+        任何一种方式找到后立即返回，不再等待其他方式(还没有开始的查找会被取消，已经开始的查找会在后台完成)，
+
+        所有调用共用一个最多4个线程的线程池，后台的查找数量有上限
 
         :param small_image: 小图片
 
@@ -743,7 +988,19 @@ class Images(object):
 
         :param rgb: 默认True
 
-        :return: 返回了五个坐标点以及对比结果
+        :param position: 查找区域start_x, start_y, end_x, end_y，为空表示整张图片
+
+        :param is_convert: 是否需要转换成为start_x, start_y, end_x, end_y模式，可以直接传入x, y, w, h
+
+        :param scale: 粗略查找时的缩放比例，为1的时候不缩放
+
+        :param find_types: 第二步使用的查找方式，默认所有FindType
+
+        :param max_workers: 本次调用第二步同时进行的查找数量，默认为4(KAZE、SIFT比较耗内存，内存有限的时候可以减少)
+
+        :param timing: 传入字典的时候保存每一步的耗时(秒)，如{"pyramid": 0.01, "sift": 0.3, "total": 0.31}
+
+        :return: 返回了五个坐标点以及对比结果(坐标是大图中的坐标)
 
             {
 
@@ -765,24 +1022,62 @@ class Images(object):
 
             }
         """
+        timing = timing if timing is not None else dict()
+        start = perf_counter()
         small_image = self.__get_image_nd_array(small_image)
         big_image = self.__get_image_nd_array(big_image)
+        offset_x, offset_y = 0, 0
+        if position:
+            offset_x, offset_y, end_x, end_y = self.__get_position(position, is_convert)
+            self.__check_cut_area(offset_x, offset_y, end_x, end_y, big_image.shape[1], big_image.shape[0])
+            big_image = big_image[offset_y:end_y, offset_x:end_x]
+        # 第一步: 金字塔模板匹配
+        try:
+            result = self.__find_by_pyramid(small_image, big_image, threshold, rgb, scale)
+        except (BaseError, cv2.error) as e:
+            logger.debug(f"skip pyramid template: {type(e).__name__}")
+            result = None
+        timing["pyramid"] = perf_counter() - start
+        logger.debug(f"pyramid template result = {result}")
+        if result and result["confidence"] >= threshold:
+            timing["total"] = perf_counter() - start
+            return self.__offset_result(result, offset_x, offset_y)
+        # 第二步: 并行使用其他的查找方式
+        if find_types is None:
+            find_types = list(FindTypeEnum)
+        find_types = [FindTypeEnum.from_value(item) if isinstance(item, str) else item for item in find_types]
         compare_result = None
         confidence = 0
-        for key, value in FindTypeEnum.__dict__.items():
-            if not key.startswith("_"):
-                logger.debug(f"current type is {value.name}")
-                try:
-                    result = self.__find_by_template(small_image, big_image, threshold, rgb, find_type=value)
-                    if result:
-                        logger.debug(f"result = {result}")
-                        if result["confidence"] > confidence:
-                            compare_result = result
-                except NoMatchPointError:
-                    logger.debug(f"skip")
-                except NoModuleError:
-                    logger.debug(f"skip")
-        return compare_result
+        workers = max_workers or 4
+        waiting = list(find_types)
+        futures = dict()
+        pending = set()
+        try:
+            while True:
+                # 同时进行的查找不超过workers个，完成一个且没有找到的时候再提交下一个
+                while compare_result is None and waiting and len(pending) < workers:
+                    find_type = waiting.pop(0)
+                    future = self.__find_executor.submit(self.__find_by_type, small_image, big_image, threshold, rgb,
+                                                         find_type)
+                    futures[future] = find_type
+                    pending.add(future)
+                if not pending or compare_result is not None:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result, elapsed = future.result()
+                    timing[futures[future].value] = elapsed
+                    logger.debug(f"{futures[future].value} result = {result}")
+                    # 同时完成的时候取相似度最高的结果
+                    if result and result["confidence"] >= threshold and result["confidence"] > confidence:
+                        compare_result = result
+                        confidence = result["confidence"]
+        finally:
+            for future in pending:
+                future.cancel()
+        timing["total"] = perf_counter() - start
+        logger.debug(f"find best result in templates timing = {timing}")
+        return self.__offset_result(compare_result, offset_x, offset_y)
 
     def find_best_result_by_position(self,
                                      image1: ImageFile,
@@ -805,13 +1100,13 @@ class Images(object):
         """
         # 当position2填写的时候需要判断大小是否与position1相同
         position1 = self.__get_position(position1, is_convert)
-        image1 = self.cut_image_array(image1, position1)
+        image1 = self.__get_image_matrix(image1, position1)
         if position2:
             position2 = self.__get_position(position2, is_convert)
             self.__check_area_same(position1, position2)
-            image2 = self.cut_image_array(image2, position2)
+            image2 = self.__get_image_matrix(image2, position2)
         else:
-            image2 = self.cut_image_array(image2, position1)
+            image2 = self.__get_image_matrix(image2, position1)
         return self.find_best_result(image1, image2, threshold, rgb, FindTypeEnum.TEMPLATE)
 
     def show_images(self, image1: ImageFile, image2: ImageFile, time: float = 0.5):
@@ -7,4 +7,4 @@
 # @Created:     2021/5/1 - 23:19
 # --------------------------------------------------------
 
-VERSION = '5.3.8'
+VERSION = '5.4.0'